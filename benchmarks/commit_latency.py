@@ -0,0 +1,87 @@
+"""
+Benchmark the latency of adding a food item to an order (`Order.add_food` and the
+commit of its unit of work) for each database profile.
+
+Run from the repository root, with a `config.py` present:
+
+    python -m benchmarks.commit_latency --iterations 500
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from supperbot.db import async_session, make_engine, transactional
+from supperbot.migrations import run_migrations
+from supperbot.models import Order, SupperJio, User
+from supperbot.models.user import _seen_users
+
+from config import SQLITE_PRAGMAS
+
+# Name of the profile -> (database URL, pragmas)
+PROFILES = {
+    "memory": ("sqlite://", None),
+    "file, SQLite defaults": ("sqlite:///{path}", None),
+    "file, configured pragmas": ("sqlite:///{path}", SQLITE_PRAGMAS),
+}
+
+NUM_USERS = 20
+
+
+@transactional
+async def setup() -> int:
+    for user_id in range(NUM_USERS):
+        await User.upsert(user_id, f"User {user_id}", user_id)
+    jio = await SupperJio.create(0, "Benchmark", "Commit latency benchmark")
+    return jio.id
+
+
+@transactional
+async def add_food(jio_id: int, i: int) -> None:
+    order = await Order.create_order(jio_id=jio_id, user_id=i % NUM_USERS)
+    await order.add_food(f"Food {i}")
+
+
+async def run_profile(database: str, pragmas, iterations: int) -> list[float]:
+    engine = make_engine(database, sqlite_pragmas=pragmas)
+    async_session.configure(bind=engine)
+    # Every profile starts with an empty database
+    _seen_users.clear()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(run_migrations)
+    jio_id = await setup()
+
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        await add_food(jio_id, i)
+        timings.append(time.perf_counter() - start)
+
+    await engine.dispose()
+    return timings
+
+
+async def main(iterations: int) -> None:
+    print(f"{'Profile':<28}{'mean':>10}{'p50':>10}{'p95':>10}{'max':>10}  (ms)")
+
+    for name, (database, pragmas) in PROFILES.items():
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "benchmark.db")
+            timings = await run_profile(database.format(path=path), pragmas, iterations)
+
+        ms = sorted(t * 1000 for t in timings)
+        print(
+            f"{name:<28}{statistics.mean(ms):>10.3f}{ms[len(ms) // 2]:>10.3f}"
+            f"{ms[int(len(ms) * 0.95)]:>10.3f}{ms[-1]:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the commit latency of Order.add_food."
+    )
+    parser.add_argument("--iterations", type=int, default=200)
+    asyncio.run(main(parser.parse_args().iterations))
@@ -0,0 +1,232 @@
+"""
+Benchmark the end-to-end latency of an update, from Telegram having it to the bot's
+reply arriving at Telegram, when receiving updates by polling and through a webhook.
+
+Telegram is replaced by a stubbed Bot API served locally, and the bot only echoes each
+message back, so that only the cost of receiving updates is measured. `--delay` adds a
+simulated one-way network delay between Telegram and the bot, and `--burst` sends that
+many updates at once, as happens when many users order at the same time.
+
+Run from the repository root:
+
+    python -m benchmarks.update_latency --iterations 200 --delay 20 --burst 5
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import socket
+import statistics
+import time
+
+import httpx
+from tornado.httpserver import HTTPServer
+from tornado.web import Application as WebApplication, RequestHandler
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, ContextTypes, MessageHandler, filters
+
+TOKEN = "123456:benchmark"
+SECRET = "benchmark-secret"
+CHAT = {"id": 1, "type": "private", "first_name": "Benchmark"}
+USER = {"id": 1, "is_bot": False, "first_name": "Benchmark"}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StubBotAPI:
+    """
+    The parts of the Bot API used by the benchmark: polling for updates, setting the
+    webhook and sending messages.
+    """
+
+    def __init__(self, delay: float):
+        # The one-way network delay (in seconds) of each response
+        self.delay = delay
+        self.updates: list[dict] = []
+        self.new_updates = asyncio.Event()
+        # Text of a message sent by the bot -> future resolved when it arrives
+        self.waiting: dict[str, asyncio.Future] = {}
+        self.message_ids = itertools.count(1)
+
+    def add_update(self, update: dict) -> None:
+        self.updates.append(update)
+        self.new_updates.set()
+
+    async def call(self, method: str, params: dict[str, str]):
+        result = await self._call(method, params)
+        await asyncio.sleep(self.delay)
+        return result
+
+    async def _call(self, method: str, params: dict[str, str]):
+        if method == "getMe":
+            return {"id": 2, "is_bot": True, "first_name": "Stub", "username": "stub"}
+
+        if method in ("setWebhook", "deleteWebhook"):
+            return True
+
+        if method == "getUpdates":
+            offset = int(params.get("offset", 0))
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            if not self.updates:
+                self.new_updates.clear()
+                try:
+                    await asyncio.wait_for(
+                        self.new_updates.wait(), int(params.get("timeout", 0))
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            return self.updates
+
+        if method == "sendMessage":
+            future = self.waiting.pop(params["text"], None)
+            if future is not None:
+                future.set_result(time.perf_counter())
+            return {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": CHAT,
+                "text": params["text"],
+            }
+
+        raise ValueError(f"Unexpected method {method}")
+
+    def release(self) -> None:
+        """
+        Answer any pending long polls, so that the stub can be stopped.
+        """
+        self.new_updates.set()
+
+    def web_application(self) -> WebApplication:
+        stub = self
+
+        class Handler(RequestHandler):
+            async def post(self, method: str):
+                params = {
+                    name: self.get_body_argument(name)
+                    for name in self.request.body_arguments
+                }
+                result = await stub.call(method, params)
+                self.write({"ok": True, "result": result})
+
+        return WebApplication([(r"/bot[^/]+/(\w+)", Handler)])
+
+
+async def echo(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.effective_chat.send_message(update.message.text)
+
+
+def _update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": CHAT,
+            "from": USER,
+            "text": f"Update {update_id}",
+        },
+    }
+
+
+async def deliver(
+    mode: str, stub: StubBotAPI, client: httpx.AsyncClient, url: str, update: dict
+) -> None:
+    if mode == "polling":
+        stub.add_update(update)
+        return
+
+    await asyncio.sleep(stub.delay)
+    await client.post(
+        url,
+        content=json.dumps(update),
+        headers={
+            "Content-Type": "application/json",
+            "X-Telegram-Bot-Api-Secret-Token": SECRET,
+        },
+    )
+
+
+async def run_mode(mode: str, iterations: int, delay: float, burst: int) -> list[float]:
+    stub = StubBotAPI(delay)
+    stub_port = _free_port()
+    stub_server = HTTPServer(stub.web_application())
+    stub_server.listen(stub_port, "127.0.0.1")
+
+    application = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(f"http://127.0.0.1:{stub_port}/bot")
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.TEXT, echo))
+
+    webhook_port = _free_port()
+    timings = []
+
+    async with application, httpx.AsyncClient() as client:
+        await application.start()
+        if mode == "polling":
+            await application.updater.start_polling(timeout=10)
+        else:
+            await application.updater.start_webhook(
+                port=webhook_port,
+                url_path="webhook",
+                webhook_url=f"http://127.0.0.1:{webhook_port}/webhook",
+                secret_token=SECRET,
+            )
+
+        webhook_url = f"http://127.0.0.1:{webhook_port}/webhook"
+        update_ids = itertools.count(1)
+        for _ in range(iterations):
+            updates = [_update(next(update_ids)) for _ in range(burst)]
+            arrivals = []
+            for update in updates:
+                arrived = asyncio.get_running_loop().create_future()
+                stub.waiting[update["message"]["text"]] = arrived
+                arrivals.append(arrived)
+
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(deliver(mode, stub, client, webhook_url, u) for u in updates)
+            )
+            for arrived in await asyncio.gather(*arrivals):
+                timings.append(arrived - start)
+
+        await application.updater.stop()
+        await application.stop()
+
+    stub.release()
+    await asyncio.sleep(delay)
+    stub_server.stop()
+    return timings
+
+
+async def main(iterations: int, delay: float, burst: int) -> None:
+    print(f"{'Mode':<12}{'mean':>10}{'p50':>10}{'p95':>10}{'max':>10}  (ms)")
+
+    for mode in ("polling", "webhook"):
+        ms = sorted(t * 1000 for t in await run_mode(mode, iterations, delay, burst))
+        print(
+            f"{mode:<12}{statistics.mean(ms):>10.3f}{ms[len(ms) // 2]:>10.3f}"
+            f"{ms[int(len(ms) * 0.95)]:>10.3f}{ms[-1]:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the update latency of polling and webhook mode."
+    )
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument(
+        "--delay", type=float, default=0, help="One-way network delay in ms."
+    )
+    parser.add_argument(
+        "--burst", type=int, default=1, help="Number of updates sent at once."
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations, args.delay / 1000, args.burst))
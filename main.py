@@ -1,10 +1,13 @@
 from datetime import datetime
 import logging
 import os
+import secrets
 
-from supperbot.bot import application
+from supperbot.bot import ALLOWED_UPDATES, application
 
-from config import LOGGING_LEVEL, LOCAL
+from config import LOGGING_LEVEL, LOCAL, PORT, URL, WEBHOOK_PATH, WEBHOOK_SECRET
+
+DEFAULT_PORT = 8443
 
 
 def main():
@@ -25,7 +28,24 @@ def main():
     )
     logging.info("Hello world, initializing bot!")
 
-    application.run_polling()
+    if URL is None:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
+        return
+
+    # Telegram sends the secret with every update, and the webhook rejects requests
+    # without it. A random secret works just as well, as the webhook is set on start.
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    # Configs created from an older `defaultconfig.py` set PORT to None
+    port = int(os.environ.get("PORT") or PORT or DEFAULT_PORT)
+    logging.info(f"Receiving updates through the webhook at {URL} on port {port}")
+    application.run_webhook(
+        listen="0.0.0.0",
+        port=port,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{URL.rstrip('/')}/{WEBHOOK_PATH}",
+        allowed_updates=ALLOWED_UPDATES,
+        secret_token=secret,
+    )
 
 
 if __name__ == "__main__":
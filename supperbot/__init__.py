@@ -0,0 +1,8 @@
+import config
+import defaultconfig
+
+# Settings added after a `config.py` was created take their values from
+# `defaultconfig.py`, so that existing configs keep working.
+for _name in dir(defaultconfig):
+    if _name.isupper() and not hasattr(config, _name):
+        setattr(config, _name, getattr(defaultconfig, _name))
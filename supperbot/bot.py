@@ -1,3 +1,4 @@
+from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
     CallbackQueryHandler,
@@ -45,21 +46,106 @@ from supperbot.commands.payment import ping_unpaid_users, declare_payment, undo_
 from supperbot.commands.menu import (
     view_created_jios,
     view_joined_jios,
+    view_archived_created_jios,
+    view_archived_joined_jios,
+    view_archived_jio,
     cancel_view,
     view_favourites,
     view_restaurant_favourites,
     main_menu_confirm_favourite_action,
     main_menu_confirm_delete_fav_item,
 )
-from supperbot.commands.misc import unrecognized_callback, set_commands
+from supperbot.commands.misc import (
+    unrecognized_callback,
+    set_commands,
+    archive_jios,
+    error_handler,
+    log_metrics,
+)
 
+from supperbot.db import engine
+from supperbot.deadletters import dead_letter_tracker
+from supperbot.edits import forget_callback_message
 from supperbot.enums import CallbackType
+from supperbot.locks import SerializedApplication
+from supperbot.migrations import migrate
+from supperbot.persistence import SQLPersistence
+from supperbot.ratelimiter import ChatAwareRateLimiter
+from supperbot.transport import PooledHTTPXRequest
+
+from config import (
+    ARCHIVE_INTERVAL,
+    HTTP2,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_POOL_SIZE,
+    HTTP_POOL_TIMEOUT,
+    HTTP_TIMEOUT,
+    METRICS_LOG_INTERVAL,
+    PENDING_UPDATES,
+    PERSISTENCE_INTERVAL,
+    RATE_LIMIT_GROUP,
+    RATE_LIMIT_MAX_RETRIES,
+    RATE_LIMIT_OVERALL,
+    RATE_LIMIT_PRIVATE,
+    REQUEST_CONCURRENCY,
+    TOKEN,
+)
+
 
-from config import TOKEN
+# The types of updates handled by the bot, so that Telegram does not send any others
+ALLOWED_UPDATES = [
+    Update.MESSAGE,
+    Update.CALLBACK_QUERY,
+    Update.INLINE_QUERY,
+    Update.CHOSEN_INLINE_RESULT,
+]
+
+
+def make_request(name: str, connection_pool_size: int) -> PooledHTTPXRequest:
+    return PooledHTTPXRequest(
+        name,
+        connection_pool_size=connection_pool_size,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        http2=HTTP2,
+        timeout=HTTP_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+    )
 
 
-application = ApplicationBuilder().concurrent_updates(False).token(TOKEN).build()
+async def post_init(_) -> None:
+    await migrate()
+    await dead_letter_tracker.load()
+
+
+application = (
+    ApplicationBuilder()
+    .application_class(SerializedApplication)
+    .concurrent_updates(PENDING_UPDATES)
+    .token(TOKEN)
+    .request(make_request("bot", HTTP_POOL_SIZE))
+    # Long polling holds its connection for the whole poll, so it gets its own
+    .get_updates_request(make_request("get_updates", 1))
+    .persistence(SQLPersistence(engine, update_interval=PERSISTENCE_INTERVAL))
+    .rate_limiter(
+        ChatAwareRateLimiter(
+            overall=RATE_LIMIT_OVERALL,
+            group=RATE_LIMIT_GROUP,
+            private=RATE_LIMIT_PRIVATE,
+            max_retries=RATE_LIMIT_MAX_RETRIES,
+            concurrency=REQUEST_CONCURRENCY,
+        )
+    )
+    .post_init(post_init)
+    .build()
+)
 application.job_queue.run_once(set_commands, 0)
+application.job_queue.run_repeating(archive_jios, ARCHIVE_INTERVAL, first=60)
+application.job_queue.run_repeating(
+    log_metrics, METRICS_LOG_INTERVAL, first=METRICS_LOG_INTERVAL
+)
+
+# Runs before the other handlers, which may edit the message of the callback query
+application.add_handler(CallbackQueryHandler(forget_callback_message), group=-1)
 
 application.add_handler(
     CommandHandler("start", start_group, ~filters.ChatType.PRIVATE), group=1
@@ -80,6 +166,8 @@ create_jio_conv_handler = ConversationHandler(
         ],
     },
     fallbacks=[create_jio_handler],
+    name="create_jio",
+    persistent=True,
 )
 application.add_handler(create_jio_conv_handler)
 
@@ -101,6 +189,8 @@ amend_description_conv_handler = ConversationHandler(
             cancel_amend_description, pattern=CallbackType.CANCEL_AMEND_DESCRIPTION
         ),
     ],
+    name="amend_description",
+    persistent=True,
 )
 application.add_handler(amend_description_conv_handler)
 application.add_handler(
@@ -130,6 +220,8 @@ add_order_conv_handler = ConversationHandler(
     },
     # Allow users to press "add order" again, otherwise it will not trigger this handler
     fallbacks=[add_order_handler],
+    name="add_order",
+    persistent=True,
 )
 application.add_handler(add_order_conv_handler)
 application.add_handler(
@@ -213,6 +305,8 @@ broadcast_conv_handler = ConversationHandler(
         broadcast_handler,
         CallbackQueryHandler(end_broadcast, pattern=CallbackType.BROADCAST_END),
     ],
+    name="broadcast",
+    persistent=True,
 )
 application.add_handler(broadcast_conv_handler)
 
@@ -229,6 +323,21 @@ application.add_handler(
     CallbackQueryHandler(cancel_view, pattern=CallbackType.CANCEL_VIEW)
 )
 
+# View archived jios
+application.add_handler(
+    CallbackQueryHandler(
+        view_archived_created_jios, pattern=CallbackType.VIEW_ARCHIVED_CREATED_JIOS
+    )
+)
+application.add_handler(
+    CallbackQueryHandler(
+        view_archived_joined_jios, pattern=CallbackType.VIEW_ARCHIVED_JOINED_JIOS
+    )
+)
+application.add_handler(
+    CallbackQueryHandler(view_archived_jio, pattern=CallbackType.VIEW_ARCHIVED_JIO)
+)
+
 # Viewing favourites
 application.add_handler(
     CallbackQueryHandler(view_favourites, pattern=CallbackType.MAIN_MENU_FAVOURITES)
@@ -260,3 +369,5 @@ application.add_handler(
 
 # Unrecognized callbacks
 application.add_handler(CallbackQueryHandler(unrecognized_callback))
+
+application.add_error_handler(error_handler)
@@ -0,0 +1,111 @@
+"""
+A read-through cache of jio snapshots, so that callbacks which only render a jio do
+not have to load it from the database every time.
+
+Whenever a jio or one of its orders is changed, its cached snapshot is discarded and,
+if the jio is being loaded, its version is bumped. A snapshot is only cached if the
+version of its jio did not change while it was being loaded, so a concurrent change
+can never be overwritten by a stale snapshot. As changes only become visible to other
+sessions once committed, the version is bumped both when the change is made and when
+its unit of work ends. Versions are only kept while the jio is being loaded.
+"""
+from __future__ import annotations
+
+import time
+from collections import Counter
+from typing import Awaitable, Callable, TYPE_CHECKING
+
+from cachetools import LRUCache
+
+from config import JIO_CACHE_SIZE, JIO_CACHE_CLOSED_TTL
+from supperbot import metrics
+from supperbot.db import after_transaction
+
+if TYPE_CHECKING:
+    from supperbot.models import JioSnapshot
+
+
+class JioCache:
+    def __init__(self, maxsize: int, closed_ttl: float):
+        """
+        :param maxsize: The maximum number of jios cached. The least recently used
+                        jio is evicted when the cache is full.
+        :param closed_ttl: The time (in seconds) after which a cached closed jio is
+                           evicted, as closed jios are rarely viewed again.
+        """
+        # Jio id -> (time cached, snapshot)
+        self._snapshots: LRUCache[int, tuple[float, JioSnapshot]] = LRUCache(maxsize)
+        # The number of loads in progress, and the versions of the jios being loaded
+        self._loading: Counter[int] = Counter()
+        self._versions: dict[int, int] = {}
+        self.closed_ttl = closed_ttl
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def _is_expired(self, cached_at: float, snapshot: JioSnapshot) -> bool:
+        return snapshot.is_closed() and time.monotonic() - cached_at > self.closed_ttl
+
+    async def get(
+        self, jio_id: int, load: Callable[[], Awaitable[JioSnapshot]]
+    ) -> JioSnapshot:
+        """
+        Returns the cached snapshot of the jio, or loads (and caches) it with `load`.
+        """
+        entry = self._snapshots.get(jio_id)
+
+        if entry is not None:
+            cached_at, snapshot = entry
+            if not self._is_expired(cached_at, snapshot):
+                metrics.increment("jio_cache.hit")
+                return snapshot
+            del self._snapshots[jio_id]
+
+        metrics.increment("jio_cache.miss")
+        version = self._versions.get(jio_id, 0)
+        self._loading[jio_id] += 1
+        try:
+            snapshot = await load()
+        finally:
+            unchanged = self._versions.get(jio_id, 0) == version
+            self._loading[jio_id] -= 1
+            if not self._loading[jio_id]:
+                del self._loading[jio_id]
+                self._versions.pop(jio_id, None)
+
+        if unchanged:
+            if len(self._snapshots) >= self._snapshots.maxsize:
+                # Prefer evicting closed jios over the least recently used open jio
+                self.evict_expired()
+            self._snapshots[jio_id] = (time.monotonic(), snapshot)
+
+        return snapshot
+
+    def invalidate(self, jio_id: int) -> None:
+        """
+        Bump the version of the jio, now and again at the end of the current unit of
+        work, discarding its cached snapshot.
+        """
+        self._bump(jio_id)
+        after_transaction(lambda: self._bump(jio_id))
+
+    def _bump(self, jio_id: int) -> None:
+        if jio_id in self._loading:
+            self._versions[jio_id] = self._versions.get(jio_id, 0) + 1
+        self._snapshots.pop(jio_id, None)
+
+    def evict_expired(self) -> None:
+        """
+        Evict all closed jios which have been cached for longer than the TTL.
+        """
+        expired = [
+            jio_id
+            for jio_id, (cached_at, snapshot) in self._snapshots.items()
+            if self._is_expired(cached_at, snapshot)
+        ]
+        for jio_id in expired:
+            del self._snapshots[jio_id]
+        metrics.increment("jio_cache.expired", len(expired))
+
+
+jio_cache = JioCache(JIO_CACHE_SIZE, JIO_CACHE_CLOSED_TTL)
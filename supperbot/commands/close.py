@@ -1,67 +1,81 @@
 """
 Coroutines for when the supper host decides to close a supper jio
 """
-from collections import Counter
-from dataclasses import dataclass, field
+from __future__ import annotations
+
+import asyncio
+from dataclasses import asdict, dataclass, field
+from functools import partial
 import logging
 
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, Message
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.constants import ParseMode
-from telegram.error import BadRequest
-from telegram.ext import ContextTypes, ConversationHandler
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import CallbackContext, ContextTypes, ConversationHandler
 
 from supperbot.checks import delayed_cooldown
 from supperbot.commands.send import resend_main_message
+from supperbot.db import transactional
+from supperbot.edits import edit_tracker, message_key
 from supperbot.enums import parse_callback_data, join, CallbackType, Stage
-from supperbot.models import SupperJio
+from supperbot.fanout import Target, TargetResult, fan_out
+from supperbot.locks import callback_jio_id, locks_jio
+from supperbot.models import SupperJio, OrderItem
+from supperbot.priority import Priority
+
+from config import BROADCAST_PROGRESS_INTERVAL
 
 
-# TODO: Rate limit this function
+@locks_jio(callback_jio_id)
+@transactional
 async def close_jio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     jio_id = int(parse_callback_data(query.data)[1])
-    jio = SupperJio.get_jio(jio_id)
+    jio = await SupperJio.get_jio(jio_id)
 
     if jio.is_closed():
         await query.answer("Jio is already closed.")
         return
 
     jio.update(status=Stage.CLOSED)
-    await jio.update_all_jio_messages(context.bot)
+    report = await jio.snapshot().update_all_jio_messages(context.bot)
+    logging.info(f"Closed jio {jio_id}, updated messages: {report}")
     await query.answer("Jio has been closed!")
 
 
-# TODO: Rate limit this
+@locks_jio(callback_jio_id)
+@transactional
 async def reopen_jio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     jio_id = int(parse_callback_data(query.data)[1])
-    jio = SupperJio.get_jio(jio_id)
+    jio = await SupperJio.get_jio(jio_id)
 
     if not jio.is_closed():
         await query.answer("Jio is already opened.")
         return
 
     jio.update(status=Stage.CREATED)
-    await jio.update_all_jio_messages(context.bot)
+    report = await jio.snapshot().update_all_jio_messages(context.bot)
+    logging.info(f"Reopened jio {jio_id}, updated messages: {report}")
     await query.answer("Jio has been opened!")
 
 
+@transactional
 async def create_ordering_list(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     jio_id = int(parse_callback_data(query.data)[1])
-    jio = SupperJio.get_jio(jio_id)
 
-    counter = Counter()
-    for order in jio.orders:
-        # Reduce to lower case so that we can match similar orders
-
-        # TODO: Create a way to combine two different orders together for convenience
-        #       eg so can combine "m fries" and "medium fries" together
-        counter.update(map(str.lower, order.food_list))
+    # Food items are normalized (eg. to lower case) so that we can match similar orders
+    # TODO: Create a way to combine two different orders together for convenience
+    #       eg so can combine "m fries" and "medium fries" together
+    counts = await OrderItem.count_by_food(jio_id)
+    jio = await SupperJio.get_snapshot(jio_id)
 
     text = "Orders:\n\n"
 
-    text += "\n".join(f"{k}: {v}" for k, v in counter.items())
+    text += "\n".join(f"{k}: {v}" for k, v in counts)
+
+    text += f"\n\nTotal: {jio.item_count} item(s) from {jio.ordered_count} people"
 
     keyboard = InlineKeyboardMarkup.from_button(
         InlineKeyboardButton("Back", callback_data=join(CallbackType.BACK, str(jio_id)))
@@ -71,13 +85,13 @@ async def create_ordering_list(update: Update, _: ContextTypes.DEFAULT_TYPE) ->
     await query.answer()
 
 
+@transactional
 async def back(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     jio_id = int(parse_callback_data(query.data)[1])
-    jio = SupperJio.get_jio(jio_id)
+    jio = await SupperJio.get_snapshot(jio_id)
 
-    if BroadcastInformation in context.user_data:
-        context.user_data.pop(BroadcastInformation)
+    context.user_data.pop(BroadcastInformation.KEY, None)
 
     await jio.update_main_jio_message(context.bot)
     await query.answer()
@@ -88,11 +102,24 @@ async def back(update: Update, context: ContextTypes.DEFAULT_TYPE):
 class BroadcastInformation:
     """
     Helper class to consolidate the information required to broadcast a message.
+
+    As user_data is persisted, only the ids of the messages are kept, and the
+    information is stored in user_data as a dictionary under `KEY`.
     """
 
+    KEY = "broadcast"
+
     jio_id: int
-    broadcast_request_message: Message
-    to_forward: Message = field(default=None)
+    chat_id: int
+    broadcast_request_message_id: int
+    to_forward_message_id: int | None = field(default=None)
+
+    @staticmethod
+    def load(context: ContextTypes.DEFAULT_TYPE) -> BroadcastInformation:
+        return BroadcastInformation(**context.user_data[BroadcastInformation.KEY])
+
+    def save(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        context.user_data[BroadcastInformation.KEY] = asdict(self)
 
 
 @delayed_cooldown(2, 60)
@@ -111,9 +138,9 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     )
 
-    context.user_data[BroadcastInformation] = BroadcastInformation(
-        jio_id, update.effective_message
-    )
+    BroadcastInformation(
+        jio_id, update.effective_chat.id, update.effective_message.message_id
+    ).save(context)
 
     await update.effective_message.edit_text(
         text, reply_markup=keyboard, parse_mode=ParseMode.HTML
@@ -123,9 +150,14 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    broadcast_info: BroadcastInformation = context.user_data[BroadcastInformation]
+    broadcast_info = BroadcastInformation.load(context)
+    edit_tracker.forget(
+        message_key(broadcast_info.chat_id, broadcast_info.broadcast_request_message_id)
+    )
     try:
-        await broadcast_info.broadcast_request_message.edit_reply_markup(None)
+        await context.bot.edit_message_reply_markup(
+            broadcast_info.chat_id, broadcast_info.broadcast_request_message_id
+        )
     except BadRequest as e:
         logging.error(f"Unable to edit broadcast message: {e}")
 
@@ -133,7 +165,8 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Are you sure this message should be sent to <b>everyone who has yet to pay</b>"
         "? This feature can only be used <b>twice a minute</b>."
     )
-    broadcast_info.to_forward = update.effective_message
+    broadcast_info.to_forward_message_id = update.effective_message.message_id
+    broadcast_info.save(context)
     jio_str = str(broadcast_info.jio_id)
 
     keyboard = InlineKeyboardMarkup.from_column(
@@ -152,37 +185,102 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CallbackType.CONFIRM_SEND
 
 
+@transactional
 async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     assert broadcast.uses_remaining(update.effective_user.id) > 0
 
     broadcast.add_cooldown(update.effective_user.id)
-    broadcast_info: BroadcastInformation = context.user_data[BroadcastInformation]
-    jio = SupperJio.get_jio(broadcast_info.jio_id)
+    broadcast_info = BroadcastInformation.load(context)
+    jio = await SupperJio.get_snapshot(broadcast_info.jio_id)
 
     assert jio.owner_id == update.effective_user.id
 
-    sent = []
-    paid = []
-    error = []
+    recipients = [
+        (order.chat_id, order.display_name)
+        for order in jio.orders
+        if order.food_list and not order.has_paid()
+    ]
+    paid = [o.display_name for o in jio.orders if o.food_list and o.has_paid()]
+
+    progress = await update.effective_chat.send_message(
+        f"Sending broadcast... (0/{len(recipients)})"
+    )
 
-    for order in jio.orders:
-        if order.food:
-            if order.has_paid():
-                paid.append(order.user.display_name)
+    # Forwarding to many users can take a while, so it is done in the background and
+    # the host can continue using the bot in the meantime
+    context.job_queue.run_once(
+        run_broadcast,
+        0,
+        data={
+            "jio_id": jio.id,
+            "from_chat_id": broadcast_info.chat_id,
+            "message_id": broadcast_info.to_forward_message_id,
+            "progress_message_id": progress.message_id,
+            "recipients": recipients,
+            "paid": paid,
+        },
+        name=f"broadcast {jio.id}",
+    )
+
+    return await end_broadcast(update, context)
+
+
+async def run_broadcast(context: CallbackContext) -> None:
+    """
+    Job forwarding the host's broadcast to every user who has yet to pay, which edits
+    the progress message every `BROADCAST_PROGRESS_INTERVAL` seconds as it goes and
+    finally replaces it with a summary.
+    """
+    data = context.job.data
+    bot = context.bot
+    chat_id, message_id = data["from_chat_id"], data["message_id"]
+    progress_message_id = data["progress_message_id"]
+    recipients = data["recipients"]
+    done = 0
+
+    async def report_progress() -> None:
+        reported = 0
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            if done == reported:
                 continue
 
+            reported = done
             try:
-                await broadcast_info.to_forward.forward(order.user.chat_id)
-                sent.append(order.user.display_name)
-            except BadRequest as e:
-                error.append(order.user.display_name)
-                logging.error(f"Unable to forward message for jio {jio.id}: {e}")
+                await bot.edit_message_text(
+                    f"Sending broadcast... ({done}/{len(recipients)})",
+                    chat_id,
+                    progress_message_id,
+                )
+            except TelegramError as e:
+                logging.error(f"Unable to update broadcast progress: {e}")
+
+    def on_result(_: TargetResult) -> None:
+        nonlocal done
+        done += 1
+
+    targets = [
+        Target(
+            name,
+            partial(bot.forward_message, recipient_chat_id, chat_id, message_id),
+            priority=Priority.BULK,
+        )
+        for recipient_chat_id, name in recipients
+    ]
+    progress = asyncio.create_task(report_progress())
+    try:
+        report = await fan_out(targets, on_result=on_result)
+    finally:
+        progress.cancel()
+    logging.info(f"Broadcast for jio {data['jio_id']}: {report}")
 
+    sent = [result.target for result in report.results if result.ok]
+    error = [result.target for result in report.errors]
     text = (
         "Sent to these people:\n"
         + ("\n".join(sent) or "None")
         + "\n\nThese people have already paid:\n"
-        + ("\n".join(paid) or "None")
+        + ("\n".join(data["paid"]) or "None")
     )
 
     if error:
@@ -191,13 +289,14 @@ async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "manually:\n " + ("\n".join(error) or "None")
         )
 
-    await update.effective_chat.send_message(text)
-
-    return await end_broadcast(update, context)
+    try:
+        await bot.edit_message_text(text, chat_id, progress_message_id)
+    except TelegramError as e:
+        logging.error(f"Unable to edit broadcast progress, sending summary: {e}")
+        await bot.send_message(chat_id, text)
 
 
 async def end_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await resend_main_message(update, context)
-    if BroadcastInformation in context.user_data:
-        context.user_data.pop(BroadcastInformation)
+    context.user_data.pop(BroadcastInformation.KEY, None)
     return ConversationHandler.END
@@ -13,7 +13,9 @@ from telegram.constants import ParseMode
 from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler
 
+from supperbot.db import transactional
 from supperbot.enums import CallbackType, parse_callback_data
+from supperbot.locks import locks_jio
 from supperbot.models import SupperJio
 
 
@@ -77,16 +79,20 @@ async def additional_details(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return CallbackType.FINISHED_CREATION
 
 
+@transactional
 async def finished_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Presents the final jio text after finishing the initialisation process."""
 
     information = update.message.text
-    jio = SupperJio.create(
+    jio = await SupperJio.create(
         update.effective_user.id, context.user_data["restaurant"], information
     )
 
+    snapshot = jio.snapshot()
     msg = await update.effective_chat.send_message(
-        text=jio.message, reply_markup=jio.keyboard_markup, parse_mode=ParseMode.HTML
+        text=snapshot.message,
+        reply_markup=snapshot.keyboard_markup,
+        parse_mode=ParseMode.HTML,
     )
     jio.update(chat_id=msg.chat_id, message_id=msg.message_id)
 
@@ -95,11 +101,13 @@ async def finished_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+@transactional
 async def amend_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # TODO: Prevent amending description too often
     query = update.callback_query
     jio_id = int(parse_callback_data(query.data)[1])
-    jio = context.user_data["jio"] = SupperJio.get_jio(jio_id)
+    jio = await SupperJio.get_jio(jio_id)
+    context.user_data["jio_id"] = jio_id
 
     # Try removing the markup
     try:
@@ -124,49 +132,62 @@ async def amend_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ),
         parse_mode=ParseMode.HTML,
     )
-    context.user_data["amend_msg"] = msg
+    # Only the ids are kept, as user_data is persisted
+    context.user_data["amend_msg"] = [msg.chat_id, msg.message_id]
 
     await query.answer()
     return CallbackType.FINISH_AMEND_DESCRIPTION
 
 
+@locks_jio(lambda _, context: context.user_data.get("jio_id"))
+@transactional
 async def finish_amend_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
     information = update.message.text
-    jio: SupperJio = context.user_data.pop("jio")
+    jio = await SupperJio.get_jio(context.user_data.pop("jio_id"))
     jio.update(description=information)
 
     try:
         # Remove the "cancel" button from the previous message
-        await context.user_data["amend_msg"].edit_reply_markup(None)
+        chat_id, message_id = context.user_data["amend_msg"]
+        await context.bot.edit_message_reply_markup(chat_id, message_id)
     except BadRequest as e:
         logging.error(f"Unable to edit amend message for jio {jio}: {e}")
     finally:
         del context.user_data["amend_msg"]
 
     # Update all messages related to the supper jio
+    snapshot = jio.snapshot()
     msg = await update.effective_chat.send_message(
-        text=jio.message, reply_markup=jio.keyboard_markup, parse_mode=ParseMode.HTML
+        text=snapshot.message,
+        reply_markup=snapshot.keyboard_markup,
+        parse_mode=ParseMode.HTML,
     )
     jio.update(chat_id=msg.chat_id, message_id=msg.message_id)
-    await jio.update_individual_order_messages(context.bot)
-    await jio.update_shared_jio_messages(context.bot)
+    await snapshot.update_individual_order_messages(context.bot)
+    await snapshot.update_shared_jio_messages(context.bot)
 
     return ConversationHandler.END
 
 
+@locks_jio(lambda _, context: context.user_data.get("jio_id"))
+@transactional
 async def cancel_amend_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    jio: SupperJio = context.user_data.pop("jio")
+    jio = await SupperJio.get_jio(context.user_data.pop("jio_id"))
 
     try:
         # Remove the "cancel" button from the previous message
-        await context.user_data["amend_msg"].edit_reply_markup(None)
+        chat_id, message_id = context.user_data["amend_msg"]
+        await context.bot.edit_message_reply_markup(chat_id, message_id)
     except BadRequest as e:
         logging.error(f"Unable to edit amend message for jio {jio}: {e}")
     finally:
         del context.user_data["amend_msg"]
 
+    snapshot = jio.snapshot()
     msg = await update.effective_chat.send_message(
-        text=jio.message, reply_markup=jio.keyboard_markup, parse_mode=ParseMode.HTML
+        text=snapshot.message,
+        reply_markup=snapshot.keyboard_markup,
+        parse_mode=ParseMode.HTML,
     )
     jio.update(chat_id=msg.chat_id, message_id=msg.message_id)
 
@@ -1,14 +1,116 @@
+from __future__ import annotations
+
+from datetime import datetime
 import logging
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.constants import InlineKeyboardMarkupLimit, ParseMode
+from telegram.constants import ParseMode
 from telegram.error import BadRequest
 
 from supperbot.commands.start import start
+from supperbot.db import transactional
 from supperbot.enums import CallbackType, join, parse_callback_data
-from supperbot.models import User, FavouriteOrder
+from supperbot.models import ArchivedJio, User, FavouriteOrder, SupperJio
+from supperbot.models.user import JioCursor
+
+
+# Number of jios shown on each page of the created and joined jios lists
+JIOS_PER_PAGE = 10
+
+# Paging direction in the callback data of the created and joined jios lists
+_OLDER = "n"
+_NEWER = "p"
+_CURSOR_FORMAT = "%Y%m%d%H%M%S%f"
+
+
+def _parse_page(callback_data: str) -> tuple[JioCursor | None, JioCursor | None]:
+    """
+    Obtain the `before` and `after` cursors from the callback data of a jio list.
+
+    The callback data is of the format `callback_type[:direction:timestamp:jio_id]`.
+    """
+    args = parse_callback_data(callback_data)[1:]
+    if not args:
+        return None, None
+
+    direction, timestamp, jio_id = args
+    cursor = (datetime.strptime(timestamp, _CURSOR_FORMAT), int(jio_id))
+    return (cursor, None) if direction == _OLDER else (None, cursor)
+
+
+def _page_callback_data(
+    callback_type: CallbackType, direction: str, jio: SupperJio | ArchivedJio
+) -> str:
+    timestamp = jio.timestamp.strftime(_CURSOR_FORMAT)
+    return join(callback_type, direction, timestamp, str(jio.id))
+
+
+async def _send_jio_page(
+    update: Update,
+    jios: list[SupperJio] | list[ArchivedJio],
+    *,
+    text: str,
+    list_type: CallbackType,
+    jio_callback_type: CallbackType,
+    before: JioCursor | None,
+    after: JioCursor | None,
+    archive_list_type: CallbackType | None = None,
+) -> None:
+    """
+    Send (or edit in, when paging) a page of jios. `jios` should contain one jio more
+    than `JIOS_PER_PAGE` if there are further jios in the paging direction.
+
+    If `archive_list_type` is provided, the last page links to the archived jios.
+    """
+    if after is not None:
+        # Paging towards newer jios. The extra jio is the newest one.
+        has_newer, has_older = len(jios) > JIOS_PER_PAGE, True
+        jios = jios[-JIOS_PER_PAGE:]
+    else:
+        has_newer, has_older = before is not None, len(jios) > JIOS_PER_PAGE
+        jios = jios[:JIOS_PER_PAGE]
+
+    navigation = []
+    if has_newer:
+        navigation.append(
+            InlineKeyboardButton(
+                "⬅ Newer",
+                callback_data=_page_callback_data(list_type, _NEWER, jios[0]),
+            )
+        )
+    if has_older:
+        navigation.append(
+            InlineKeyboardButton(
+                "Older ➡",
+                callback_data=_page_callback_data(list_type, _OLDER, jios[-1]),
+            )
+        )
+    elif archive_list_type is not None:
+        navigation.append(
+            InlineKeyboardButton("📦 Archived Jios", callback_data=archive_list_type)
+        )
 
+    keyboard = InlineKeyboardMarkup(
+        [[InlineKeyboardButton("↩ Cancel", callback_data=CallbackType.CANCEL_VIEW)]]
+        # Use a list comprehension to generate the rest of the buttons
+        + [
+            [
+                InlineKeyboardButton(
+                    str(jio), callback_data=join(jio_callback_type, str(jio.id))
+                )
+            ]
+            for jio in jios
+        ]
+        + ([navigation] if navigation else [])
+    )
 
+    if before is None and after is None:
+        await update.effective_chat.send_message(text, reply_markup=keyboard)
+    else:
+        await update.effective_message.edit_text(text, reply_markup=keyboard)
+
+
+@transactional
 async def view_created_jios(update: Update, _) -> None:
     """
     Present to the user a list of Supper Jios that they have created.
@@ -17,40 +119,31 @@ async def view_created_jios(update: Update, _) -> None:
     """
 
     query = update.callback_query
-    user = User.get_user(update.effective_user.id)
-
-    # TODO: Create a next page functionality for the buttons so that more can be viewed
-    # Telegram has a limitation on how many buttons there can be. Currently, it's 100.
-    # However, 100 buttons is still too many. Right now the limit is 50.
-    jios = user.get_created_jios(
-        limit=min(50, InlineKeyboardMarkupLimit.TOTAL_BUTTON_NUMBER - 1),
-        allow_closed=True,
+    user = await User.get_user(update.effective_user.id)
+
+    before, after = _parse_page(query.data)
+    jios = await user.get_created_jios(
+        limit=JIOS_PER_PAGE + 1, allow_closed=True, before=before, after=after
     )
 
     if not jios:
-        # User has not created any jios
-        await update.effective_chat.send_message(text="You have not created any jios.")
+        # User has not created any jios, other than those which have been archived
+        await _send_archived_jio_page(
+            update, user, joined=False, empty_text="You have not created any jios."
+        )
         await query.answer()
         return
 
-    text = (
-        "Which of your jios do you want to view?\n"
-        "Only the most recent 50 jios can be viewed."
+    await _send_jio_page(
+        update,
+        jios,
+        text="Which of your jios do you want to view?",
+        list_type=CallbackType.VIEW_CREATED_JIOS,
+        jio_callback_type=CallbackType.RESEND_MAIN_MESSAGE,
+        before=before,
+        after=after,
+        archive_list_type=CallbackType.VIEW_ARCHIVED_CREATED_JIOS,
     )
-
-    keyboard = InlineKeyboardMarkup.from_column(
-        [InlineKeyboardButton("↩ Cancel", callback_data=CallbackType.CANCEL_VIEW)]
-        # Use a list comprehension to generate the rest of the buttons
-        + [
-            InlineKeyboardButton(
-                str(jio),
-                callback_data=join(CallbackType.RESEND_MAIN_MESSAGE, str(jio.id)),
-            )
-            for jio in jios
-        ]
-    )
-
-    await update.effective_chat.send_message(text, reply_markup=keyboard)
     await query.answer()
 
 
@@ -64,6 +157,7 @@ async def cancel_view(update: Update, _) -> None:
     await start(update, _)
 
 
+@transactional
 async def view_joined_jios(update: Update, _) -> None:
     """
     Present to the user a list of Supper Jios that they have participated in.
@@ -72,45 +166,131 @@ async def view_joined_jios(update: Update, _) -> None:
     """
 
     query = update.callback_query
-    user = User.get_user(update.effective_user.id)
+    user = await User.get_user(update.effective_user.id)
 
-    # TODO: Create a next page functionality for the buttons so that more can be viewed
-    # Telegram has a limitation on how many buttons there can be. Currently, it's 100.
-    # However, 100 buttons is still too many. Right now the limit is 50.
     # TODO: Maybe consider only showing orders that the user has ordered something?
-    jios = user.get_joined_jios(
-        limit=min(50, InlineKeyboardMarkupLimit.TOTAL_BUTTON_NUMBER - 1),
+    before, after = _parse_page(query.data)
+    jios = await user.get_joined_jios(
+        limit=JIOS_PER_PAGE + 1, before=before, after=after
     )
 
     if not jios:
-        # User has not created any jios
-        await update.effective_chat.send_message(text="You have not joined any jios.")
+        # User has not joined any jios, other than those which have been archived
+        await _send_archived_jio_page(
+            update, user, joined=True, empty_text="You have not joined any jios."
+        )
         await query.answer()
         return
 
-    text = (
-        "Which of the jios do you want to view?\n"
-        "Only the most recent 50 jios can be viewed."
+    await _send_jio_page(
+        update,
+        jios,
+        text="Which of the jios do you want to view?",
+        list_type=CallbackType.VIEW_JOINED_JIOS,
+        # TODO: `OWNER_ADD_ORDER` is correct, the function is correct.
+        #       But name isn't nice, should refactor?
+        jio_callback_type=CallbackType.OWNER_ADD_ORDER,
+        before=before,
+        after=after,
+        archive_list_type=CallbackType.VIEW_ARCHIVED_JOINED_JIOS,
     )
+    await query.answer()
 
-    keyboard = InlineKeyboardMarkup.from_column(
-        [InlineKeyboardButton("↩ Cancel", callback_data=CallbackType.CANCEL_VIEW)]
-        # Use a list comprehension to generate the rest of the buttons
-        + [
-            InlineKeyboardButton(
-                str(jio),
-                # TODO: `OWNER_ADD_ORDER` is correct, the function is correct.
-                #       But name isn't nice, should refactor?
-                callback_data=join(CallbackType.OWNER_ADD_ORDER, str(jio.id)),
-            )
-            for jio in jios
-        ]
+
+async def _send_archived_jio_page(
+    update: Update,
+    user: User,
+    *,
+    joined: bool,
+    empty_text: str,
+    before: JioCursor | None = None,
+    after: JioCursor | None = None,
+) -> None:
+    """
+    Send (or edit in, when paging) a page of the user's archived jios.
+    """
+    jios = await user.get_archived_jios(
+        joined=joined, limit=JIOS_PER_PAGE + 1, before=before, after=after
     )
 
-    await update.effective_chat.send_message(text, reply_markup=keyboard)
+    if not jios:
+        await update.effective_chat.send_message(text=empty_text)
+        return
+
+    await _send_jio_page(
+        update,
+        jios,
+        text="Which of the archived jios do you want to view?",
+        list_type=CallbackType.VIEW_ARCHIVED_JOINED_JIOS
+        if joined
+        else CallbackType.VIEW_ARCHIVED_CREATED_JIOS,
+        jio_callback_type=CallbackType.VIEW_ARCHIVED_JIO,
+        before=before,
+        after=after,
+    )
+
+
+@transactional
+async def view_archived_created_jios(update: Update, _) -> None:
+    """
+    Present to the user a list of archived Supper Jios that they have created.
+    """
+    query = update.callback_query
+    user = await User.get_user(update.effective_user.id)
+
+    before, after = _parse_page(query.data)
+    await _send_archived_jio_page(
+        update,
+        user,
+        joined=False,
+        empty_text="You do not have any archived jios.",
+        before=before,
+        after=after,
+    )
+    await query.answer()
+
+
+@transactional
+async def view_archived_joined_jios(update: Update, _) -> None:
+    """
+    Present to the user a list of archived Supper Jios that they have participated in.
+    """
+    query = update.callback_query
+    user = await User.get_user(update.effective_user.id)
+
+    before, after = _parse_page(query.data)
+    await _send_archived_jio_page(
+        update,
+        user,
+        joined=True,
+        empty_text="You do not have any archived jios.",
+        before=before,
+        after=after,
+    )
+    await query.answer()
+
+
+@transactional
+async def view_archived_jio(update: Update, _) -> None:
+    """
+    Send the consolidated orders of an archived jio. Archived jios are read-only, so
+    the message has no buttons.
+    """
+    query = update.callback_query
+    jio_id = int(parse_callback_data(query.data)[1])
+
+    user = await User.get_user(update.effective_user.id)
+    jio = await user.get_archived_snapshot(jio_id)
+
+    if jio is None:
+        await query.answer("This jio could not be found.")
+        return
+
+    await update.effective_chat.send_message(jio.message, parse_mode=ParseMode.HTML)
     await query.answer()
 
 
+@transactional
 async def view_favourites(update: Update, _):
     """
     Allow users to view their favourite items for each restaurant they are in.
@@ -119,10 +299,10 @@ async def view_favourites(update: Update, _):
     if update.callback_query:
         await update.callback_query.answer()
 
-    user = User.get_user(update.effective_user.id)
+    user = await User.get_user(update.effective_user.id)
 
     # Obtain all restaurants they have favourite items for
-    restaurants = user.get_favourite_restaurants()
+    restaurants = await user.get_favourite_restaurants()
 
     markup = [
         InlineKeyboardButton("↩ Cancel", callback_data=CallbackType.CANCEL_VIEW)
@@ -142,15 +322,16 @@ async def view_favourites(update: Update, _):
     await update.effective_chat.send_message(message, reply_markup=keyboard)
 
 
+@transactional
 async def view_restaurant_favourites(update: Update, _):
     query = update.callback_query
     await query.answer()
 
-    user = User.get_user(update.effective_user.id)
+    user = await User.get_user(update.effective_user.id)
 
     # Obtain the favourite foods
     restaurant = parse_callback_data(query.data)[1]
-    favourites = user.get_favourite_orders(restaurant)
+    favourites = await user.get_favourite_orders(restaurant)
 
     markup = [
         InlineKeyboardButton("↩ Cancel", callback_data=CallbackType.CANCEL_VIEW)
@@ -173,13 +354,14 @@ async def view_restaurant_favourites(update: Update, _):
     await update.effective_message.edit_text(message, reply_markup=keyboard)
 
 
+@transactional
 async def main_menu_confirm_favourite_action(update: Update, _):
 
     query = update.callback_query
     await query.answer()
 
     _, restaurant, idx_str = parse_callback_data(query.data)
-    favourite_order = FavouriteOrder.get_favourite(int(idx_str))
+    favourite_order = await FavouriteOrder.get_favourite(int(idx_str))
 
     markup = [
         InlineKeyboardButton(
@@ -204,10 +386,11 @@ async def main_menu_confirm_favourite_action(update: Update, _):
     )
 
 
+@transactional
 async def main_menu_confirm_delete_fav_item(update: Update, _):
     query = update.callback_query
     await query.answer()
 
     _, restaurant, idx_str = parse_callback_data(query.data)
-    FavouriteOrder.delete(int(idx_str), update.effective_user.id)
+    await FavouriteOrder.delete(int(idx_str), update.effective_user.id)
     await view_restaurant_favourites(update, _)
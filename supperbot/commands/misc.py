@@ -1,9 +1,19 @@
 """File containing coroutines that do not cleanly fit in other files"""
+from datetime import datetime, timedelta
 import logging
 
+from sqlalchemy.exc import NoResultFound
 from telegram import Update
+from telegram.error import TelegramError
 from telegram.ext import CallbackContext
 
+from supperbot import metrics
+from supperbot.cache import jio_cache
+from supperbot.db import get_session, transactional
+from supperbot.models.archive import archive_closed_jios
+
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+
 
 async def not_implemented_callback(update: Update, _) -> None:
     query = update.callback_query
@@ -15,6 +25,24 @@ async def unrecognized_callback(update: Update, _) -> None:
     logging.error(f"Unexpected callback data received: {update.callback_query.data}")
 
 
+async def error_handler(update: object, context: CallbackContext) -> None:
+    """
+    Logs errors raised by handlers.
+
+    Buttons of jios which have been archived lead to jios which no longer exist, so
+    such callback queries are answered instead of being left loading.
+    """
+    query = update.callback_query if isinstance(update, Update) else None
+    if isinstance(context.error, NoResultFound) and query is not None:
+        try:
+            await query.answer("This jio has been archived and can no longer be used.")
+        except TelegramError as e:
+            logging.error(f"Unable to answer callback query {query.data}: {e}")
+        return
+
+    logging.error("Exception while handling an update:", exc_info=context.error)
+
+
 async def set_commands(context: CallbackContext) -> None:
     await context.bot.set_my_commands(
         [
@@ -23,3 +51,38 @@ async def set_commands(context: CallbackContext) -> None:
         ]
     )
     logging.info(f"Started as {context.bot.name}")
+
+
+@transactional
+async def archive_jios(_: CallbackContext) -> None:
+    """
+    Job which moves jios that have been closed for more than `ARCHIVE_AFTER_DAYS` days
+    into the archive tables.
+    """
+    closed_before = datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    archived = 0
+
+    while jio_ids := await archive_closed_jios(
+        closed_before=closed_before, limit=ARCHIVE_BATCH_SIZE
+    ):
+        archived += len(jio_ids)
+        for jio_id in jio_ids:
+            jio_cache.invalidate(jio_id)
+
+        # Commit each batch separately, so that other updates are not blocked for long
+        await get_session().commit()
+
+    if archived:
+        logging.info(f"Archived {archived} jio(s) closed before {closed_before}.")
+
+
+async def log_metrics(_: CallbackContext) -> None:
+    """
+    Job which logs the current value of every counter, eg. the cache hit rates.
+    """
+    counters = metrics.snapshot()
+    if counters:
+        values = ", ".join(
+            f"{name}={value}" for name, value in sorted(counters.items())
+        )
+        logging.info(f"Metrics: {values}")
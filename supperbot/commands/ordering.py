@@ -8,10 +8,15 @@ from telegram import (
 )
 from telegram.ext import ApplicationHandlerStop, ContextTypes, ConversationHandler
 
+from supperbot.db import transactional
 from supperbot.enums import CallbackType, parse_callback_data, join, extract_jio_number
+from supperbot.locks import callback_jio_id, locks_jio
 from supperbot.models import SupperJio, User, Order, FavouriteOrder
+from supperbot.refresh import refresh_jio_messages
 
 
+@locks_jio(lambda _, context: extract_jio_number(context.args[0]))
+@transactional
 @User.initialize_user
 async def interested_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -24,14 +29,17 @@ async def interested_user(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     - Send a message to the user so that they can add in their orders
     """
     jio_id = extract_jio_number(context.args[0])
-    user = User.get_user(update.effective_user.id)
+    user = await User.get_user(update.effective_user.id)
+    jio = await SupperJio.get_jio(jio_id)
 
-    order = Order.create_order(SupperJio.get_jio(jio_id), user)
+    order = await Order.create_order(jio, user)
 
     await order.send_user_order(context.bot)
     raise ApplicationHandlerStop  # Do not trigger the other /start commands
 
 
+@locks_jio(callback_jio_id)
+@transactional
 @User.initialize_user
 async def interested_owner(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -41,20 +49,22 @@ async def interested_owner(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     query = update.callback_query
     jio_id = int(parse_callback_data(query.data)[1])
 
-    user = User.get_user(update.effective_user.id)
+    user = await User.get_user(update.effective_user.id)
+    jio = await SupperJio.get_jio(jio_id)
 
-    order = Order.create_order(SupperJio.get_jio(jio_id), user)
+    order = await Order.create_order(jio, user)
     await order.send_user_order(context.bot)
     await query.answer()
 
 
+@transactional
 async def add_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Callback for when a user wishes to add an order to a jio.
     """
     query = update.callback_query
     jio_id = int(parse_callback_data(query.data)[1])
-    jio = SupperJio.get_jio(jio_id)
+    jio = await SupperJio.get_snapshot(jio_id)
 
     if jio.is_closed():
         await query.answer("The jio is closed!")
@@ -67,10 +77,9 @@ async def add_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     # Get all favourite orders
+    user = await User.get_user(update.effective_user.id)
     favourite_orders = [
-        fav.food
-        for fav in User.get_user(update.effective_user.id).favourite_orders
-        if fav.restaurant == jio.restaurant
+        fav.food for fav in await user.get_favourite_orders(jio.restaurant)
     ]
     markup = [["↩ Cancel"]]
     for i in range(0, len(favourite_orders), 2):
@@ -79,32 +88,34 @@ async def add_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = ReplyKeyboardMarkup(markup, resize_keyboard=True)
 
     # Keep track of current order for the reply
-    context.user_data["current_jio"] = jio
+    context.user_data["current_jio"] = jio.id
 
     await update.effective_chat.send_message(text=message, reply_markup=keyboard)
     await query.answer()
     return CallbackType.CONFIRM_ORDER
 
 
+@locks_jio(lambda _, context: context.user_data.get("current_jio"))
+@transactional
 async def confirm_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # TODO: Investigate the error that occurs here for some reason - sometimes
     #       update.message == None
     food = update.message.text
 
-    jio: SupperJio = context.user_data.pop("current_jio")
-    user = User.get_user(update.effective_user.id)
-    order = Order.create_order(jio, user)
+    jio = await SupperJio.get_jio(context.user_data.pop("current_jio"))
+    user = await User.get_user(update.effective_user.id)
+    order = await Order.create_order(jio, user)
 
     if food != "↩ Cancel":
-        order.add_food(food)
-        await jio.update_main_jio_message(context.bot)
-        await jio.update_shared_jio_messages(context.bot)
+        await order.add_food(food)
+        refresh_jio_messages(jio.id, context.bot)
 
     await order.send_user_order(context.bot, remove_reply_markup=True)
 
     return ConversationHandler.END
 
 
+@transactional
 async def delete_order(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Callback for when the user wishes to delete one food order
@@ -114,14 +125,15 @@ async def delete_order(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
     jio_str = str(jio_id)
 
     # Check if jio is closed
-    jio = SupperJio.get_jio(jio_id)
+    jio = await SupperJio.get_snapshot(jio_id)
     if jio.is_closed():
         await query.answer("The jio is closed!")
         return
 
     # Obtain all user orders and display in a column
     text = "Please select which food order to delete:"
-    order = Order.create_order(jio, User.get_user(update.effective_user.id))
+    user = await User.get_user(update.effective_user.id)
+    order = await Order.create_order(jio_id=jio_id, user=user)
 
     keyboard = InlineKeyboardMarkup.from_column(
         [
@@ -134,10 +146,12 @@ async def delete_order(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
         # TODO: Create a next page functionality? Too many buttons can cause an error
         + [
             InlineKeyboardButton(
-                food,
-                callback_data=join(CallbackType.DELETE_ORDER_ITEM, jio_str, str(idx)),
+                item.food,
+                callback_data=join(
+                    CallbackType.DELETE_ORDER_ITEM, jio_str, str(item.id)
+                ),
             )
-            for idx, food in enumerate(order.food_list)
+            for item in order.items
         ]
     )
 
@@ -145,49 +159,58 @@ async def delete_order(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
     await query.answer()
 
 
+@transactional
 async def cancel_order_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Cancel deletion of a food order.
     """
     query = update.callback_query
     jio_id = int(parse_callback_data(query.data)[1])
-    jio = SupperJio.get_jio(jio_id)
 
-    order = Order.create_order(jio, User.get_user(update.effective_user.id))
+    user = await User.get_user(update.effective_user.id)
+    order = await Order.create_order(jio_id=jio_id, user=user)
 
     await order.update_user_order(context.bot)
     await query.answer()
 
 
+@locks_jio(callback_jio_id)
+@transactional
 async def delete_order_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    _, jio_str, idx = parse_callback_data(query.data)
+    _, jio_str, item_id = parse_callback_data(query.data)
 
-    jio = SupperJio.get_jio(int(jio_str))
-    order = Order.create_order(jio, User.get_user(update.effective_user.id))
+    jio = await SupperJio.get_jio(int(jio_str))
+    user = await User.get_user(update.effective_user.id)
+    order = await Order.create_order(jio, user)
 
     if jio.is_closed():
         await query.answer("The jio is closed!")
         return
 
-    order.delete_food(int(idx))
+    try:
+        await order.delete_food(int(item_id))
+    except ValueError:
+        # The button of an item which has already been deleted was pressed
+        await query.answer("This item has already been deleted.")
+        return
 
     await order.update_user_order(context.bot)
-    await jio.update_main_jio_message(context.bot)
-    await jio.update_shared_jio_messages(context.bot)
+    refresh_jio_messages(jio.id, context.bot)
 
     # TODO: Consider putting result of deletion into query?
     await query.answer()
 
 
+@transactional
 async def add_favourite_item(update: Update, _):
     query = update.callback_query
     jio_str = parse_callback_data(query.data)[1]
     jio_id = int(jio_str)
 
-    user = User.get_user(update.effective_user.id)
-    jio = SupperJio.get_jio(jio_id)
-    order = Order.create_order(jio, user)
+    user = await User.get_user(update.effective_user.id)
+    jio = await SupperJio.get_snapshot(jio_id)
+    order = await Order.create_order(jio_id=jio_id, user=user)
 
     if not order.food_list:
         await update.effective_chat.send_message(
@@ -210,7 +233,8 @@ async def add_favourite_item(update: Update, _):
     # Map the favourite food to its respective id in the database for ease of deletion
     # later below
     favourites = {
-        favFood.food: favFood.id for favFood in user.get_favourite_foods(jio.restaurant)
+        favFood.food: favFood.id
+        for favFood in await user.get_favourite_foods(jio.restaurant)
     }
 
     markup = [
@@ -248,20 +272,20 @@ async def add_favourite_item(update: Update, _):
     await update.effective_message.edit_text(text, reply_markup=keyboard)
 
 
+@transactional
 async def confirm_favourite_item(update: Update, _):
     query = update.callback_query
     _, jio_str, restaurant, idx_str = parse_callback_data(query.data)
 
-    jio = SupperJio.get_jio(int(jio_str))
-    user = User.get_user(update.effective_user.id)
-    order = Order.create_order(jio, user)
+    user = await User.get_user(update.effective_user.id)
+    order = await Order.create_order(jio_id=int(jio_str), user=user)
 
     # Get food name
     food = order.food_list[int(idx_str)]
 
     # Update database
     # TODO: What if too many - need check
-    if not FavouriteOrder.create(user, restaurant, food):
+    if not await FavouriteOrder.create(user, restaurant, food):
         await update.effective_chat.send_message(
             "You have too many favourite items for this restaurant. "
             "Please remove some by going to /start and viewing your favourite orders."
@@ -271,9 +295,10 @@ async def confirm_favourite_item(update: Update, _):
     await add_favourite_item(update, _)
 
 
+@transactional
 async def delete_favourite_item(update: Update, _):
     query = update.callback_query
     fav_id = int(parse_callback_data(query.data)[2])
 
-    FavouriteOrder.delete(fav_id, update.effective_user.id)
+    await FavouriteOrder.delete(fav_id, update.effective_user.id)
     await add_favourite_item(update, _)
@@ -1,55 +1,83 @@
 """
 Coroutines relating to payment of supper jios.
 """
+from functools import partial
 import logging
 
 from telegram import Update
-from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
+from supperbot.db import transactional
+from supperbot.edits import edit_tracker, message_key
 from supperbot.enums import parse_callback_data, PaidStatus
+from supperbot.fanout import Target, fan_out
+from supperbot.locks import callback_jio_id, locks_jio
 from supperbot.models import SupperJio, Order
+from supperbot.priority import Priority
+from supperbot.refresh import refresh_jio_messages
 
 
-# TODO: Needs rate limiting
+# Shown above the order message sent to each user who has yet to pay
+PING_HEADER = "⏰ <b>Reminder to pay for your food!</b> ⏰\n\n"
+
+
+@locks_jio(callback_jio_id)
+@transactional
 async def ping_unpaid_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     jio_id = int(parse_callback_data(query.data)[1])
-    jio = SupperJio.get_jio(jio_id)
+    jio = await SupperJio.get_jio(jio_id)
+    await query.answer()
 
     bot = context.bot
 
+    # Need to check whether the user has even made an order
+    unpaid = [o for o in jio.orders if o.food_list and not o.has_paid()]
+    not_pinged = [o.user.display_name for o in jio.orders if o.has_paid()]
+
+    # The reminder is part of a new order message, so each user only needs one message
+    # and the previous order message only has to lose its buttons
+    previous_messages = {
+        order.user_id: (order.user.chat_id, order.message_id) for order in unpaid
+    }
+    report = await fan_out(
+        Target(
+            order.user.display_name,
+            partial(order.send_user_order, bot, header=PING_HEADER),
+            priority=Priority.BULK,
+        )
+        for order in unpaid
+    )
+
     pinged = []
-    not_pinged = []
-
-    for order in jio.orders:
-        if order.has_paid():
-            not_pinged.append(order.user.display_name)
-        elif order.food:  # Need to check whether the user has even made an order
-            try:
-                await bot.edit_message_reply_markup(
-                    order.user.chat_id, order.message_id, reply_markup=None
-                )
-            except BadRequest as e:
-                logging.error(
-                    f"Unable to edit message {order.message_id} for "
-                    f"{order.user.display_name} (Chat id {order.user.chat_id}): {e}"
+    stale_keyboards = []
+    for order, result in zip(unpaid, report.results):
+        if not result.ok:
+            not_pinged.append(result.target + "(Error: Unable to send message)")
+            continue
+
+        pinged.append(result.target)
+        chat_id, message_id = previous_messages[order.user_id]
+        if message_id is not None:
+            edit_tracker.forget(message_key(chat_id, message_id))
+            stale_keyboards.append(
+                Target(
+                    f"previous order message for user {order.user_id}",
+                    partial(bot.edit_message_reply_markup, chat_id, message_id),
+                    priority=Priority.BULK,
+                    retry=True,
                 )
+            )
 
-            try:
-                await bot.send_message(
-                    order.user.chat_id, "Reminder to pay for your food!"
-                )
-                await order.send_user_order(context.bot)
-            except BadRequest as e:
-                logging.error(f"Unable to ping user {order.user.display_name}: {e}")
-                not_pinged.append(
-                    order.user.display_name + "(Error: Unable to send message)"
-                )
-            else:
-                pinged.append(order.user.display_name)
+    # Removing the buttons of the previous messages is not urgent, so it is done in
+    # the background once the reminders have been sent
+    if stale_keyboards:
+        context.application.create_task(fan_out(stale_keyboards))
 
-    await query.answer()
+    logging.info(
+        f"Pinged unpaid users of jio {jio_id} with {len(unpaid)} message(s) "
+        f"({report}), and {len(stale_keyboards)} deferred keyboard removal(s)"
+    )
 
     text = "Pinged users:\n"
     text += "\n".join(pinged) or "None"
@@ -58,16 +86,16 @@ async def ping_unpaid_users(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await update.effective_chat.send_message(text)
 
 
-# TODO: Rate limit
+@locks_jio(callback_jio_id)
+@transactional
 async def declare_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # TODO: Create something where the user has to declare how much they paid?
     # TODO: Check if user even has an order before declaring payment
     query = update.callback_query
     jio_id = int(parse_callback_data(query.data)[1])
-    jio = SupperJio.get_jio(jio_id)
 
-    order = Order.create_order(jio_id=jio_id, user_id=update.effective_user.id)
-    order.update(paid_status=PaidStatus.PAID)
+    order = await Order.create_order(jio_id=jio_id, user_id=update.effective_user.id)
+    await order.update(paid_status=PaidStatus.PAID)
 
     # TODO: Need to include try-excepts for all these awaits
     await update.effective_message.edit_reply_markup(None)
@@ -77,18 +105,18 @@ async def declare_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     # Update all consolidated jio order messages, without updating other user's messages
-    await jio.update_main_jio_message(context.bot)
-    await jio.update_shared_jio_messages(context.bot)
+    refresh_jio_messages(jio_id, context.bot)
 
 
+@locks_jio(callback_jio_id)
+@transactional
 async def undo_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     query = update.callback_query
     jio_id = int(parse_callback_data(query.data)[1])
-    jio = SupperJio.get_jio(jio_id)
 
-    order = Order.create_order(jio_id=jio_id, user_id=update.effective_user.id)
-    order.update(paid_status=PaidStatus.NOT_PAID)
+    order = await Order.create_order(jio_id=jio_id, user_id=update.effective_user.id)
+    await order.update(paid_status=PaidStatus.NOT_PAID)
 
     await update.effective_message.edit_reply_markup(None)
 
@@ -96,5 +124,4 @@ async def undo_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     # Update all consolidated jio order messages, without updating other user's messages
-    await jio.update_main_jio_message(context.bot)
-    await jio.update_shared_jio_messages(context.bot)
+    refresh_jio_messages(jio_id, context.bot)
@@ -13,10 +13,13 @@ from telegram.ext import ContextTypes
 
 from sqlalchemy.exc import NoResultFound
 
+from supperbot.db import transactional
 from supperbot.enums import parse_callback_data, extract_jio_number
+from supperbot.locks import callback_jio_id, locks_jio
 from supperbot.models import SupperJio, Message
 
 
+@transactional
 async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles the inline queries from sharing jios."""
 
@@ -29,7 +32,7 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     # Check if the order id is valid
     try:
-        jio = SupperJio.get_jio(jio_id)
+        jio = await SupperJio.get_snapshot(jio_id)
     except NoResultFound:
         jio = None
 
@@ -81,6 +84,8 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     # return
 
 
+@locks_jio(lambda update, _: extract_jio_number(update.chosen_inline_result.result_id))
+@transactional
 async def shared_jio(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Updates the database with the new message id after a jio has been shared to a group.
@@ -92,6 +97,8 @@ async def shared_jio(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
     Message.create(jio_id, msg_id)
 
 
+@locks_jio(callback_jio_id)
+@transactional
 async def resend_main_message(update: Update, _):
     """
     Resend the owner's jio message so that it'll be at the bottom of the chat.
@@ -99,7 +106,7 @@ async def resend_main_message(update: Update, _):
 
     query = update.callback_query
     jio_id = int(parse_callback_data(query.data)[1])
-    jio = SupperJio.get_jio(jio_id)
+    jio = await SupperJio.get_jio(jio_id)
 
     # Try editing the previous main message
     try:
@@ -109,7 +116,10 @@ async def resend_main_message(update: Update, _):
 
     await query.answer()
 
+    snapshot = jio.snapshot()
     msg = await update.effective_chat.send_message(
-        text=jio.message, reply_markup=jio.keyboard_markup, parse_mode=ParseMode.HTML
+        text=snapshot.message,
+        reply_markup=snapshot.keyboard_markup,
+        parse_mode=ParseMode.HTML,
     )
     jio.update(chat_id=msg.chat_id, message_id=msg.message_id)
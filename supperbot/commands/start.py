@@ -3,6 +3,7 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 
+from supperbot.db import transactional
 from supperbot.enums import CallbackType
 from supperbot.models import User
 
@@ -21,6 +22,7 @@ async def start_group(update: Update, _) -> None:
     )
 
 
+@transactional
 @User.initialize_user
 async def start(update: Update, _) -> None:
     message = (
@@ -1,18 +1,250 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker, Session
+from __future__ import annotations
 
-from config import DATABASE
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Awaitable, Callable, TypeVar
 
-engine = create_engine(DATABASE, future=True, echo=False)
+from sqlalchemy import Table, and_, event, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.ext.asyncio import (
+    create_async_engine,
+    AsyncConnection,
+    AsyncEngine,
+    AsyncSession,
+)
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from telegram.ext import ApplicationHandlerStop
+
+from config import DATABASE, DATABASE_POOL_SIZE, SQLITE_PRAGMAS
+
+T = TypeVar("T")
+
+# Dialects with native support for `INSERT ... ON CONFLICT`
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+# Async drivers used when the configured database URL does not specify one
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_url(database: str) -> URL:
+    """
+    Convert a database URL into one using an asyncio compatible driver.
+
+    This allows existing configs such as `sqlite:///supper.db` to keep working, while
+    URLs that already specify an async driver are left untouched.
+    """
+    url = make_url(database)
+    return url.set(drivername=_ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def _is_sqlite_file(url: URL) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database not in (
+        None,
+        "",
+        ":memory:",
+    )
+
+
+def make_engine(
+    database: str,
+    *,
+    pool_size: int = DATABASE_POOL_SIZE,
+    sqlite_pragmas: dict[str, str | int] | None = None,
+) -> AsyncEngine:
+    """
+    Create an async engine for the database URL.
+
+    For an on-disk SQLite database, connections are pooled (instead of opening a new
+    connection for every session) and `sqlite_pragmas` are set on each connection.
+    In-memory SQLite databases keep using a single shared connection, as each
+    connection would otherwise see a different database.
+
+    :param database: The database URL.
+    :param pool_size: The number of connections kept open in the pool.
+    :param sqlite_pragmas: The pragmas to set on each on-disk SQLite connection,
+                           eg. `{"journal_mode": "WAL"}`.
+    """
+    url = async_url(database)
+    options = {}
+
+    if url.get_backend_name() != "sqlite":
+        options.update(pool_size=pool_size, pool_pre_ping=True)
+    elif _is_sqlite_file(url):
+        options.update(poolclass=AsyncAdaptedQueuePool, pool_size=pool_size)
+
+    new_engine = create_async_engine(url, future=True, echo=False, **options)
+
+    if sqlite_pragmas and _is_sqlite_file(url):
+
+        @event.listens_for(new_engine.sync_engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, _):
+            cursor = dbapi_connection.cursor()
+            for pragma, value in sqlite_pragmas.items():
+                cursor.execute(f"PRAGMA {pragma}={value}")
+            cursor.close()
+
+    return new_engine
+
+
+engine = make_engine(DATABASE, sqlite_pragmas=SQLITE_PRAGMAS)
 Base = declarative_base()
 
-_Session = None
+# Objects are not expired on commit, as accessing an expired attribute would require
+# an implicit (blocking) refresh, which is not allowed with asyncio.
+async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+# The session of the unit of work (i.e. the update or job) currently being processed
+_current_session: ContextVar[AsyncSession | None] = ContextVar(
+    "_current_session", default=None
+)
+
+
+def get_session() -> AsyncSession:
+    """
+    Returns the session of the current unit of work.
+
+    Sessions are only available within callbacks decorated with `transactional`.
+    """
+    session = _current_session.get()
+    if session is None:
+        raise RuntimeError(
+            "No database session is active. "
+            "Decorate the callback with `supperbot.db.transactional`."
+        )
+    return session
+
+
+def transactional(
+    coroutine: Callable[..., Awaitable[T]]
+) -> Callable[..., Awaitable[T]]:
+    """
+    Decorator which runs a handler or job within its own unit of work.
+
+    A new session is opened before the coroutine is called, and is committed once when
+    the coroutine returns (or stops handling with `ApplicationHandlerStop`). Any other
+    exception rolls back the session. The session, along with its identity map, is
+    discarded afterwards.
+
+    Nested calls to decorated coroutines reuse the session of the outermost call.
+    Callbacks registered with `after_commit` are called once the session has been
+    committed, and those registered with `after_transaction` once the session has been
+    committed or rolled back.
+    """
+
+    @wraps(coroutine)
+    async def inner(*args: Any, **kwargs: Any) -> T:
+        if _current_session.get() is not None:
+            return await coroutine(*args, **kwargs)
+
+        async with async_session() as session:
+            token = _current_session.set(session)
+            try:
+                result = await coroutine(*args, **kwargs)
+                await session.commit()
+                _run_callbacks(session, "after_commit")
+                return result
+            except ApplicationHandlerStop:
+                await session.commit()
+                _run_callbacks(session, "after_commit")
+                raise
+            finally:
+                _current_session.reset(token)
+                _run_callbacks(session, "after_transaction")
+
+    return inner
+
+
+def _run_callbacks(session: AsyncSession, key: str) -> None:
+    for callback in session.sync_session.info.pop(key, []):
+        callback()
+
+
+def after_commit(callback: Callable[[], Any]) -> None:
+    """
+    Register a callback to be called once the current unit of work has been committed.
+    """
+    get_session().sync_session.info.setdefault("after_commit", []).append(callback)
+
+
+def after_transaction(callback: Callable[[], Any]) -> None:
+    """
+    Register a callback to be called once the current unit of work has ended, whether
+    it was committed or rolled back.
+    """
+    get_session().sync_session.info.setdefault("after_transaction", []).append(callback)
+
+
+async def write(operation: Callable[[AsyncConnection], Awaitable[T]]) -> T:
+    """
+    Execute a write operation on the connection of the current unit of work, so that
+    it is committed (or rolled back) along with the rest of the unit of work.
+
+    The operation should only execute statements and not modify any ORM objects.
+    """
+    return await operation(await get_session().connection())
+
+
+async def upsert(
+    conn: AsyncConnection,
+    table: Table,
+    keys: dict[str, Any],
+    values: dict[str, Any],
+    *,
+    update: bool = True,
+) -> None:
+    """
+    Insert a row, or if a row with the same keys already exists, update its values if
+    they have changed (or leave it as it is if `update` is False).
+
+    Uses `INSERT ... ON CONFLICT` where the dialect supports it. Other dialects select
+    the row first, so the caller must ensure that the same row is not upserted
+    concurrently, eg. through a lock.
+
+    :param keys: The values of the columns of a unique index or primary key.
+    :param values: The values of the other columns.
+    """
+    insert = _UPSERT_INSERTS.get(conn.dialect.name)
+    if insert is None:
+        await _select_then_upsert(conn, table, keys, values, update=update)
+        return
+
+    stmt = insert(table).values(**keys, **values)
+    if not update:
+        await conn.execute(stmt.on_conflict_do_nothing(index_elements=list(keys)))
+        return
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: stmt.excluded[name] for name in values},
+        where=or_(*(table.c[name] != stmt.excluded[name] for name in values)),
+    )
+    await conn.execute(stmt)
 
 
-def get_session() -> Session:
-    global _Session
+async def _select_then_upsert(
+    conn: AsyncConnection,
+    table: Table,
+    keys: dict[str, Any],
+    values: dict[str, Any],
+    *,
+    update: bool,
+) -> None:
+    """
+    `upsert` with a separate select and insert or update, for dialects without
+    `INSERT ... ON CONFLICT`.
+    """
+    where = and_(*(table.c[name] == value for name, value in keys.items()))
+    columns = [table.c[name] for name in values]
+    existing = (await conn.execute(select(*columns).where(where).limit(1))).first()
 
-    if _Session is None:
-        Base.metadata.create_all(engine)
-        _Session = sessionmaker(engine)()
-    return _Session
+    if existing is None:
+        await conn.execute(table.insert().values(**keys, **values))
+    elif update and tuple(existing) != tuple(values.values()):
+        await conn.execute(table.update().where(where).values(**values))
@@ -0,0 +1,93 @@
+"""
+Dead letters: jio messages which repeatedly failed to be edited, eg. because the user
+blocked the bot or the group deleted the message.
+
+Once a message has failed `DEAD_LETTER_AFTER` fan-outs in a row with a permanent error
+(`BadRequest` or `Forbidden`), it is recorded in the `dead_letters` table and is no
+longer edited, so that it does not cost API calls (and retries) on every fan-out.
+Timeouts and network errors never dead-letter a message. Deleting its row and
+restarting the bot edits it again.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+
+from cachetools import LRUCache
+from sqlalchemy import Column, DateTime, Index, Integer, String, Table, select
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config import DEAD_LETTER_AFTER
+from supperbot.db import Base, engine, upsert, write
+
+dead_letters = Table(
+    "dead_letters",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    # "<chat id>:<message id>", or the inline message id of a shared message
+    Column("message", String, nullable=False),
+    Column("target", String, nullable=False),
+    Column("error", String, nullable=False),
+    Column("failures", Integer, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Index("ix_dead_letters_message", "message", unique=True),
+)
+
+# The number of failing messages whose consecutive failures are counted
+_FAILURES_SIZE = 4096
+
+
+class DeadLetterTracker:
+    def __init__(self, threshold: int):
+        """
+        :param threshold: The number of consecutive failed fan-outs after which a
+                          message is dead-lettered.
+        """
+        self.threshold = threshold
+        self._messages: set[str] = set()
+        self._failures: LRUCache[str, int] = LRUCache(_FAILURES_SIZE)
+
+    def __contains__(self, message: str) -> bool:
+        return message in self._messages
+
+    async def load(self) -> None:
+        """
+        Load the dead-lettered messages from the database.
+        """
+        async with engine.connect() as conn:
+            self._messages = set(await conn.scalars(select(dead_letters.c.message)))
+
+    def record_success(self, message: str) -> None:
+        self._failures.pop(message, None)
+
+    def record_failure(self, message: str) -> bool:
+        """
+        :return: Whether the message has now failed too often, and is dead-lettered.
+        """
+        failures = self._failures.get(message, 0) + 1
+        if failures < self.threshold:
+            self._failures[message] = failures
+            return False
+
+        self._failures.pop(message, None)
+        self._messages.add(message)
+        return True
+
+    async def store(self, message: str, target: str, error: str) -> None:
+        """
+        Record a dead-lettered message in the database, within the current unit of
+        work.
+        """
+
+        async def insert(conn: AsyncConnection) -> None:
+            values = {
+                "target": target,
+                "error": error,
+                "failures": self.threshold,
+                "created_at": datetime.now(),
+            }
+            await upsert(conn, dead_letters, {"message": message}, values, update=False)
+
+        await write(insert)
+
+
+dead_letter_tracker = DeadLetterTracker(DEAD_LETTER_AFTER)
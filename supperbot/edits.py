@@ -0,0 +1,63 @@
+"""
+Tracking of the content last rendered into each jio message, so that edits which would
+not change a message can be skipped.
+
+Telegram rejects such edits with "message is not modified", but they still count
+towards the rate limits. The content is tracked in memory, so the first edit of each
+message after a restart is always made.
+
+Messages are identified by "<chat id>:<message id>" (see `message_key`), or by their
+inline message id for the shared messages in groups. Callbacks which edit a tracked
+message directly, instead of through a fan-out, have to forget its content, as it no
+longer matches.
+"""
+from __future__ import annotations
+
+from cachetools import LRUCache
+from telegram import InlineKeyboardMarkup, Update
+from telegram.ext import ContextTypes
+
+from config import EDIT_TRACKER_SIZE
+
+
+def message_key(chat_id: int, message_id: int | None) -> str:
+    return f"{chat_id}:{message_id}"
+
+
+def content_hash(text: str, reply_markup: InlineKeyboardMarkup | None) -> int:
+    return hash((text, reply_markup.to_json() if reply_markup is not None else None))
+
+
+class EditTracker:
+    def __init__(self, maxsize: int):
+        """
+        :param maxsize: The maximum number of messages tracked. The least recently
+                        edited message is forgotten when full.
+        """
+        self._hashes: LRUCache[str, int] = LRUCache(maxsize)
+
+    def is_unchanged(self, message: str, content: int) -> bool:
+        return self._hashes.get(message) == content
+
+    def record(self, message: str, content: int) -> None:
+        self._hashes[message] = content
+
+    def forget(self, message: str) -> None:
+        self._hashes.pop(message, None)
+
+
+edit_tracker = EditTracker(EDIT_TRACKER_SIZE)
+
+
+async def forget_callback_message(update: Update, _: ContextTypes.DEFAULT_TYPE):
+    """
+    Handler which forgets the content of the message whose button was pressed, as
+    callback queries commonly edit their message directly.
+    """
+    query = update.callback_query
+    if query.inline_message_id is not None:
+        edit_tracker.forget(query.inline_message_id)
+    elif query.message is not None:
+        edit_tracker.forget(
+            message_key(query.message.chat_id, query.message.message_id)
+        )
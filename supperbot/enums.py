@@ -38,7 +38,10 @@ class CallbackType(str, Enum):
 
     VIEW_CREATED_JIOS = "030"
     CANCEL_VIEW = "031"
+    VIEW_ARCHIVED_CREATED_JIOS = "032"
     VIEW_JOINED_JIOS = "035"
+    VIEW_ARCHIVED_JOINED_JIOS = "036"
+    VIEW_ARCHIVED_JIO = "037"
 
     RESEND_MAIN_MESSAGE = "040"
     OWNER_ADD_ORDER = "041"
@@ -0,0 +1,288 @@
+"""
+Concurrent fan-out of Telegram API calls, eg. editing every message of a supper jio.
+
+Edits failing with timeouts or network errors are retried with jittered exponential
+backoff, while other calls (eg. sending messages) are only made once, as retrying them
+could send the message twice. Rate limits are retried by the rate limiter. Messages
+which can no longer be edited, eg. as they are older than 48 hours, are sent again
+instead where possible, and messages which keep failing with permanent errors are
+dead-lettered (see `supperbot.deadletters`).
+"""
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Iterable, TypeVar
+
+from telegram import Bot, InlineKeyboardMarkup, Message
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, NetworkError, TelegramError
+
+from config import EDIT_MAX_RETRIES, EDIT_RETRY_BASE_DELAY, FANOUT_CONCURRENCY
+from supperbot import metrics
+from supperbot.deadletters import dead_letter_tracker
+from supperbot.edits import content_hash, edit_tracker, message_key
+from supperbot.priority import Priority, current_priority, request_priority
+
+T = TypeVar("T")
+
+# Errors for messages which can no longer be edited, and should be sent again instead
+_RESEND_ERRORS = ("message can't be edited", "message to edit not found")
+
+
+@dataclass(frozen=True)
+class Target:
+    """An API call made during a fan-out."""
+
+    # A description of the target, used in logs and reports
+    name: str
+    call: Callable[[], Awaitable[Any]]
+    # The message edited by the call and the hash of its new content, if the call
+    # should be skipped when the message already has that content
+    message: str | None = None
+    content: int | None = None
+    # The priority of the call, if not the priority of the fan-out
+    priority: Priority | None = None
+    # Whether the call can safely be made again after a timeout or network error,
+    # eg. an edit, but not sending a message
+    retry: bool = False
+    # Sends a new message in place of a message which can no longer be edited, and
+    # stores the id of the new message
+    resend: Callable[[], Awaitable[Message]] | None = None
+    on_resent: Callable[[int], Awaitable[None]] | None = None
+
+
+def edit_target(
+    name: str,
+    bot: Bot,
+    text: str,
+    reply_markup: InlineKeyboardMarkup | None,
+    *,
+    chat_id: int | None = None,
+    message_id: int | None = None,
+    inline_message_id: str | None = None,
+    priority: Priority | None = None,
+    on_resent: Callable[[int], Awaitable[None]] | None = None,
+) -> Target:
+    """
+    A target editing the HTML text and reply markup of a message, which is skipped if
+    the message is known to have that text and markup already.
+
+    :param on_resent: Stores the id of the message sent to the chat if the message can
+                      no longer be edited. Messages are only sent again if given.
+    """
+
+    def resend() -> Awaitable[Message]:
+        return bot.send_message(
+            chat_id, text, parse_mode=ParseMode.HTML, reply_markup=reply_markup
+        )
+
+    return Target(
+        name,
+        lambda: bot.edit_message_text(
+            text,
+            chat_id=chat_id,
+            message_id=message_id,
+            inline_message_id=inline_message_id,
+            parse_mode=ParseMode.HTML,
+            reply_markup=reply_markup,
+        ),
+        message=inline_message_id or message_key(chat_id, message_id),
+        content=content_hash(text, reply_markup),
+        priority=priority,
+        retry=True,
+        resend=resend if on_resent is not None else None,
+        on_resent=on_resent,
+    )
+
+
+@dataclass(frozen=True)
+class TargetResult:
+    target: str
+    duration: float
+    error: TelegramError | None = None
+    # Whether the call was skipped, as the message already had the content or has
+    # been dead-lettered
+    skipped: bool = False
+    # The id of the message sent in place of a message which can no longer be edited
+    resent_message_id: int | None = None
+    # Whether the message failed too often, and will no longer be edited
+    dead_lettered: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass(frozen=True)
+class FanoutReport:
+    results: tuple[TargetResult, ...]
+    duration: float
+
+    @property
+    def errors(self) -> tuple[TargetResult, ...]:
+        return tuple(result for result in self.results if not result.ok)
+
+    @property
+    def skipped(self) -> tuple[TargetResult, ...]:
+        return tuple(result for result in self.results if result.skipped)
+
+    @property
+    def resent(self) -> tuple[TargetResult, ...]:
+        return tuple(r for r in self.results if r.resent_message_id is not None)
+
+    def __str__(self):
+        return (
+            f"{len(self.results)} target(s) in {self.duration:.3f}s, "
+            f"{len(self.skipped)} skipped, {len(self.resent)} resent, "
+            f"{len(self.errors)} failed"
+        )
+
+
+async def _with_retries(call: Callable[[], Awaitable[T]]) -> T:
+    """
+    Make the API call, retrying timeouts and network errors up to `EDIT_MAX_RETRIES`
+    times. `RetryAfter` is already retried by the rate limiter.
+    """
+    retries = 0
+    while True:
+        try:
+            return await call()
+        except BadRequest:
+            # A subclass of NetworkError, but retrying would fail the same way
+            raise
+        except NetworkError:
+            if retries >= EDIT_MAX_RETRIES:
+                raise
+
+            delay = random.uniform(0, EDIT_RETRY_BASE_DELAY * 2**retries)
+            retries += 1
+            metrics.increment("edits.retried")
+            await asyncio.sleep(delay)
+
+
+async def _make(target: Target) -> Any:
+    """
+    Make the API call of the target, with retries if it is safe to do so.
+    """
+    if target.retry:
+        return await _with_retries(target.call)
+    return await target.call()
+
+
+async def _call(target: Target) -> tuple[bool, Message | None]:
+    """
+    Make the API call of the target, unless it would not change its message.
+
+    :return: Whether the call was skipped, and the message sent in place of the
+             edited message if it could no longer be edited.
+    """
+    if target.message is None:
+        await _make(target)
+        return False, None
+
+    if target.message in dead_letter_tracker:
+        metrics.increment("edits.dead_lettered")
+        return True, None
+
+    if edit_tracker.is_unchanged(target.message, target.content):
+        metrics.increment("edits.skipped")
+        return True, None
+
+    # The content of the message is unknown until the edit succeeds
+    edit_tracker.forget(target.message)
+    try:
+        await _make(target)
+    except BadRequest as e:
+        error = e.message.lower()
+        if "not modified" in error:
+            metrics.increment("edits.not_modified")
+        elif target.resend is not None and any(s in error for s in _RESEND_ERRORS):
+            msg = await target.resend()
+            metrics.increment("edits.resent")
+            edit_tracker.record(
+                message_key(msg.chat_id, msg.message_id), target.content
+            )
+            return False, msg
+        else:
+            raise
+    else:
+        metrics.increment("edits.sent")
+
+    edit_tracker.record(target.message, target.content)
+    return False, None
+
+
+async def fan_out(
+    targets: Iterable[Target],
+    *,
+    concurrency: int = FANOUT_CONCURRENCY,
+    on_result: Callable[[TargetResult], None] | None = None,
+) -> FanoutReport:
+    """
+    Make the API calls of all targets concurrently, with at most `concurrency` calls
+    in flight at once. `on_result` is called with the result of each target as soon
+    as its call has been made, eg. to report progress.
+
+    A target failing with a `TelegramError` does not stop the other targets. The
+    error is logged, and recorded in the returned report.
+
+    The ids of resent messages and any dead-lettered messages are stored within the
+    current unit of work, once all calls have been made.
+    """
+    targets = list(targets)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(target: Target) -> TargetResult:
+        result = await call(target)
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    async def call(target: Target) -> TargetResult:
+        priority = current_priority() if target.priority is None else target.priority
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                with request_priority(priority):
+                    skipped, resent = await _call(target)
+            except TelegramError as e:
+                logging.error(f"Unable to update {target.name}: {e}")
+                # Timeouts and network errors may well succeed on the next fan-out
+                dead_lettered = (
+                    target.message is not None
+                    and isinstance(e, (BadRequest, Forbidden))
+                    and dead_letter_tracker.record_failure(target.message)
+                )
+                return TargetResult(
+                    target.name,
+                    time.perf_counter() - start,
+                    e,
+                    dead_lettered=dead_lettered,
+                )
+
+            if target.message is not None:
+                dead_letter_tracker.record_success(target.message)
+            return TargetResult(
+                target.name,
+                time.perf_counter() - start,
+                skipped=skipped,
+                resent_message_id=resent.message_id if resent is not None else None,
+            )
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run(target) for target in targets))
+
+    for target, result in zip(targets, results):
+        if result.resent_message_id is not None:
+            await target.on_resent(result.resent_message_id)
+        if result.dead_lettered:
+            logging.warning(f"No longer updating {target.name}: {result.error}")
+            await dead_letter_tracker.store(
+                target.message, target.name, str(result.error)
+            )
+
+    return FanoutReport(tuple(results), time.perf_counter() - start)
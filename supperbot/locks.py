@@ -0,0 +1,144 @@
+"""
+Locks which allow updates to be processed concurrently, while keeping the updates
+which depend on each other in order.
+
+* Updates from the same user are processed one at a time, in the order they were
+  received, so that the conversation state of the user is always correct.
+* Handlers which change a supper jio (eg. adding an order) are decorated with
+  `locks_jio`, so that changes to the same jio are made (and committed) one at a time.
+
+Everything else is processed concurrently.
+"""
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, TypeVar
+
+from telegram import Update
+from telegram.ext import Application
+
+from config import CONCURRENT_UPDATES
+from supperbot import metrics
+from supperbot.enums import parse_callback_data
+
+T = TypeVar("T")
+
+
+class KeyedLocks:
+    """
+    A lock for each key, created when first needed and discarded once unused.
+
+    The locks are reentrant within a task (and the tasks it creates), so a handler
+    holding a lock can call another handler taking the same lock.
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: The name of the locks in the metrics, eg. `jio_lock.contended`.
+        """
+        self.name = name
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+        # The number of tasks holding or waiting for the lock of each key
+        self._users: dict[Hashable, int] = {}
+        # The keys whose locks are held by the current task
+        self._held: ContextVar[frozenset] = ContextVar(
+            f"{name}_held", default=frozenset()
+        )
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        held = self._held.get()
+        if key in held:
+            yield
+            return
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._users[key] = self._users.get(key, 0) + 1
+        if lock.locked():
+            metrics.increment(f"{self.name}.contended")
+
+        try:
+            async with lock:
+                token = self._held.set(held | {key})
+                try:
+                    yield
+                finally:
+                    self._held.reset(token)
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+
+user_locks = KeyedLocks("user_lock")
+jio_locks = KeyedLocks("jio_lock")
+
+
+Handler = Callable[..., Awaitable[T]]
+
+
+def locks_jio(jio_id: Callable[..., int | None]) -> Callable[[Handler], Handler]:
+    """
+    Decorator which holds the lock of a jio while the handler runs.
+
+    It must be applied above `transactional`, so that the lock is only released once
+    the changes to the jio have been committed, and before the unit of work writes
+    anything, as another unit of work holding the lock may be waiting for that write
+    to be committed.
+
+    :param jio_id: Returns the id of the jio, given the arguments of the handler. The
+                   handler runs without the lock if it returns None.
+    """
+
+    def decorator(coroutine: Handler[T]) -> Handler[T]:
+        @wraps(coroutine)
+        async def inner(*args: Any, **kwargs: Any) -> T:
+            key = jio_id(*args, **kwargs)
+            if key is None:
+                return await coroutine(*args, **kwargs)
+
+            async with jio_locks.hold(key):
+                return await coroutine(*args, **kwargs)
+
+        return inner
+
+    return decorator
+
+
+def callback_jio_id(update: Update, _) -> int:
+    """
+    The jio id of callback data such as `<callback type>:<jio id>:...`.
+    """
+    return int(parse_callback_data(update.callback_query.data)[1])
+
+
+class SerializedApplication(Application):
+    """
+    An application processing updates concurrently, except for the updates from the
+    same user, which are processed one at a time.
+
+    At most `CONCURRENT_UPDATES` updates are processed at once. The lock of the user is
+    taken before one of these slots, so that the updates waiting behind another update
+    of the same user never hold a slot, which would keep the updates of everyone else
+    waiting. The `concurrent_updates` of the application (which are taken before
+    `process_update` is called) only limits the number of updates taken from the
+    update queue, and must be larger.
+    """
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._processing = asyncio.BoundedSemaphore(CONCURRENT_UPDATES)
+
+    async def process_update(self, update: object) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            async with self._processing:
+                await super().process_update(update)
+            return
+
+        async with user_locks.hold(user.id), self._processing:
+            await super().process_update(update)
@@ -0,0 +1,33 @@
+"""
+In-process counters for monitoring the bot, eg. cache hit rates.
+
+Counters are identified by dotted names such as `jio_cache.hit`, and are reset when
+the bot restarts. The values of all counters are logged periodically by the
+`log_metrics` job.
+"""
+from collections import Counter
+
+_counters: Counter[str] = Counter()
+
+
+def increment(name: str, value: int = 1) -> None:
+    _counters[name] += value
+
+
+def set_value(name: str, value: int) -> None:
+    """
+    Set the counter to a value, for counters measuring a current level such as the
+    length of a queue.
+    """
+    _counters[name] = value
+
+
+def get(name: str) -> int:
+    return _counters[name]
+
+
+def snapshot(prefix: str = "") -> dict[str, int]:
+    """
+    Returns the current value of every counter whose name starts with `prefix`.
+    """
+    return {name: value for name, value in _counters.items() if name.startswith(prefix)}
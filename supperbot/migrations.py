@@ -0,0 +1,537 @@
+"""
+Versioned schema migrations, which are applied when the bot starts.
+
+Each migration is a function taking a (synchronous) SQLAlchemy connection, registered
+with the `migration` decorator under a unique, increasing version number. Applied
+versions are recorded in the `schema_migrations` table.
+
+A new database is created directly from the models and stamped with every version, so
+migrations only ever run against databases created by an older version of the bot.
+Migrations should therefore be written against the schema as it was at that point in
+time, and not import the models.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+import logging
+from typing import Callable
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    ForeignKeyConstraint,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    bindparam,
+    column,
+    inspect,
+    select,
+    table,
+    text,
+)
+from sqlalchemy.engine import Connection
+
+from supperbot.db import Base, engine
+
+# Ensure that all tables are registered in the metadata
+import supperbot.models  # noqa: F401
+
+
+schema_migrations = Table(
+    "schema_migrations",
+    Base.metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+MIGRATIONS: list[Migration] = []
+
+# Number of rows updated at once when migrating data
+_BATCH_SIZE = 1000
+
+
+def migration(version: int, description: str):
+    """
+    Decorator to register a function as a schema migration.
+
+    :param version: The version of the schema after applying this migration.
+    :param description: A short description of what the migration does.
+    """
+    if any(m.version == version for m in MIGRATIONS):
+        raise ValueError(f"Migration version {version} is already registered.")
+
+    def inner(upgrade: Callable[[Connection], None]):
+        MIGRATIONS.append(Migration(version, description, upgrade))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return upgrade
+
+    return inner
+
+
+@migration(1, "Add secondary indexes for user and jio lookups")
+def _add_secondary_indexes(conn: Connection) -> None:
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS ix_orders_user_id ON orders (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_supper_jios_owner_id_status_timestamp "
+        "ON supper_jios (owner_id, status, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_favourite_orders_user_id_restaurant "
+        "ON favourite_orders (user_id, restaurant)",
+        "CREATE INDEX IF NOT EXISTS ix_shared_messages_jio_id "
+        "ON shared_messages (jio_id)",
+    ):
+        conn.execute(text(statement))
+
+
+@migration(2, "Store jio timestamps as DateTime instead of strings")
+def _datetime_timestamps(conn: Connection) -> None:
+    datetime_type = DateTime().compile(dialect=conn.dialect)
+
+    # Columns which are part of an index cannot be dropped
+    conn.execute(text("DROP INDEX ix_supper_jios_owner_id_status_timestamp"))
+    conn.execute(
+        text(f"ALTER TABLE supper_jios ADD COLUMN timestamp_new {datetime_type}")
+    )
+
+    # The old timestamps were stored as `str(datetime.now())`
+    jios = table("supper_jios", column("id"), column("timestamp_new", DateTime))
+    rows = conn.execute(text("SELECT id, timestamp FROM supper_jios")).all()
+    for i in range(0, len(rows), _BATCH_SIZE):
+        conn.execute(
+            jios.update()
+            .where(jios.c.id == bindparam("jio_id"))
+            .values(timestamp_new=bindparam("new")),
+            [
+                {"jio_id": jio_id, "new": datetime.fromisoformat(timestamp)}
+                for jio_id, timestamp in rows[i : i + _BATCH_SIZE]
+            ],
+        )
+
+    conn.execute(text("ALTER TABLE supper_jios DROP COLUMN timestamp"))
+    conn.execute(
+        text("ALTER TABLE supper_jios RENAME COLUMN timestamp_new TO timestamp")
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX ix_supper_jios_owner_id_status_timestamp "
+            "ON supper_jios (owner_id, status, timestamp)"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX ix_supper_jios_owner_id_timestamp "
+            "ON supper_jios (owner_id, timestamp)"
+        )
+    )
+
+
+@migration(3, "Move food orders into the order_items table")
+def _order_items(conn: Connection) -> None:
+    metadata = MetaData()
+    # Only the referenced columns of orders are needed to create the foreign key
+    Table(
+        "orders",
+        metadata,
+        Column("jio_id", Integer, primary_key=True),
+        Column("user_id", BigInteger, primary_key=True),
+    )
+    items = Table(
+        "order_items",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("jio_id", Integer, nullable=False),
+        Column("user_id", BigInteger, nullable=False),
+        Column("position", Integer, nullable=False),
+        Column("food", String, nullable=False),
+        Column("normalized", String, nullable=False),
+        Column("created_at", DateTime, nullable=False),
+        ForeignKeyConstraint(
+            ["jio_id", "user_id"], ["orders.jio_id", "orders.user_id"]
+        ),
+        Index(
+            "ix_order_items_jio_id_user_id_position", "jio_id", "user_id", "position"
+        ),
+        Index("ix_order_items_jio_id_normalized", "jio_id", "normalized"),
+    )
+    items.create(conn)
+
+    # The food orders were stored as a tab separated string. When each item was
+    # ordered is unknown, so the time of the migration is used instead.
+    now = datetime.now()
+    result = conn.execute(
+        text("SELECT jio_id, user_id, food FROM orders WHERE food != ''")
+    )
+    for rows in result.partitions(_BATCH_SIZE):
+        conn.execute(
+            items.insert(),
+            [
+                {
+                    "jio_id": jio_id,
+                    "user_id": user_id,
+                    "position": position,
+                    "food": food,
+                    "normalized": " ".join(food.lower().split()),
+                    "created_at": now,
+                }
+                for jio_id, user_id, foods in rows
+                for position, food in enumerate(foods.split("\t"))
+            ],
+        )
+
+    conn.execute(text("ALTER TABLE orders DROP COLUMN food"))
+
+
+@migration(4, "Record when jios were closed and add the archive tables")
+def _archive_tables(conn: Connection) -> None:
+    datetime_type = DateTime().compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE supper_jios ADD COLUMN closed_at {datetime_type}"))
+
+    # When existing jios were closed is unknown, so they are treated as having been
+    # closed when they were created.
+    conn.execute(
+        text("UPDATE supper_jios SET closed_at = timestamp WHERE status = :closed"),
+        {"closed": 1},
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX ix_supper_jios_status_closed_at "
+            "ON supper_jios (status, closed_at)"
+        )
+    )
+
+    metadata = MetaData()
+    Table(
+        "archived_jios",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("description", String, nullable=False),
+        Column("restaurant", String(32), nullable=False),
+        Column("owner_id", BigInteger, nullable=False),
+        Column("status", Integer, nullable=False),
+        Column("chat_id", BigInteger, nullable=True),
+        Column("message_id", Integer, nullable=True),
+        Column("timestamp", DateTime, nullable=False),
+        Column("closed_at", DateTime, nullable=True),
+        Column("archived_at", DateTime, nullable=False),
+        Index("ix_archived_jios_owner_id_timestamp", "owner_id", "timestamp"),
+    )
+    Table(
+        "archived_orders",
+        metadata,
+        Column("jio_id", Integer, primary_key=True),
+        Column("user_id", BigInteger, primary_key=True),
+        Column("paid", Integer),
+        Column("message_id", Integer, nullable=True),
+        Index("ix_archived_orders_user_id", "user_id"),
+    )
+    Table(
+        "archived_order_items",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("jio_id", Integer, nullable=False),
+        Column("user_id", BigInteger, nullable=False),
+        Column("position", Integer, nullable=False),
+        Column("food", String, nullable=False),
+        Column("normalized", String, nullable=False),
+        Column("created_at", DateTime, nullable=False),
+        Index(
+            "ix_archived_order_items_jio_id_user_id_position",
+            "jio_id",
+            "user_id",
+            "position",
+        ),
+    )
+    Table(
+        "archived_shared_messages",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("jio_id", Integer),
+        Column("message_id", String),
+        Index("ix_archived_shared_messages_jio_id", "jio_id"),
+    )
+    metadata.create_all(conn)
+
+
+@migration(5, "Add order counters to jios")
+def _jio_counters(conn: Connection) -> None:
+    counters = ("participant_count", "ordered_count", "paid_count", "item_count")
+    for table_name in ("supper_jios", "archived_jios"):
+        for counter in counters:
+            conn.execute(
+                text(
+                    f"ALTER TABLE {table_name} "
+                    f"ADD COLUMN {counter} INTEGER NOT NULL DEFAULT 0"
+                )
+            )
+
+    for table_name, orders, items in (
+        ("supper_jios", "orders", "order_items"),
+        ("archived_jios", "archived_orders", "archived_order_items"),
+    ):
+        item_counts = (
+            f"(SELECT COUNT(*) FROM {items} i "
+            f"WHERE i.jio_id = o.jio_id AND i.user_id = o.user_id)"
+        )
+        conn.execute(
+            text(
+                f"UPDATE {table_name} SET "
+                f"participant_count = (SELECT COUNT(*) FROM {orders} o "
+                f"WHERE o.jio_id = {table_name}.id), "
+                f"ordered_count = (SELECT COUNT(*) FROM {orders} o "
+                f"WHERE o.jio_id = {table_name}.id AND {item_counts} > 0), "
+                f"paid_count = (SELECT COUNT(*) FROM {orders} o "
+                f"WHERE o.jio_id = {table_name}.id AND o.paid = 1), "
+                f"item_count = (SELECT COUNT(*) FROM {items} i "
+                f"WHERE i.jio_id = {table_name}.id)"
+            )
+        )
+
+
+@migration(6, "Add the dead letters table")
+def _dead_letters(conn: Connection) -> None:
+    metadata = MetaData()
+    Table(
+        "dead_letters",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("message", String, nullable=False),
+        Column("target", String, nullable=False),
+        Column("error", String, nullable=False),
+        Column("failures", Integer, nullable=False),
+        Column("created_at", DateTime, nullable=False),
+        Index("ix_dead_letters_message", "message", unique=True),
+    )
+    metadata.create_all(conn)
+
+
+def _renumber_archived(conn: Connection, archive: str, hot: str, *references) -> None:
+    """
+    Give the archived rows whose ids have been given out again in the hot table new
+    ids above those of both tables, updating the `references` (as `(table, column)`)
+    to them as well.
+    """
+    clashing = conn.scalars(
+        text(f"SELECT a.id FROM {archive} a JOIN {hot} h ON h.id = a.id")
+    ).all()
+    if not clashing:
+        return
+
+    last = conn.scalar(
+        text(
+            f"SELECT MAX(id) FROM (SELECT id FROM {hot} UNION ALL SELECT id FROM "
+            f"{archive}) AS ids"
+        )
+    )
+    for new_id, old_id in enumerate(clashing, start=last + 1):
+        for table_name, column_name in ((archive, "id"), *references):
+            conn.execute(
+                text(
+                    f"UPDATE {table_name} SET {column_name} = :new "
+                    f"WHERE {column_name} = :old"
+                ),
+                {"new": new_id, "old": old_id},
+            )
+
+
+def _rebuild_with_autoincrement(conn: Connection, new: Table, archive: str) -> None:
+    """
+    Rebuild a SQLite table as the given table (named `<table>_new`), whose primary key
+    uses AUTOINCREMENT, and reserve the ids of its archived rows.
+    """
+    name = new.name.removesuffix("_new")
+    names = ", ".join(c.name for c in new.columns)
+    indexes = conn.scalars(
+        text(
+            "SELECT sql FROM sqlite_master "
+            "WHERE type = 'index' AND tbl_name = :name AND sql IS NOT NULL"
+        ),
+        {"name": name},
+    ).all()
+
+    new.create(conn)
+    conn.execute(text(f"INSERT INTO {new.name} ({names}) SELECT {names} FROM {name}"))
+    conn.execute(text(f"DROP TABLE {name}"))
+    conn.execute(text(f"ALTER TABLE {new.name} RENAME TO {name}"))
+    for sql in indexes:
+        conn.execute(text(sql))
+
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": name})
+    conn.execute(
+        text(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT :name, COALESCE(MAX(id), 0) "
+            f"FROM (SELECT id FROM {name} UNION ALL SELECT id FROM {archive}) AS ids"
+        ),
+        {"name": name},
+    )
+
+
+@migration(7, "Never reuse the ids of archived jios, food items and messages")
+def _autoincrement_ids(conn: Connection) -> None:
+    # Other databases use sequences, which never give out an id again
+    if conn.dialect.name != "sqlite":
+        return
+
+    # Ids which have already been given out again can no longer be archived, so the
+    # archived rows are moved out of the way. Only jios browsed from the archive are
+    # looked up by these ids.
+    _renumber_archived(
+        conn,
+        "archived_jios",
+        "supper_jios",
+        ("archived_orders", "jio_id"),
+        ("archived_order_items", "jio_id"),
+        ("archived_shared_messages", "jio_id"),
+    )
+    _renumber_archived(conn, "archived_order_items", "order_items")
+    _renumber_archived(conn, "archived_shared_messages", "shared_messages")
+
+    metadata = MetaData()
+    # Only the referenced columns are needed to create the foreign keys
+    Table("users", metadata, Column("id", BigInteger, primary_key=True))
+    Table("supper_jios", metadata, Column("id", Integer, primary_key=True))
+    Table(
+        "orders",
+        metadata,
+        Column("jio_id", Integer, primary_key=True),
+        Column("user_id", BigInteger, primary_key=True),
+    )
+    jios = Table(
+        "supper_jios_new",
+        metadata,
+        Column("id", Integer, primary_key=True, nullable=False),
+        Column("description", String, nullable=False),
+        Column("restaurant", String(32), nullable=False),
+        Column("owner_id", BigInteger, ForeignKey("users.id"), nullable=False),
+        Column("status", Integer, nullable=False),
+        Column("chat_id", BigInteger, nullable=True),
+        Column("message_id", Integer, unique=True, nullable=True),
+        Column("timestamp", DateTime, nullable=False),
+        Column("closed_at", DateTime, nullable=True),
+        Column("participant_count", Integer, nullable=False, server_default="0"),
+        Column("ordered_count", Integer, nullable=False, server_default="0"),
+        Column("paid_count", Integer, nullable=False, server_default="0"),
+        Column("item_count", Integer, nullable=False, server_default="0"),
+        sqlite_autoincrement=True,
+    )
+    items = Table(
+        "order_items_new",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("jio_id", Integer, nullable=False),
+        Column("user_id", BigInteger, nullable=False),
+        Column("position", Integer, nullable=False),
+        Column("food", String, nullable=False),
+        Column("normalized", String, nullable=False),
+        Column("created_at", DateTime, nullable=False),
+        ForeignKeyConstraint(
+            ["jio_id", "user_id"], ["orders.jio_id", "orders.user_id"]
+        ),
+        sqlite_autoincrement=True,
+    )
+    messages = Table(
+        "shared_messages_new",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("jio_id", Integer, ForeignKey("supper_jios.id")),
+        Column("message_id", String, unique=True),
+        sqlite_autoincrement=True,
+    )
+    _rebuild_with_autoincrement(conn, jios, "archived_jios")
+    _rebuild_with_autoincrement(conn, items, "archived_order_items")
+    _rebuild_with_autoincrement(conn, messages, "archived_shared_messages")
+
+
+def _record(conn: Connection, m: Migration) -> None:
+    conn.execute(
+        schema_migrations.insert().values(
+            version=m.version, description=m.description, applied_at=datetime.now()
+        )
+    )
+
+
+def run_migrations(conn: Connection) -> None:
+    """
+    Bring the database schema up to date.
+
+    All pending migrations are applied within the same transaction as the caller, so
+    a failing migration leaves the database untouched.
+    """
+    if not inspect(conn).has_table("supper_jios"):
+        logging.info("Creating a new database schema.")
+        Base.metadata.create_all(conn)
+        for m in MIGRATIONS:
+            _record(conn, m)
+        return
+
+    schema_migrations.create(conn, checkfirst=True)
+    applied = set(conn.scalars(select(schema_migrations.c.version)))
+
+    for m in MIGRATIONS:
+        if m.version in applied:
+            continue
+
+        logging.info(f"Applying migration {m.version}: {m.description}")
+        m.upgrade(conn)
+        _record(conn, m)
+
+    # Create any tables which are not managed by migrations
+    Base.metadata.create_all(conn)
+
+
+def check_schema_drift(conn: Connection) -> list[str]:
+    """
+    Compare the database schema against the models.
+
+    :return: A list of human-readable differences. An empty list means that every
+             table, column and index of the models is present in the database.
+    """
+    inspector = inspect(conn)
+    drift = []
+
+    for model in Base.metadata.sorted_tables:
+        name = model.name
+        if not inspector.has_table(name):
+            drift.append(f"Missing table {name}")
+            continue
+
+        columns = {col["name"] for col in inspector.get_columns(name)}
+        for col in model.columns:
+            if col.name not in columns:
+                drift.append(f"Missing column {name}.{col.name}")
+        for col_name in columns - set(model.columns.keys()):
+            drift.append(f"Unexpected column {name}.{col_name}")
+
+        indexes = {index["name"] for index in inspector.get_indexes(name)}
+        for index in model.indexes:
+            if index.name not in indexes:
+                drift.append(f"Missing index {index.name} on {name}")
+
+    return drift
+
+
+async def migrate(_=None) -> None:
+    """
+    Apply any pending migrations and report schema drift.
+
+    Used as the application's `post_init`.
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(run_migrations)
+        drift = await conn.run_sync(check_schema_drift)
+
+    for difference in drift:
+        logging.warning(f"Schema drift detected: {difference}")
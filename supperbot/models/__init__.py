@@ -1,7 +1,20 @@
+from supperbot.models.snapshot import JioSnapshot, OrderSnapshot
 from supperbot.models.favouriteorder import FavouriteOrder
 from supperbot.models.message import Message
+from supperbot.models.orderitem import OrderItem
 from supperbot.models.order import Order
 from supperbot.models.supperjio import SupperJio
+from supperbot.models.archive import ArchivedJio
 from supperbot.models.user import User
 
-__all__ = ["FavouriteOrder", "Message", "Order", "SupperJio", "User"]
+__all__ = [
+    "ArchivedJio",
+    "FavouriteOrder",
+    "JioSnapshot",
+    "Message",
+    "Order",
+    "OrderItem",
+    "OrderSnapshot",
+    "SupperJio",
+    "User",
+]
@@ -0,0 +1,147 @@
+"""
+Archive tables for supper jios which have been closed for a long time.
+
+Archived jios, together with their orders, food items and shared messages, are moved
+out of the hot tables so that the queries of the bot only have to consider recent
+jios. The archive tables have the same columns as the hot tables, without the foreign
+keys, and are only read when users browse their past jios.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    String,
+    Table,
+    literal,
+    select,
+)
+
+from supperbot.db import Base, get_session
+from supperbot.enums import Stage
+from supperbot.models.message import Message
+from supperbot.models.order import Order
+from supperbot.models.orderitem import OrderItem
+from supperbot.models.supperjio import SupperJio
+
+archived_jios = Table(
+    "archived_jios",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("restaurant", String(32), nullable=False),
+    Column("owner_id", BigInteger, nullable=False),
+    Column("status", Integer, nullable=False),
+    Column("chat_id", BigInteger, nullable=True),
+    Column("message_id", Integer, nullable=True),
+    Column("timestamp", DateTime, nullable=False),
+    Column("closed_at", DateTime, nullable=True),
+    Column("participant_count", Integer, nullable=False, server_default="0"),
+    Column("ordered_count", Integer, nullable=False, server_default="0"),
+    Column("paid_count", Integer, nullable=False, server_default="0"),
+    Column("item_count", Integer, nullable=False, server_default="0"),
+    Column("archived_at", DateTime, nullable=False),
+    Index("ix_archived_jios_owner_id_timestamp", "owner_id", "timestamp"),
+)
+
+archived_orders = Table(
+    "archived_orders",
+    Base.metadata,
+    Column("jio_id", Integer, primary_key=True),
+    Column("user_id", BigInteger, primary_key=True),
+    Column("paid", Integer),
+    Column("message_id", Integer, nullable=True),
+    Index("ix_archived_orders_user_id", "user_id"),
+)
+
+archived_order_items = Table(
+    "archived_order_items",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("jio_id", Integer, nullable=False),
+    Column("user_id", BigInteger, nullable=False),
+    Column("position", Integer, nullable=False),
+    Column("food", String, nullable=False),
+    Column("normalized", String, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Index(
+        "ix_archived_order_items_jio_id_user_id_position",
+        "jio_id",
+        "user_id",
+        "position",
+    ),
+)
+
+archived_shared_messages = Table(
+    "archived_shared_messages",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("jio_id", Integer),
+    Column("message_id", String),
+    Index("ix_archived_shared_messages_jio_id", "jio_id"),
+)
+
+# (hot table, archive table, column of the hot table with the jio id), with the
+# children first so that rows are deleted before the rows they reference
+_ARCHIVED_TABLES = (
+    (OrderItem.__table__, archived_order_items, OrderItem.jio_id),
+    (Order.__table__, archived_orders, Order.jio_id),
+    (Message.__table__, archived_shared_messages, Message.jio_id),
+    (SupperJio.__table__, archived_jios, SupperJio.id),
+)
+
+
+@dataclass(frozen=True)
+class ArchivedJio:
+    """An archived supper jio, as listed when browsing past jios."""
+
+    id: int
+    restaurant: str
+    timestamp: datetime
+
+    def __str__(self):
+        return f"Order {self.id}: {self.restaurant} (Archived, {self.timestamp.date()})"
+
+
+async def archive_closed_jios(*, closed_before: datetime, limit: int) -> list[int]:
+    """
+    Move up to `limit` jios closed before `closed_before`, together with their orders,
+    food items and shared messages, into the archive tables.
+
+    :return: The ids of the archived jios.
+    """
+    session = get_session()
+    stmt = (
+        select(SupperJio.id)
+        .where(SupperJio.status == Stage.CLOSED, SupperJio.closed_at < closed_before)
+        .order_by(SupperJio.closed_at)
+        .limit(limit)
+    )
+    jio_ids = (await session.scalars(stmt)).all()
+    if not jio_ids:
+        return []
+
+    now = datetime.now()
+    for hot, archive, jio_id in reversed(_ARCHIVED_TABLES):
+        columns = [c.name for c in hot.columns]
+        selected = [hot.c[name] for name in columns]
+        if "archived_at" in archive.c:
+            columns.append("archived_at")
+            selected.append(literal(now, DateTime))
+
+        await session.execute(
+            archive.insert().from_select(
+                columns, select(*selected).where(jio_id.in_(jio_ids))
+            )
+        )
+
+    for hot, _, jio_id in _ARCHIVED_TABLES:
+        await session.execute(hot.delete().where(jio_id.in_(jio_ids)))
+
+    return jio_ids
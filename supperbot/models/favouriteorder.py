@@ -2,7 +2,16 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Column, BigInteger, String, Integer, ForeignKey, delete, select
+from sqlalchemy import (
+    Column,
+    BigInteger,
+    String,
+    Integer,
+    ForeignKey,
+    Index,
+    delete,
+    select,
+)
 from sqlalchemy.orm import relationship
 
 from supperbot.db import Base, get_session
@@ -23,6 +32,10 @@ class FavouriteOrder(Base):
     restaurant = Column(String(32))
     food = Column(String)
 
+    __table_args__ = (
+        Index("ix_favourite_orders_user_id_restaurant", "user_id", "restaurant"),
+    )
+
     user = relationship("User", back_populates="favourite_orders")
 
     def __repr__(self):
@@ -32,7 +45,7 @@ class FavouriteOrder(Base):
         )
 
     @staticmethod
-    def create(user: User, restaurant: str, food: str):
+    async def create(user: User, restaurant: str, food: str):
         """
         Adds the user's favourite orders for a specified restaurant.
         Each user can only have up to 10 favourite orders per restaurant.
@@ -42,7 +55,7 @@ class FavouriteOrder(Base):
         :param food: The name of the favourite food.
         :return: A boolean indicating whether the insert was successful.
         """
-        favourite = user.get_favourite_foods(restaurant)
+        favourite = await user.get_favourite_foods(restaurant)
         if len(favourite) >= FavouriteOrder.MAX_FAVOURITE_ITEMS_PER_RESTAURANT:
             return False
 
@@ -51,21 +64,19 @@ class FavouriteOrder(Base):
             session.add(
                 FavouriteOrder(user_id=user.id, restaurant=restaurant, food=food)
             )
-            session.commit()
 
         return True
 
     @staticmethod
-    def get_favourite(fav_id: int) -> FavouriteOrder:
+    async def get_favourite(fav_id: int) -> FavouriteOrder:
         """
         Get a FavouriteOrder object based on its id
         """
         stmt = select(FavouriteOrder).filter_by(id=fav_id)
-        return get_session().scalars(stmt).one()
+        return (await get_session().scalars(stmt)).one()
 
     @staticmethod
-    def delete(fav_id: int, user_id: int):
+    async def delete(fav_id: int, user_id: int):
         session = get_session()
         stmt = delete(FavouriteOrder).filter_by(id=fav_id, user_id=user_id)
-        session.execute(stmt)
-        session.commit()
+        await session.execute(stmt)
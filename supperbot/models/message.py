@@ -3,6 +3,7 @@ from __future__ import annotations
 from sqlalchemy import Column, String, Integer, ForeignKey
 from sqlalchemy.orm import relationship
 
+from supperbot.cache import jio_cache
 from supperbot.db import Base, get_session
 
 
@@ -12,9 +13,11 @@ class Message(Base):
     """
 
     __tablename__ = "shared_messages"
+    # Ids of archived messages must not be given out again, see `SupperJio`
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = Column(Integer, primary_key=True)
-    jio_id = Column(Integer, ForeignKey("supper_jios.id"))
+    jio_id = Column(Integer, ForeignKey("supper_jios.id"), index=True)
     message_id = Column(String, unique=True)
 
     jio = relationship("SupperJio", back_populates="shared_messages")
@@ -25,8 +28,6 @@ class Message(Base):
     @staticmethod
     def create(jio_id: int, message_id: str) -> Message:
         msg = Message(jio_id=jio_id, message_id=message_id)
-
-        session = get_session()
-        session.add(msg)
-        session.commit()
+        get_session().add(msg)
+        jio_cache.invalidate(jio_id)
         return msg
@@ -1,48 +1,70 @@
 from __future__ import annotations
 
-import logging
 from typing import TYPE_CHECKING
 
 from sqlalchemy import (
     Column,
     BigInteger,
-    String,
     Integer,
+    delete,
+    func,
+    insert,
+    inspect,
     select,
+    update,
     ForeignKey,
     PrimaryKeyConstraint,
 )
-from sqlalchemy.orm import relationship
-
-from telegram import (
-    Bot,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
-    ReplyKeyboardRemove,
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.orm import (
+    joinedload,
+    make_transient_to_detached,
+    relationship,
+    selectinload,
 )
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql import Update
+
+from telegram import Bot, ReplyKeyboardRemove
 from telegram.constants import ParseMode
-from telegram.error import BadRequest
 
-from supperbot.db import Base, get_session
-from supperbot.enums import CallbackType, join, PaidStatus
+from supperbot.cache import jio_cache
+from supperbot.db import Base, get_session, write
+from supperbot.edits import content_hash, edit_tracker, message_key
+from supperbot.enums import PaidStatus
+from supperbot.fanout import FanoutReport
+from supperbot.models.orderitem import OrderItem
+from supperbot.models.snapshot import OrderSnapshot
 
 if TYPE_CHECKING:
     from supperbot.models import SupperJio, User
 
 
+def _update_counters(jio_id: int, **changes: int) -> Update:
+    """
+    Returns a statement adding the changes to the counters of the jio, eg.
+    `_update_counters(jio_id, item_count=1)`.
+    """
+    jios = Base.metadata.tables["supper_jios"]
+    return (
+        jios.update()
+        .where(jios.c.id == jio_id)
+        .values({name: jios.c[name] + change for name, change in changes.items()})
+    )
+
+
 class Order(Base):
     """
     Represents an order made by a user for a specific supper jio.
 
-    The food orders are consolidated into a single tab separated string instead
-    of using another table.
+    Each food item of the order is stored as an `OrderItem`.
     """
 
     __tablename__ = "orders"
 
     jio_id = Column(Integer, ForeignKey("supper_jios.id"))
-    user_id = Column(BigInteger, ForeignKey("users.id"))
-    food = Column(String)  # Tab separated
+    user_id = Column(BigInteger, ForeignKey("users.id"), index=True)
     paid = Column(Integer)
     message_id = Column(Integer, unique=True, nullable=True)
 
@@ -50,37 +72,47 @@ class Order(Base):
 
     user = relationship("User", back_populates="orders")
     jio = relationship("SupperJio", back_populates="orders")
+    items: list[OrderItem] = relationship(
+        "OrderItem",
+        back_populates="order",
+        order_by="OrderItem.position",
+        cascade="all, delete-orphan",
+    )
 
     def has_paid(self) -> bool:
         return self.paid == PaidStatus.PAID
 
     @property
     def food_list(self) -> list[str]:
-        return self.food.split("\t") if self.food else []
+        return [item.food for item in self.items]
 
     def __repr__(self):
-        return f"Order {self.jio_id}: ({self.user_id=}) {self.food}"
+        return f"Order {self.jio_id}: ({self.user_id=}) {self.food_list}"
 
-    def __str__(self):
-        jio = self.jio
-        message = (
-            f"Supper Jio Order #{jio.id}: <b>{jio.restaurant}</b>\n"
-            f"Additional Information: \n{jio.description}\n\n"
-            "Your Orders:\n"
-        )
-
-        message += "\n".join(self.food_list) if self.food_list else "None"
+    def _apply_counter_changes(self, **changes: int) -> None:
+        """
+        Apply changes which have already been written to the database to the counters
+        of the jio, if it has been loaded, so that it can be rendered without having to
+        load it again.
+        """
+        if "jio" in inspect(self).unloaded:
+            return
 
-        if self.has_paid():
-            message += "\n\n💰 You have declared payment! 💰"
+        jio = self.jio
+        for name, change in changes.items():
+            set_committed_value(jio, name, getattr(jio, name) + change)
 
-        if jio.is_closed():
-            message += "\n\n🛑 Jio is closed! 🛑"
+    def snapshot(self) -> OrderSnapshot:
+        """
+        Returns a snapshot of the order for rendering the user's order message.
 
-        return message
+        The `jio` and `user` relationships must already be loaded, eg. through
+        `create_order`.
+        """
+        return OrderSnapshot.from_order(self, self.jio)
 
     @staticmethod
-    def create_order(
+    async def create_order(
         jio: SupperJio = None,
         user: User = None,
         jio_id: int = None,
@@ -91,117 +123,176 @@ class Order(Base):
         not already exist.
 
         Either jio or jio_id, and either user or user_id, must be present.
+
+        :raises NoResultFound: If the jio does not exist, eg. as it has been archived.
+
+        The returned order has its `jio`, `user` and `items` relationships loaded, as
+        lazy loading is not possible with an async session.
         """
-        jio_id = jio_id or jio.id
-        user_id = user_id or user.id
+        jio_id = jio.id if jio_id is None else jio_id
+        user_id = user.id if user_id is None else user_id
         session = get_session()
-        stmt = select(Order).filter_by(jio_id=jio_id, user_id=user_id)
-        order = session.scalars(stmt).one_or_none()
+        stmt = (
+            select(Order)
+            .filter_by(jio_id=jio_id, user_id=user_id)
+            .options(
+                joinedload(Order.jio),
+                joinedload(Order.user),
+                selectinload(Order.items),
+            )
+        )
+        order = (await session.scalars(stmt)).one_or_none()
 
         # If there is no existing order for this jio and user, then create a new one
         if order is None:
+            if jio is None:
+                # eg. a button of a jio which has since been archived
+                jios = Base.metadata.tables["supper_jios"]
+                if await session.scalar(select(jios.c.id).filter_by(id=jio_id)) is None:
+                    raise NoResultFound(f"Supper jio {jio_id} does not exist.")
+
             order = Order(
-                jio_id=jio_id, user_id=user_id, food="", paid=PaidStatus.NOT_PAID
+                jio_id=jio_id, user_id=user_id, paid=PaidStatus.NOT_PAID, items=[]
             )
+            # Setting the relationships also adds the order to any `jio.orders` that
+            # has already been loaded, so that rendering the jio includes this order.
+            if jio is not None:
+                order.jio = jio
+            if user is not None:
+                order.user = user
+
             session.add(order)
-            session.commit()
+            jio_cache.invalidate(jio_id)
+
+            async def count_participant(conn: AsyncConnection) -> None:
+                await conn.execute(_update_counters(jio_id, participant_count=1))
+
+            await write(count_participant)
+            order._apply_counter_changes(participant_count=1)
+
+            if jio is None or user is None:
+                order = (await session.scalars(stmt)).one()
 
         return order
 
-    def add_food(self, food: str) -> None:
+    async def add_food(self, food: str) -> None:
         """
-        The food orders are strong in a single row per user per jio, delimited by tabs.
+        Add a food item to the end of the order.
         """
-        if self.food:
-            self.food += "\t" + food
-        else:
-            self.food = food
+        item = OrderItem(food, position=0)
+        jio_id, user_id = self.jio_id, self.user_id
+
+        async def insert_item(conn: AsyncConnection) -> tuple[int, int, int]:
+            count, position = (
+                await conn.execute(
+                    select(
+                        func.count(),
+                        func.coalesce(func.max(OrderItem.position) + 1, 0),
+                    ).where(OrderItem.jio_id == jio_id, OrderItem.user_id == user_id)
+                )
+            ).one()
+            result = await conn.execute(
+                insert(OrderItem).values(
+                    jio_id=jio_id,
+                    user_id=user_id,
+                    position=position,
+                    food=item.food,
+                    normalized=item.normalized,
+                    created_at=item.created_at,
+                )
+            )
+            # The user has ordered something once their first item is added
+            ordered = 1 if count == 0 else 0
+            await conn.execute(
+                _update_counters(jio_id, item_count=1, ordered_count=ordered)
+            )
+            return result.inserted_primary_key[0], position, ordered
+
+        item.id, item.position, ordered = await write(insert_item)
+        item.jio_id, item.user_id = jio_id, user_id
 
-        get_session().commit()
+        # The row has already been written, so the item is attached to the order
+        # without the session tracking it as a change.
+        make_transient_to_detached(item)
+        set_committed_value(self, "items", [*self.items, item])
+        self._apply_counter_changes(item_count=1, ordered_count=ordered)
+        jio_cache.invalidate(jio_id)
 
-    def delete_food(self, food_idx: int) -> None:
+    async def delete_food(self, item_id: int) -> None:
         """
-        Delete a food order based on its position.
+        Delete a food item based on its id.
 
-        Deletion is based on position instead of the name of the food, due to
+        Deletion is based on the id instead of the name of the food, due to
         1) Possibility of multiple foods with the same name
         2) Telegram callback information is limited to 64 bytes
         """
-        old = self.food_list
-        if food_idx > len(old):
-            raise ValueError(
-                "The index of the food should be smaller than the size of the list."
-            )
-        old.pop(food_idx)
-        self.food = "\t".join(old)
-        get_session().commit()
+        if all(item.id != item_id for item in self.items):
+            raise ValueError(f"The food item {item_id} is not part of this order.")
 
-    def update(self, *, message_id: int = None, paid_status: PaidStatus = None) -> None:
-        if message_id is not None:
-            self.message_id = message_id
+        jio_id, user_id = self.jio_id, self.user_id
 
-        if paid_status is not None:
-            self.paid = paid_status
-        get_session().commit()
+        async def delete_item(conn: AsyncConnection) -> dict[str, int]:
+            result = await conn.execute(
+                delete(OrderItem).filter_by(id=item_id, jio_id=jio_id, user_id=user_id)
+            )
+            if result.rowcount == 0:
+                return {}
 
-    @property
-    def keyboard_markup(self) -> InlineKeyboardMarkup | None:
-        jio = self.jio
-        jio_str = str(self.jio_id)
-
-        if not jio.is_closed():
-            return InlineKeyboardMarkup(
-                [
-                    [
-                        InlineKeyboardButton(
-                            "➕ Add Order",
-                            callback_data=join(CallbackType.ADD_ORDER, jio_str),
-                        ),
-                        InlineKeyboardButton(
-                            "❌ Delete Order",
-                            callback_data=join(CallbackType.DELETE_ORDER, jio_str),
-                        ),
-                    ],
-                    [
-                        InlineKeyboardButton(
-                            "⭐ Favourite Item",
-                            callback_data=join(CallbackType.FAVOURITE_ITEM, jio_str),
-                        )
-                    ],
-                ]
+            remaining = await conn.scalar(
+                select(func.count()).where(
+                    OrderItem.jio_id == jio_id, OrderItem.user_id == user_id
+                )
             )
+            changes = {"item_count": -1, "ordered_count": -1 if remaining == 0 else 0}
+            await conn.execute(_update_counters(jio_id, **changes))
+            return changes
 
-        if not self.food_list:
-            # User doesn't even have a food order. Don't let them declare payment.
-            return None
+        changes = await write(delete_item)
+        set_committed_value(
+            self, "items", [item for item in self.items if item.id != item_id]
+        )
+        self._apply_counter_changes(**changes)
+        jio_cache.invalidate(jio_id)
 
-        if self.has_paid():
-            result = [
-                InlineKeyboardButton(
-                    "Undo Payment Declaration",
-                    callback_data=join(CallbackType.UNDO_PAYMENT, jio_str),
-                )
-            ]
-        else:
-            result = [
-                InlineKeyboardButton(
-                    "Declare Payment",
-                    callback_data=join(CallbackType.DECLARE_PAYMENT, jio_str),
+    async def update(
+        self, *, message_id: int = None, paid_status: PaidStatus = None
+    ) -> None:
+        if message_id is not None:
+            self.message_id = message_id
+
+        if paid_status is not None and paid_status != self.paid:
+            jio_id, user_id = self.jio_id, self.user_id
+            change = 1 if paid_status == PaidStatus.PAID else -1
+
+            async def update_paid(conn: AsyncConnection) -> bool:
+                result = await conn.execute(
+                    update(Order)
+                    .where(
+                        Order.jio_id == jio_id,
+                        Order.user_id == user_id,
+                        Order.paid != paid_status,
+                    )
+                    .values(paid=paid_status)
                 )
-            ]
+                if result.rowcount == 0:
+                    return False
 
-        result.append(
-            InlineKeyboardButton(
-                "⭐ Favourite Item",
-                callback_data=join(CallbackType.FAVOURITE_ITEM, jio_str),
-            )
-        )
+                await conn.execute(_update_counters(jio_id, paid_count=change))
+                return True
+
+            if await write(update_paid):
+                self._apply_counter_changes(paid_count=change)
+            set_committed_value(self, "paid", paid_status)
 
-        return InlineKeyboardMarkup.from_column(result)
+        jio_cache.invalidate(self.jio_id)
 
-    async def send_user_order(self, bot: Bot, *, remove_reply_markup: bool = False):
+    async def send_user_order(
+        self, bot: Bot, *, remove_reply_markup: bool = False, header: str = ""
+    ):
         """
         Sends a new message containing the user's food orders and updates the database.
+
+        :param header: Text shown above the orders, eg. a reminder to pay.
         """
         # TODO: Check if a user revoking permission for the bot to send a message will
         #       cause an error
@@ -218,15 +309,21 @@ class Order(Base):
             await clear_msg.delete()
 
         # TODO: Should try remove the previous buttons
+        snapshot = self.snapshot()
+        text = header + snapshot.message
         msg = await bot.send_message(
             chat_id=self.user.chat_id,
-            text=str(self),
-            reply_markup=self.keyboard_markup,
+            text=text,
+            reply_markup=snapshot.keyboard_markup,
             parse_mode=ParseMode.HTML,
         )
-        self.update(message_id=msg.message_id)
+        edit_tracker.record(
+            message_key(msg.chat_id, msg.message_id),
+            content_hash(text, snapshot.keyboard_markup),
+        )
+        await self.update(message_id=msg.message_id)
 
-    async def update_user_order(self, bot: Bot):
+    async def update_user_order(self, bot: Bot) -> FanoutReport:
         """
         Similar to `send_user_order`, except that it edits the (latest sent) message
         instead of sending a new one. This is more useful in scenarios where it is less
@@ -234,16 +331,4 @@ class Order(Base):
 
         Note that messages can only be edited within 48 hours.
         """
-        # TODO: Maybe make it resend if cannot edit?
-        try:
-            await bot.edit_message_text(
-                str(self),
-                chat_id=self.user.chat_id,
-                message_id=self.message_id,
-                parse_mode=ParseMode.HTML,
-                reply_markup=self.keyboard_markup,
-            )
-        except BadRequest as e:
-            logging.error(
-                f"Unable to edit individual order message for user {self.user}: {e}"
-            )
+        return await self.snapshot().update_user_order(bot)
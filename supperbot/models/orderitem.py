@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from datetime import datetime
+
+from sqlalchemy import (
+    Column,
+    BigInteger,
+    DateTime,
+    ForeignKeyConstraint,
+    Index,
+    Integer,
+    String,
+    func,
+    select,
+)
+from sqlalchemy.orm import relationship
+
+from supperbot.db import Base, get_session
+
+
+def normalize_food(food: str) -> str:
+    """
+    Normalize the name of a food item, so that similar orders can be counted together.
+    """
+    return " ".join(food.lower().split())
+
+
+class OrderItem(Base):
+    """
+    Represents a single food item in a user's order for a supper jio.
+    """
+
+    __tablename__ = "order_items"
+
+    id = Column(Integer, primary_key=True)
+    jio_id = Column(Integer, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    position = Column(Integer, nullable=False)
+    food = Column(String, nullable=False)
+    normalized = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["jio_id", "user_id"], ["orders.jio_id", "orders.user_id"]
+        ),
+        Index(
+            "ix_order_items_jio_id_user_id_position", "jio_id", "user_id", "position"
+        ),
+        Index("ix_order_items_jio_id_normalized", "jio_id", "normalized"),
+        # Ids of archived items must not be given out again, see `SupperJio`
+        {"sqlite_autoincrement": True},
+    )
+
+    order = relationship("Order", back_populates="items")
+
+    def __init__(self, food: str, position: int):
+        self.food = food
+        self.normalized = normalize_food(food)
+        self.position = position
+        self.created_at = datetime.now()
+
+    def __repr__(self):
+        return f"OrderItem({self.id=}, {self.jio_id=}, {self.user_id=}, {self.food=})"
+
+    @staticmethod
+    async def count_by_food(jio_id: int) -> list[tuple[str, int]]:
+        """
+        Count the number of each (normalized) food item ordered for a jio, in the order
+        that they were first ordered.
+        """
+        stmt = (
+            select(OrderItem.normalized, func.count())
+            .filter_by(jio_id=jio_id)
+            .group_by(OrderItem.normalized)
+            .order_by(func.min(OrderItem.id))
+        )
+        return (await get_session().execute(stmt)).all()
@@ -0,0 +1,444 @@
+"""
+Immutable snapshots of supper jios and orders, used to render the jio messages.
+
+Snapshots are built from ORM objects whose relationships have already been loaded, so
+rendering them (possibly many times during a fan-out) never issues another query.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from telegram import Bot, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.helpers import create_deep_linked_url
+
+from config import JIO_SUMMARY_HEADER
+from supperbot.cache import jio_cache
+from supperbot.db import Base, write
+from supperbot.enums import CallbackType, join, PaidStatus, Stage
+from supperbot.fanout import FanoutReport, Target, edit_target, fan_out
+from supperbot.priority import Priority
+
+if TYPE_CHECKING:
+    from supperbot.models import Order, SupperJio
+
+
+async def _save_order_message_id(jio_id: int, user_id: int, message_id: int) -> None:
+    """
+    Store the id of an individual order message which was sent again during a fan-out.
+    """
+    orders = Base.metadata.tables["orders"]
+
+    async def save(conn: AsyncConnection) -> None:
+        await conn.execute(
+            update(orders)
+            .where(orders.c.jio_id == jio_id, orders.c.user_id == user_id)
+            .values(message_id=message_id)
+        )
+
+    await write(save)
+    jio_cache.invalidate(jio_id)
+
+
+async def _save_jio_message_id(jio_id: int, message_id: int) -> None:
+    """
+    Store the id of a host's jio message which was sent again during a fan-out.
+    """
+    jios = Base.metadata.tables["supper_jios"]
+
+    async def save(conn: AsyncConnection) -> None:
+        await conn.execute(
+            update(jios).where(jios.c.id == jio_id).values(message_id=message_id)
+        )
+
+    await write(save)
+    jio_cache.invalidate(jio_id)
+
+
+@dataclass(frozen=True)
+class OrderSnapshot:
+    """A user's order, together with the jio details needed to render it."""
+
+    jio_id: int
+    restaurant: str
+    description: str
+    jio_closed: bool
+    user_id: int
+    display_name: str
+    chat_id: int
+    food_list: tuple[str, ...]
+    paid: bool
+    message_id: int | None
+
+    @staticmethod
+    def from_order(order: Order, jio: SupperJio) -> OrderSnapshot:
+        return OrderSnapshot(
+            jio_id=jio.id,
+            restaurant=jio.restaurant,
+            description=jio.description,
+            jio_closed=jio.is_closed(),
+            user_id=order.user_id,
+            display_name=order.user.display_name,
+            chat_id=order.user.chat_id,
+            food_list=tuple(order.food_list),
+            paid=order.paid == PaidStatus.PAID,
+            message_id=order.message_id,
+        )
+
+    def has_paid(self) -> bool:
+        return self.paid
+
+    @property
+    def message(self) -> str:
+        """
+        The text of the user's individual order message.
+        """
+        message = (
+            f"Supper Jio Order #{self.jio_id}: <b>{self.restaurant}</b>\n"
+            f"Additional Information: \n{self.description}\n\n"
+            "Your Orders:\n"
+        )
+
+        message += "\n".join(self.food_list) if self.food_list else "None"
+
+        if self.has_paid():
+            message += "\n\n💰 You have declared payment! 💰"
+
+        if self.jio_closed:
+            message += "\n\n🛑 Jio is closed! 🛑"
+
+        return message
+
+    @property
+    def keyboard_markup(self) -> InlineKeyboardMarkup | None:
+        jio_str = str(self.jio_id)
+
+        if not self.jio_closed:
+            return InlineKeyboardMarkup(
+                [
+                    [
+                        InlineKeyboardButton(
+                            "➕ Add Order",
+                            callback_data=join(CallbackType.ADD_ORDER, jio_str),
+                        ),
+                        InlineKeyboardButton(
+                            "❌ Delete Order",
+                            callback_data=join(CallbackType.DELETE_ORDER, jio_str),
+                        ),
+                    ],
+                    [
+                        InlineKeyboardButton(
+                            "⭐ Favourite Item",
+                            callback_data=join(CallbackType.FAVOURITE_ITEM, jio_str),
+                        )
+                    ],
+                ]
+            )
+
+        if not self.food_list:
+            # User doesn't even have a food order. Don't let them declare payment.
+            return None
+
+        if self.has_paid():
+            result = [
+                InlineKeyboardButton(
+                    "Undo Payment Declaration",
+                    callback_data=join(CallbackType.UNDO_PAYMENT, jio_str),
+                )
+            ]
+        else:
+            result = [
+                InlineKeyboardButton(
+                    "Declare Payment",
+                    callback_data=join(CallbackType.DECLARE_PAYMENT, jio_str),
+                )
+            ]
+
+        result.append(
+            InlineKeyboardButton(
+                "⭐ Favourite Item",
+                callback_data=join(CallbackType.FAVOURITE_ITEM, jio_str),
+            )
+        )
+
+        return InlineKeyboardMarkup.from_column(result)
+
+    @property
+    def formatted(self) -> str:
+        """
+        Formats the order for the consolidated jio messages.
+        """
+        if not self.food_list:
+            return f"{self.display_name} -- None"
+
+        ordered = f"{self.display_name} -- " + "; ".join(self.food_list)
+
+        if self.has_paid():
+            return "<s>" + ordered + "</s> Paid"
+        return ordered
+
+    def edit_target(self, bot: Bot, priority: Priority = Priority.BULK) -> Target:
+        """
+        The fan-out target which edits the (latest sent) individual order message of
+        the user.
+        """
+        return edit_target(
+            f"individual order message for user {self.user_id}",
+            bot,
+            self.message,
+            self.keyboard_markup,
+            chat_id=self.chat_id,
+            message_id=self.message_id,
+            priority=priority,
+            on_resent=lambda message_id: _save_order_message_id(
+                self.jio_id, self.user_id, message_id
+            ),
+        )
+
+    async def update_user_order(self, bot: Bot) -> FanoutReport:
+        """
+        Edits the (latest sent) individual order message of the user.
+
+        Note that messages can only be edited within 48 hours, after which a new
+        message is sent instead.
+        """
+        return await fan_out([self.edit_target(bot, Priority.INTERACTIVE)])
+
+
+@dataclass(frozen=True)
+class JioSnapshot:
+    """A supper jio, together with its orders and shared messages."""
+
+    id: int
+    restaurant: str
+    description: str
+    owner_id: int
+    status: Stage
+    chat_id: int | None
+    message_id: int | None
+    orders: tuple[OrderSnapshot, ...]
+    shared_message_ids: tuple[str, ...]
+    participant_count: int
+    ordered_count: int
+    paid_count: int
+    item_count: int
+
+    @staticmethod
+    def from_jio(jio: SupperJio) -> JioSnapshot:
+        """
+        Create a snapshot from a jio whose orders (and their users) and shared messages
+        have been loaded, eg. through `SupperJio.get_jio`.
+        """
+        return JioSnapshot(
+            id=jio.id,
+            restaurant=jio.restaurant,
+            description=jio.description,
+            owner_id=jio.owner_id,
+            status=Stage(jio.status),
+            chat_id=jio.chat_id,
+            message_id=jio.message_id,
+            orders=tuple(OrderSnapshot.from_order(order, jio) for order in jio.orders),
+            shared_message_ids=tuple(msg.message_id for msg in jio.shared_messages),
+            participant_count=jio.participant_count,
+            ordered_count=jio.ordered_count,
+            paid_count=jio.paid_count,
+            item_count=jio.item_count,
+        )
+
+    def is_closed(self) -> bool:
+        return self.status == Stage.CLOSED
+
+    @property
+    def message(self) -> str:
+        """
+        The text that will be displayed in the host's main message and the shared
+        messages in the groups.
+        """
+        message = (
+            f"Supper Jio Order #{self.id}: <b>{self.restaurant}</b>\n"
+            f"Additional Information: \n{self.description}\n\n"
+        )
+
+        if JIO_SUMMARY_HEADER:
+            message += f"{self.summary}\n\n"
+
+        message += "Current Orders:\n"
+
+        order_list = "\n".join(
+            order.formatted for order in self.orders if order.food_list
+        )
+        message += order_list if order_list else "None"
+
+        if self.is_closed():
+            message += "\n🛑 Jio is closed! 🛑"
+
+        return message
+
+    @property
+    def summary(self) -> str:
+        """
+        A one line summary of the orders, from the counters of the jio.
+        """
+        return (
+            f"👥 {self.participant_count} joined, {self.ordered_count} ordered, "
+            f"{self.paid_count} paid, {self.item_count} item(s)"
+        )
+
+    @property
+    def keyboard_markup(self) -> InlineKeyboardMarkup:
+        """
+        The inline keyboard markup for the host main message.
+        """
+        jio_str = str(self.id)
+
+        if self.is_closed():
+            return InlineKeyboardMarkup.from_column(
+                [
+                    InlineKeyboardButton(
+                        "🔓 Reopen the jio",
+                        callback_data=join(CallbackType.REOPEN_JIO, jio_str),
+                    ),
+                    InlineKeyboardButton(
+                        "✍️Create Ordering List",
+                        callback_data=join(CallbackType.CREATE_ORDERING_LIST, jio_str),
+                    ),
+                    InlineKeyboardButton(
+                        "🔔 Ping Unpaid",
+                        callback_data=join(CallbackType.PING_ALL_UNPAID, jio_str),
+                    ),
+                    InlineKeyboardButton(
+                        "📢 Broadcast Message",
+                        callback_data=join(CallbackType.BROADCAST_MESSAGE, jio_str),
+                    ),
+                    InlineKeyboardButton(
+                        "♻ Refresh Message",
+                        callback_data=join(CallbackType.RESEND_MAIN_MESSAGE, jio_str),
+                    ),
+                ],
+            )
+
+        return InlineKeyboardMarkup(
+            [
+                [
+                    InlineKeyboardButton(
+                        "📢 Share this Jio!", switch_inline_query=f"order{jio_str}"
+                    ),
+                ],
+                [
+                    InlineKeyboardButton(
+                        "Add Order",
+                        callback_data=join(CallbackType.OWNER_ADD_ORDER, jio_str),
+                    ),
+                    InlineKeyboardButton(
+                        "🔒 Close the Jio",
+                        callback_data=join(CallbackType.CLOSE_JIO, jio_str),
+                    ),
+                ],
+                [
+                    InlineKeyboardButton(
+                        "🗒️ Edit Description",
+                        callback_data=join(CallbackType.AMEND_DESCRIPTION, jio_str),
+                    ),
+                    InlineKeyboardButton(
+                        "♻ Refresh Message",
+                        callback_data=join(CallbackType.RESEND_MAIN_MESSAGE, jio_str),
+                    ),
+                ],
+            ]
+        )
+
+    def shared_message_reply_markup(self, bot: Bot) -> InlineKeyboardMarkup | None:
+        if self.is_closed():
+            return None
+
+        return InlineKeyboardMarkup.from_button(
+            InlineKeyboardButton(
+                text="➕ Add Order",
+                url=create_deep_linked_url(bot.username, f"order{self.id}"),
+            )
+        )
+
+    def _main_message_target(self, bot: Bot) -> Target:
+        return edit_target(
+            f"original jio message for order {self.id}",
+            bot,
+            self.message,
+            self.keyboard_markup,
+            chat_id=self.chat_id,
+            message_id=self.message_id,
+            priority=Priority.INTERACTIVE,
+            on_resent=lambda message_id: _save_jio_message_id(self.id, message_id),
+        )
+
+    def _shared_message_targets(self, bot: Bot) -> list[Target]:
+        text = self.message
+        reply_markup = self.shared_message_reply_markup(bot)
+        return [
+            edit_target(
+                f"message with message_id {message_id}",
+                bot,
+                text,
+                reply_markup,
+                inline_message_id=message_id,
+                priority=Priority.BULK,
+            )
+            for message_id in self.shared_message_ids
+        ]
+
+    def _individual_order_targets(self, bot: Bot) -> list[Target]:
+        return [order.edit_target(bot) for order in self.orders]
+
+    async def update_main_jio_message(self, bot: Bot) -> FanoutReport:
+        """
+        Update the host's jio message, i.e. the one used to control the supper jio.
+        """
+        return await fan_out([self._main_message_target(bot)])
+
+    async def update_shared_jio_messages(self, bot: Bot) -> FanoutReport:
+        """
+        Updates all shared jio messages, i.e. the messages sent to groups by the host.
+        """
+        return await fan_out(self._shared_message_targets(bot))
+
+    async def update_consolidated_jio_messages(self, bot: Bot) -> FanoutReport:
+        """
+        Updates the host's jio message and the shared jio messages concurrently, i.e.
+        all messages showing the consolidated orders.
+        """
+        return await fan_out(
+            [self._main_message_target(bot), *self._shared_message_targets(bot)]
+        )
+
+    async def update_individual_order_messages(self, bot: Bot) -> FanoutReport:
+        """
+        Updates all individual order messages.
+
+        Obviously, this method uses the API a lot, especially if there are many users.
+        Care must be taken to ensure that all functions using this method are rate
+        limited.
+        """
+        return await fan_out(self._individual_order_targets(bot))
+
+    async def update_all_jio_messages(self, bot: Bot) -> FanoutReport:
+        """
+        Updates all messages relating to this jio, i.e. the host's message, the shared
+        messages and the individual user messages.
+
+        Essentially just `update_main_jio_message`, `update_shared_jio_messages` and
+        `update_individual_order_messages` all together, except that all messages are
+        edited concurrently (up to `FANOUT_CONCURRENCY` at once).
+
+        As this method uses the API a lot, especially if there are many users in this
+        Supper Jio, care must be taken to ensure that all function using this method
+        are rate limited.
+        """
+        return await fan_out(
+            [
+                self._main_message_target(bot),
+                *self._shared_message_targets(bot),
+                *self._individual_order_targets(bot),
+            ]
+        )
@@ -1,21 +1,31 @@
 from __future__ import annotations
 
 from datetime import datetime
-import logging
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Column, BigInteger, String, Integer, select, ForeignKey
-from sqlalchemy.orm import relationship
-
-from telegram import Bot, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.constants import ParseMode
-from telegram.error import BadRequest
-from telegram.helpers import create_deep_linked_url
-
+from sqlalchemy import (
+    Column,
+    BigInteger,
+    DateTime,
+    String,
+    Integer,
+    Index,
+    and_,
+    case,
+    func,
+    or_,
+    select,
+    ForeignKey,
+)
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.orm import joinedload, relationship, selectinload
+
+from supperbot.cache import jio_cache
 from supperbot.db import Base, get_session
-from supperbot.enums import CallbackType, join, Stage
+from supperbot.enums import PaidStatus, Stage
 
-from supperbot.models import Order
+from supperbot.models import Order, OrderItem
+from supperbot.models.snapshot import JioSnapshot
 
 if TYPE_CHECKING:
     from supperbot.models import User, Message
@@ -33,7 +43,29 @@ class SupperJio(Base):
     status = Column(Integer, nullable=False)
     chat_id = Column(BigInteger, nullable=True)
     message_id = Column(Integer, unique=True, nullable=True)
-    timestamp = Column(String, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+    closed_at = Column(DateTime, nullable=True)
+
+    # Counters maintained together with the orders, so that summaries of the jio do
+    # not have to go through all of its orders
+    participant_count = Column(Integer, nullable=False, server_default="0")
+    ordered_count = Column(Integer, nullable=False, server_default="0")
+    paid_count = Column(Integer, nullable=False, server_default="0")
+    item_count = Column(Integer, nullable=False, server_default="0")
+
+    __table_args__ = (
+        Index(
+            "ix_supper_jios_owner_id_status_timestamp",
+            "owner_id",
+            "status",
+            "timestamp",
+        ),
+        Index("ix_supper_jios_owner_id_timestamp", "owner_id", "timestamp"),
+        Index("ix_supper_jios_status_closed_at", "status", "closed_at"),
+        # Archiving removes the jios with the highest ids, which SQLite would otherwise
+        # give out again
+        {"sqlite_autoincrement": True},
+    )
 
     owner: User = relationship("User", back_populates="jios")
     shared_messages: list[Message] = relationship("Message", back_populates="jio")
@@ -45,27 +77,67 @@ class SupperJio(Base):
         self.restaurant = restaurant
         self.description = description
         self.status = Stage.CREATED
-        self.timestamp = str(datetime.now())
+        self.timestamp = datetime.now()
+        self.participant_count = 0
+        self.ordered_count = 0
+        self.paid_count = 0
+        self.item_count = 0
+
+        # A new jio has no orders or shared messages. Marking the collections as loaded
+        # prevents them from being lazy loaded, which is not possible with asyncio.
+        self.orders = []
+        self.shared_messages = []
 
     def __str__(self):
         closed = "Closed, " if self.status == Stage.CLOSED else ""
-        return f"Order {self.id}: {self.restaurant} ({closed + self.timestamp[:10]})"
+        return f"Order {self.id}: {self.restaurant} ({closed}{self.timestamp.date()})"
 
     @staticmethod
-    def create(owner_id: int, restaurant: str, description: str) -> SupperJio:
+    async def create(owner_id: int, restaurant: str, description: str) -> SupperJio:
         jio = SupperJio(owner_id, restaurant, description)
 
         session = get_session()
         session.add(jio)
-        session.commit()
+        await session.flush()  # Obtain the id of the jio
         return jio
 
     @staticmethod
-    def get_jio(jio_id: int) -> SupperJio:
-        stmt = select(SupperJio).where(SupperJio.id == jio_id)
+    async def get_jio(jio_id: int) -> SupperJio:
+        """
+        Get a Supper Jio, together with its orders, the users who made them and its
+        shared messages, as these are required to render the jio messages.
+
+        Everything is loaded in three queries, regardless of the number of orders:
+        one for the jio and its shared messages, one for the orders and their users,
+        and one for the food items of the orders.
+        """
+        stmt = (
+            select(SupperJio)
+            .where(SupperJio.id == jio_id)
+            .options(
+                joinedload(SupperJio.shared_messages),
+                selectinload(SupperJio.orders).joinedload(Order.user),
+                selectinload(SupperJio.orders).selectinload(Order.items),
+            )
+            .execution_options(populate_existing=True)
+        )
         session = get_session()
 
-        return session.scalars(stmt).one()
+        return (await session.scalars(stmt)).unique().one()
+
+    @staticmethod
+    async def get_snapshot(jio_id: int) -> JioSnapshot:
+        """
+        Get an immutable snapshot of a Supper Jio for rendering its messages.
+
+        Snapshots are cached, so this should be preferred over `get_jio` by callbacks
+        which do not modify the jio.
+        """
+
+        async def load() -> JioSnapshot:
+            return (await SupperJio.get_jio(jio_id)).snapshot()
+
+        return await jio_cache.get(jio_id, load)
 
     def update(
         self,
@@ -92,182 +164,88 @@ class SupperJio(Base):
 
         if status is not None:
             self.status = status
+            self.closed_at = datetime.now() if status == Stage.CLOSED else None
 
-        get_session().commit()
+        jio_cache.invalidate(self.id)
 
     def is_closed(self) -> bool:
         return self.status == Stage.CLOSED
 
-    @property
-    def message(self) -> str:
+    def snapshot(self) -> JioSnapshot:
         """
-        The text that will be displayed in the host's main message and the shared
-        messages in the groups.
-        """
-        message = (
-            f"Supper Jio Order #{self.id}: <b>{self.restaurant}</b>\n"
-            f"Additional Information: \n{self.description}\n\n"
-            "Current Orders:\n"
-        )
-
-        orders: list[Order] = self.orders
-        order_list = "\n".join(
-            _format_individual_orders(order) for order in orders if order.food_list
-        )
-        message += order_list if order_list else "None"
-
-        if self.is_closed():
-            message += "\n🛑 Jio is closed! 🛑"
+        Returns a snapshot of the jio's current state, including changes made in the
+        current session which have not been committed yet.
 
-        return message
+        The jio must have been obtained through `get_jio` (or `create`), so that all
+        relationships required for rendering have already been loaded.
+        """
+        return JioSnapshot.from_jio(self)
 
-    @property
-    def keyboard_markup(self) -> InlineKeyboardMarkup:
+    @staticmethod
+    async def check_counters(conn: AsyncConnection, *, fix: bool = False) -> list[str]:
         """
-        The inline keyboard markup for the host main message.
-        :return:
+        Compare the counters of every jio against its orders.
+
+        :param fix: Whether to correct the counters which do not match.
+        :return: A list of human-readable differences.
         """
-        jio_str = str(self.id)
-
-        if self.is_closed():
-            return InlineKeyboardMarkup.from_column(
-                [
-                    InlineKeyboardButton(
-                        "🔓 Reopen the jio",
-                        callback_data=join(CallbackType.REOPEN_JIO, jio_str),
-                    ),
-                    InlineKeyboardButton(
-                        "✍️Create Ordering List",
-                        callback_data=join(CallbackType.CREATE_ORDERING_LIST, jio_str),
-                    ),
-                    InlineKeyboardButton(
-                        "🔔 Ping Unpaid",
-                        callback_data=join(CallbackType.PING_ALL_UNPAID, jio_str),
-                    ),
-                    InlineKeyboardButton(
-                        "📢 Broadcast Message",
-                        callback_data=join(CallbackType.BROADCAST_MESSAGE, jio_str),
-                    ),
-                    InlineKeyboardButton(
-                        "♻ Refresh Message",
-                        callback_data=join(CallbackType.RESEND_MAIN_MESSAGE, jio_str),
-                    ),
-                ],
-            )
+        orders, items, jios = Order.__table__, OrderItem.__table__, SupperJio.__table__
+        counters = ("participant_count", "ordered_count", "paid_count", "item_count")
 
-        return InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton(
-                        "📢 Share this Jio!", switch_inline_query=f"order{jio_str}"
-                    ),
-                ],
-                [
-                    InlineKeyboardButton(
-                        "Add Order",
-                        callback_data=join(CallbackType.OWNER_ADD_ORDER, jio_str),
-                    ),
-                    InlineKeyboardButton(
-                        "🔒 Close the Jio",
-                        callback_data=join(CallbackType.CLOSE_JIO, jio_str),
-                    ),
-                ],
-                [
-                    InlineKeyboardButton(
-                        "🗒️ Edit Description",
-                        callback_data=join(CallbackType.AMEND_DESCRIPTION, jio_str),
-                    ),
-                    InlineKeyboardButton(
-                        "♻ Refresh Message",
-                        callback_data=join(CallbackType.RESEND_MAIN_MESSAGE, jio_str),
-                    ),
-                ],
-            ]
+        item_counts = (
+            select(items.c.jio_id, items.c.user_id, func.count().label("items"))
+            .group_by(items.c.jio_id, items.c.user_id)
+            .subquery()
         )
-
-    def shared_message_reply_markup(self, bot: Bot) -> InlineKeyboardMarkup | None:
-        if self.is_closed():
-            return None
-
-        return InlineKeyboardMarkup.from_button(
-            InlineKeyboardButton(
-                text="➕ Add Order",
-                url=create_deep_linked_url(bot.username, f"order{self.id}"),
+        per_order = (
+            select(
+                orders.c.jio_id,
+                orders.c.paid,
+                func.coalesce(item_counts.c["items"], 0).label("items"),
             )
-        )
-
-    async def update_main_jio_message(self, bot: Bot):
-        """
-        Update the host's jio message, i.e. the one used to control the supper jio.
-        """
-        # TODO: Consider if we should resend the message if editing fails?
-        try:
-            await bot.edit_message_text(
-                self.message,
-                self.chat_id,
-                self.message_id,
-                parse_mode=ParseMode.HTML,
-                reply_markup=self.keyboard_markup,
+            .outerjoin(
+                item_counts,
+                and_(
+                    item_counts.c.jio_id == orders.c.jio_id,
+                    item_counts.c.user_id == orders.c.user_id,
+                ),
             )
-        except BadRequest as e:
-            logging.error(
-                f"Unable to edit original jio message for order {self.id}: {e}"
+            .subquery()
+        )
+        actual = (
+            select(
+                per_order.c.jio_id,
+                func.count().label("participant_count"),
+                func.sum(case((per_order.c["items"] > 0, 1), else_=0)).label(
+                    "ordered_count"
+                ),
+                func.sum(case((per_order.c.paid == PaidStatus.PAID, 1), else_=0)).label(
+                    "paid_count"
+                ),
+                func.sum(per_order.c["items"]).label("item_count"),
             )
+            .group_by(per_order.c.jio_id)
+            .subquery()
+        )
+        expected = [func.coalesce(actual.c[name], 0) for name in counters]
+        stmt = (
+            select(jios.c.id, *[jios.c[name] for name in counters], *expected)
+            .outerjoin(actual, actual.c.jio_id == jios.c.id)
+            .where(or_(*[jios.c[name] != e for name, e in zip(counters, expected)]))
+        )
 
-    async def update_shared_jio_messages(self, bot: Bot):
-        """
-        Updates all shared jio messages, i.e. the messages sent to groups by the host.
-        """
-        text = self.message
-        reply_markup = self.shared_message_reply_markup(bot)
-        for msg in self.shared_messages:
-            try:
-                await bot.edit_message_text(
-                    text,
-                    inline_message_id=msg.message_id,
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=reply_markup,
+        differences = []
+        for jio_id, *values in (await conn.execute(stmt)).all():
+            stored, correct = values[: len(counters)], values[len(counters) :]
+            for name, s, c in zip(counters, stored, correct):
+                if s != c:
+                    differences.append(f"Jio {jio_id}: {name} is {s}, expected {c}")
+
+            if fix:
+                await conn.execute(
+                    jios.update()
+                    .where(jios.c.id == jio_id)
+                    .values(dict(zip(counters, correct)))
                 )
-            except BadRequest as e:
-                logging.error(f"Unable to edit message with message_id {msg.id}: {e}")
-
-    async def update_individual_order_messages(self, bot: Bot):
-        """
-        Updates all individual order messages.
-
-        Obviously, this method uses the API a lot, especially if there are many users.
-        Care must be taken to ensure that all functions using this method are rate
-        limited.
-        """
-        for order in self.orders:
-            await order.update_user_order(bot)
-
-    async def update_all_jio_messages(self, bot: Bot):
-        """
-        Updates all messages relating to this jio, i.e. the host's message, the shared
-        messages and the individual user messages.
-
-        Essentially just `update_main_jio_message`, `update_shared_jio_messages` and
-        `update_individual_order_messages` all together.
-
-        As this method uses the API a lot, especially if there are many users in this
-        Supper Jio, care must be taken to ensure that all function using this method
-        are rate limited.
-        """
-        await self.update_main_jio_message(bot)
-        await self.update_shared_jio_messages(bot)
-        await self.update_individual_order_messages(bot)
-
-
-def _format_individual_orders(order: Order):
-    """
-    Formats individual orders for shared messages.
-    """
-    if not order.food_list:
-        return f"{order.user.display_name} -- None"
-
-    ordered = f"{order.user.display_name} -- " + "; ".join(order.food_list)
 
-    if order.has_paid():
-        return "<s>" + ordered + "</s> Paid"
-    return ordered
+        return differences
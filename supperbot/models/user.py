@@ -1,14 +1,61 @@
 from __future__ import annotations
 
-from sqlalchemy import Column, BigInteger, String, select
+from datetime import datetime
+
+from cachetools import LRUCache
+from sqlalchemy import Column, BigInteger, String, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncConnection
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import FromClause, Select
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from supperbot.db import Base, get_session
-from supperbot.enums import Stage
+from config import USER_CACHE_SIZE
+from supperbot import metrics
+from supperbot.db import Base, after_commit, get_session, upsert, write
+from supperbot.enums import PaidStatus, Stage
 from supperbot.models import SupperJio, FavouriteOrder, Order
+from supperbot.models.archive import (
+    ArchivedJio,
+    archived_jios,
+    archived_order_items,
+    archived_orders,
+)
+from supperbot.models.snapshot import JioSnapshot, OrderSnapshot
+
+# A position in a list of jios, as the (timestamp, id) of a jio
+JioCursor = tuple[datetime, int]
+
+# User id -> (display name, chat id) of users recently stored in the database
+_seen_users: LRUCache[int, tuple[str, int]] = LRUCache(USER_CACHE_SIZE)
+
+
+def _paginate(
+    stmt: Select,
+    *,
+    before: JioCursor | None,
+    after: JioCursor | None,
+    jios: FromClause = SupperJio.__table__,
+) -> Select:
+    """
+    Restrict a statement selecting jios to a single page, using keyset pagination on
+    (timestamp, id) so that each page is a single range scan of an index.
+
+    :param before: Only return the jios older than this jio, i.e. the next page.
+    :param after: Only return the jios newer than this jio, i.e. the previous page.
+                  The jios are then returned oldest first.
+    :param jios: The table of the jios, i.e. either the hot or the archive table.
+    """
+    timestamp, jio_id = jios.c.timestamp, jios.c.id
+    key = tuple_(timestamp, jio_id)
+
+    if after is not None:
+        return stmt.where(key > after).order_by(timestamp, jio_id)
+
+    if before is not None:
+        stmt = stmt.where(key < before)
+    return stmt.order_by(timestamp.desc(), jio_id.desc())
 
 
 class User(Base):
@@ -25,36 +72,52 @@ class User(Base):
     favourite_orders = relationship("FavouriteOrder", back_populates="user")
 
     @staticmethod
-    def get_user(user_id: int) -> User:
+    async def get_user(user_id: int) -> User:
         """
         Get an instance of a user that is already stored in the database.
         """
         session = get_session()
         stmt = select(User).filter_by(id=user_id)
-        return session.scalars(stmt).one()
+        return (await session.scalars(stmt)).one()
 
     @staticmethod
-    def upsert(user_id: int, display_name: str, chat_id: int) -> User:
-        # Unfortunately, SQLAlchemy does not seem to support upserts directly.
-        session = get_session()
-        stmt = select(User).where(User.id == user_id)
-        user = session.scalars(stmt).one_or_none()
+    async def upsert(user_id: int, display_name: str, chat_id: int) -> None:
+        """
+        Store the user's display name and chat id, if they have changed.
 
-        if user is None:
-            user = User(id=user_id, display_name=display_name, chat_id=chat_id)
-            session.add(user)
-        else:
-            user.display_name = display_name
-            user.chat_id = chat_id
+        Users whose details were recently stored are remembered, so repeat users do
+        not cost any writes. Otherwise, the row is only updated if either value has
+        actually changed.
+        """
+        details = (display_name, chat_id)
+        if _seen_users.get(user_id) == details:
+            metrics.increment("user_cache.hit")
+            return
+
+        metrics.increment("user_cache.miss")
+
+        async def upsert_user(conn: AsyncConnection) -> None:
+            values = {"display_name": display_name, "chat_id": chat_id}
+            await upsert(conn, User.__table__, {"id": user_id}, values)
 
-        session.commit()
-        return user
+        def remember_user() -> None:
+            _seen_users[user_id] = details
 
-    def get_created_jios(
-        self, *, limit: int | None = 10, allow_closed: bool = False, desc: bool = True
+        await write(upsert_user)
+        after_commit(remember_user)
+
+    async def get_created_jios(
+        self,
+        *,
+        limit: int | None = 10,
+        allow_closed: bool = False,
+        before: JioCursor | None = None,
+        after: JioCursor | None = None,
     ) -> list[SupperJio]:
         """
-        Returns a list a joins this user has created.
+        Returns a list a joins this user has created, from newest to oldest.
+
+        `before` and `after` can be used to page through the list, see `_paginate`.
         """
 
         stmt = select(SupperJio).filter_by(owner_id=self.id)
@@ -62,48 +125,142 @@ class User(Base):
         if not allow_closed:
             stmt = stmt.where(SupperJio.status != Stage.CLOSED)
 
-        if desc:
-            stmt = stmt.order_by(SupperJio.timestamp.desc())
+        stmt = _paginate(stmt, before=before, after=after)
+
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        jios = (await get_session().scalars(stmt)).all()
+        return jios[::-1] if after is not None else jios
+
+    async def get_joined_jios(
+        self,
+        *,
+        limit: int | None = 10,
+        before: JioCursor | None = None,
+        after: JioCursor | None = None,
+    ) -> list[SupperJio]:
+        """
+        Returns a list of jios this user has joined, from newest to oldest.
+
+        `before` and `after` can be used to page through the list, see `_paginate`.
+        """
+        stmt = select(SupperJio).join(Order).filter_by(user_id=self.id)
+        stmt = _paginate(stmt, before=before, after=after)
+
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        jios = (await get_session().scalars(stmt)).all()
+        return jios[::-1] if after is not None else jios
+
+    async def get_archived_jios(
+        self,
+        *,
+        joined: bool = False,
+        limit: int | None = 10,
+        before: JioCursor | None = None,
+        after: JioCursor | None = None,
+    ) -> list[ArchivedJio]:
+        """
+        Returns a list of archived jios this user has created (or joined, if `joined`
+        is set), from newest to oldest.
+
+        `before` and `after` can be used to page through the list, see `_paginate`.
+        """
+        stmt = select(
+            archived_jios.c.id, archived_jios.c.restaurant, archived_jios.c.timestamp
+        )
+        if joined:
+            stmt = stmt.join(
+                archived_orders, archived_orders.c.jio_id == archived_jios.c.id
+            ).where(archived_orders.c.user_id == self.id)
         else:
-            stmt = stmt.order_by(SupperJio.timestamp)
+            stmt = stmt.where(archived_jios.c.owner_id == self.id)
+
+        stmt = _paginate(stmt, before=before, after=after, jios=archived_jios)
 
-        if limit is None:
-            return get_session().scalars(stmt).fetchall()
-        return get_session().scalars(stmt).fetchmany(size=limit)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        jios = [ArchivedJio(*row) for row in await get_session().execute(stmt)]
+        return jios[::-1] if after is not None else jios
 
-    def get_joined_jios(self, *, limit: int | None = 10) -> list[SupperJio]:
+    async def get_archived_snapshot(self, jio_id: int) -> JioSnapshot | None:
         """
-        Returns a list of jios this user has joined.
+        Get a snapshot of an archived jio for rendering, if this user created or
+        joined it.
         """
+        session = get_session()
+        stmt = select(archived_jios).filter_by(id=jio_id)
+        jio = (await session.execute(stmt)).one_or_none()
+        if jio is None:
+            return None
+
         stmt = (
-            select(SupperJio)
-            .join(Order)
-            .filter_by(user_id=self.id)
-            .order_by(SupperJio.timestamp.desc())
+            select(archived_orders, User.display_name, User.chat_id)
+            .join(User, User.id == archived_orders.c.user_id)
+            .where(archived_orders.c.jio_id == jio_id)
+            .order_by(archived_orders.c.user_id)
         )
+        orders = (await session.execute(stmt)).all()
+        if jio.owner_id != self.id and all(o.user_id != self.id for o in orders):
+            return None
 
-        session = get_session()
-        if limit is None:
-            return session.scalars(stmt).fetchall()
-        return session.scalars(stmt).fetchmany(size=limit)
+        stmt = (
+            select(archived_order_items.c.user_id, archived_order_items.c.food)
+            .where(archived_order_items.c.jio_id == jio_id)
+            .order_by(archived_order_items.c.position)
+        )
+        food_lists: dict[int, list[str]] = {}
+        for user_id, food in await session.execute(stmt):
+            food_lists.setdefault(user_id, []).append(food)
+
+        return JioSnapshot(
+            id=jio.id,
+            restaurant=jio.restaurant,
+            description=jio.description,
+            owner_id=jio.owner_id,
+            status=Stage(jio.status),
+            chat_id=jio.chat_id,
+            message_id=jio.message_id,
+            orders=tuple(
+                OrderSnapshot(
+                    jio_id=jio.id,
+                    restaurant=jio.restaurant,
+                    description=jio.description,
+                    jio_closed=True,
+                    user_id=order.user_id,
+                    display_name=order.display_name,
+                    chat_id=order.chat_id,
+                    food_list=tuple(food_lists.get(order.user_id, ())),
+                    paid=order.paid == PaidStatus.PAID,
+                    message_id=order.message_id,
+                )
+                for order in orders
+            ),
+            # Shared messages of archived jios are no longer updated
+            shared_message_ids=(),
+            participant_count=jio.participant_count,
+            ordered_count=jio.ordered_count,
+            paid_count=jio.paid_count,
+            item_count=jio.item_count,
+        )
 
-    def get_favourite_foods(self, restaurant: str) -> list[FavouriteOrder]:
+    async def get_favourite_foods(self, restaurant: str) -> list[FavouriteOrder]:
         stmt = select(FavouriteOrder).filter_by(user_id=self.id, restaurant=restaurant)
-        return get_session().scalars(stmt).fetchall()
+        return (await get_session().scalars(stmt)).all()
 
-    def get_favourite_restaurants(self) -> set[str]:
+    async def get_favourite_restaurants(self) -> set[str]:
         """
         Returns a set of restaurants for which the user has a favourite item.
         """
         stmt = select(FavouriteOrder.restaurant).filter_by(user_id=self.id)
-        return set(get_session().scalars(stmt).fetchall())
+        return set((await get_session().scalars(stmt)).all())
 
-    def get_favourite_orders(self, restaurant: str) -> list[FavouriteOrder]:
+    async def get_favourite_orders(self, restaurant: str) -> list[FavouriteOrder]:
         """
         Returns the list of the user's favourite orders for the specified restaurant.
         """
         stmt = select(FavouriteOrder).filter_by(user_id=self.id, restaurant=restaurant)
-        return get_session().scalars(stmt).fetchall()
+        return (await get_session().scalars(stmt)).all()
 
     @staticmethod
     def initialize_user(coroutine):
@@ -112,7 +269,7 @@ class User(Base):
         """
 
         async def inner(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-            User.upsert(
+            await User.upsert(
                 update.effective_user.id,
                 update.effective_user.first_name,
                 update.effective_chat.id,
@@ -0,0 +1,158 @@
+"""
+Persistence of conversation states and `user_data` in the database, so that users can
+continue their conversations with the bot after it restarts.
+
+The application collects the conversations and `user_data` which have changed, and
+hands them to the persistence every `update_interval` seconds. All changes of such a
+run are written in a single transaction through a `WriteBuffer`.
+
+Values are stored as JSON. `user_data` should therefore only contain small, JSON
+serializable values such as ids, and never ORM objects or telegram objects.
+"""
+from __future__ import annotations
+
+import json
+import logging
+from typing import Any
+
+from sqlalchemy import Column, String, Table, Text, delete, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from supperbot.db import Base, upsert
+from supperbot.enums import CallbackType
+from supperbot.writebuffer import WriteBuffer
+
+persistence_data = Table(
+    "persistence_data",
+    Base.metadata,
+    # Either "user_data" or "conversation:<name of the conversation handler>"
+    Column("namespace", String, primary_key=True),
+    Column("key", String, primary_key=True),
+    Column("data", Text, nullable=False),
+)
+
+_USER_DATA = "user_data"
+
+
+def _conversation_namespace(name: str) -> str:
+    return f"conversation:{name}"
+
+
+def _load_state(state: Any) -> Any:
+    """
+    Conversation states are `CallbackType`s, which are stored as their string values.
+    """
+    try:
+        return CallbackType(state)
+    except ValueError:
+        return state
+
+
+class SQLPersistence(BasePersistence):
+    """
+    Stores conversation states and `user_data` in the `persistence_data` table.
+
+    Chat data, bot data and callback data are not used by the bot, and are therefore
+    not stored.
+    """
+
+    def __init__(self, engine: AsyncEngine, *, update_interval: float):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.engine = engine
+        # Collects the writes of each run of the application's update_persistence
+        self.buffer = WriteBuffer(engine, max_delay=0.01, max_operations=1000)
+
+    async def _load(self, namespace: str) -> dict[str, Any]:
+        stmt = select(persistence_data.c.key, persistence_data.c.data).where(
+            persistence_data.c.namespace == namespace
+        )
+        async with self.engine.begin() as conn:
+            # The persistence is loaded before the migrations are run in `post_init`,
+            # so the table might not have been created yet
+            await conn.run_sync(persistence_data.create, checkfirst=True)
+            rows = await conn.execute(stmt)
+            return {key: json.loads(data) for key, data in rows}
+
+    async def _store(self, namespace: str, key: str, data: Any) -> None:
+        """
+        Store the data under the key, or delete it if the data is None.
+        """
+        where = (persistence_data.c.namespace == namespace) & (
+            persistence_data.c.key == key
+        )
+
+        async def store(conn: AsyncConnection) -> None:
+            if data is None:
+                await conn.execute(delete(persistence_data).where(where))
+                return
+
+            keys = {"namespace": namespace, "key": key}
+            await upsert(conn, persistence_data, keys, {"data": json.dumps(data)})
+
+        try:
+            await self.buffer.submit(store)
+        except Exception as e:
+            # The data is still in memory, and is written again when it next changes
+            logging.error(f"Unable to persist {namespace} for {key}: {e}")
+
+    async def get_user_data(self) -> dict[int, dict]:
+        return {int(key): data for key, data in (await self._load(_USER_DATA)).items()}
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict[tuple[int, ...], object]:
+        return {
+            tuple(json.loads(key)): _load_state(state)
+            for key, state in (await self._load(_conversation_namespace(name))).items()
+        }
+
+    async def update_conversation(
+        self, name: str, key: tuple[int, ...], new_state: object | None
+    ) -> None:
+        await self._store(_conversation_namespace(name), json.dumps(key), new_state)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        # Empty user data does not have to be stored
+        await self._store(_USER_DATA, str(user_id), data or None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._store(_USER_DATA, str(user_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        # The data in memory is always the latest, as only this process writes to it
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def flush(self) -> None:
+        await self.buffer.flush()
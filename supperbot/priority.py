@@ -0,0 +1,121 @@
+"""
+Prioritisation of outbound requests to the Telegram bot API.
+
+Responses to users, such as answering callback queries, should not have to wait
+behind bulk work such as broadcasts and refreshes of shared messages. Each request has
+a priority, taken from the context it is made in, and requests waiting for a free slot
+are served in order of priority.
+"""
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+import heapq
+import itertools
+from typing import AsyncIterator, Iterator
+
+from supperbot import metrics
+
+
+class Priority(IntEnum):
+    """Priorities of requests, from highest to lowest."""
+
+    INTERACTIVE = 0
+    NORMAL = 1
+    BULK = 2
+
+
+_priority: ContextVar[Priority] = ContextVar("_priority", default=Priority.NORMAL)
+
+
+def current_priority() -> Priority:
+    return _priority.get()
+
+
+@contextmanager
+def request_priority(priority: Priority) -> Iterator[None]:
+    """
+    Make all requests within the block (including those of tasks created within it)
+    with the given priority.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class PriorityGate:
+    """
+    Limits the number of requests in flight. Requests waiting for a slot are given one
+    in order of priority, and in order of arrival within the same priority.
+
+    The number of waiting requests of each priority is exposed through the
+    `request_queue.depth.<priority>` metrics.
+    """
+
+    def __init__(self, slots: int):
+        if slots <= 0:
+            raise ValueError("slots must be a positive integer.")
+
+        self._free = slots
+        # Heap of (priority, arrival, future resolved once given a slot)
+        self._waiters: list[tuple[Priority, int, asyncio.Future]] = []
+        self._arrivals = itertools.count()
+        self._depths = {priority: 0 for priority in Priority}
+
+    def depth(self, priority: Priority) -> int:
+        """
+        Returns the number of requests of the priority waiting for a slot.
+        """
+        return self._depths[priority]
+
+    def _change_depth(self, priority: Priority, change: int) -> None:
+        self._depths[priority] += change
+        metrics.set_value(
+            f"request_queue.depth.{priority.name.lower()}", self._depths[priority]
+        )
+
+    async def acquire(self, priority: Priority) -> None:
+        # Slots are handed directly to waiting requests when released, so a free slot
+        # means that no request is waiting
+        if self._free > 0:
+            self._free -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), future))
+        self._change_depth(priority, 1)
+        metrics.increment(f"request_queue.queued.{priority.name.lower()}")
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                self._change_depth(priority, -1)
+            else:
+                # The slot was handed over just before the request was cancelled
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            priority, _, future = heapq.heappop(self._waiters)
+            if future.cancelled():
+                continue
+
+            self._change_depth(priority, -1)
+            future.set_result(None)
+            return
+
+        self._free += 1
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority) -> AsyncIterator[None]:
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
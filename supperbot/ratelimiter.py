@@ -0,0 +1,151 @@
+"""
+Outbound rate limiting of all requests to the Telegram bot API.
+
+Telegram allows bots to send about 30 messages per second overall, 20 messages per
+minute to each group and about one message per second to each private chat.
+Exceeding these limits results in `RetryAfter` errors, which throttle the bot for far
+longer than simply waiting for the limit would have.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Callable, Coroutine
+
+from aiolimiter import AsyncLimiter
+from cachetools import LRUCache
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from supperbot import metrics
+from supperbot.priority import Priority, PriorityGate, current_priority
+
+# The number of chats whose rate limiters are remembered
+_CHAT_LIMITERS_SIZE = 4096
+
+# Requests which respond to the user directly, and are always made first
+_INTERACTIVE_ENDPOINTS = {"answerCallbackQuery", "answerInlineQuery"}
+
+
+def _is_group(chat_id: int | str) -> bool:
+    # Groups and channels have negative ids, or are referred to by their @username
+    return isinstance(chat_id, str) or chat_id < 0
+
+
+class ChatAwareRateLimiter(BaseRateLimiter[int]):
+    """
+    Limits requests with a global token bucket, and for requests to a chat, a token
+    bucket for that chat whose rate depends on whether the chat is a group or a
+    private chat.
+
+    Within these limits, at most `concurrency` requests are in flight at once. Waiting
+    requests are made in order of their `Priority`, so that responses to users are not
+    held up by bulk work.
+
+    Requests failing with `RetryAfter` are retried after the time requested by
+    Telegram, during which all other requests are held back as well. The number of
+    retries can be overridden per request through the `rate_limit_args` argument of
+    the bot methods.
+    """
+
+    def __init__(
+        self,
+        *,
+        overall: tuple[int, float],
+        group: tuple[int, float],
+        private: tuple[int, float],
+        max_retries: int,
+        concurrency: int,
+    ):
+        """
+        :param overall: The (max requests, period in seconds) for all requests.
+        :param group: The (max requests, period in seconds) for each group chat.
+        :param private: The (max requests, period in seconds) for each private chat.
+        :param max_retries: The number of times a request is retried on `RetryAfter`.
+        :param concurrency: The maximum number of requests in flight at once.
+        """
+        self._overall_limiter = AsyncLimiter(*overall)
+        self._group_rate = group
+        self._private_rate = private
+        self.max_retries = max_retries
+        self.gate = PriorityGate(concurrency)
+
+        self._chat_limiters: LRUCache[int | str, AsyncLimiter] = LRUCache(
+            _CHAT_LIMITERS_SIZE
+        )
+        # Loop time until which Telegram asked us to stop sending requests
+        self._paused_until = 0.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_limiter(self, chat_id: int | str | None) -> AsyncLimiter | None:
+        if chat_id is None:
+            # eg. answering callback queries and editing inline messages
+            return None
+
+        limiter = self._chat_limiters.get(chat_id)
+        if limiter is None:
+            rate = self._group_rate if _is_group(chat_id) else self._private_rate
+            limiter = AsyncLimiter(*rate)
+            self._chat_limiters[chat_id] = limiter
+        return limiter
+
+    async def _wait_if_paused(self) -> None:
+        delay = self._paused_until - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _call(
+        self,
+        priority: Priority,
+        callback: Callable[..., Coroutine[Any, Any, bool | dict | list | None]],
+        args: Any,
+        kwargs: dict[str, Any],
+    ) -> bool | dict | list | None:
+        async with self.gate.slot(priority), self._overall_limiter:
+            return await callback(*args, **kwargs)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, bool | dict | list | None]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: int | None,
+    ) -> bool | dict | list | None:
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+        chat_limiter = self._chat_limiter(data.get("chat_id"))
+        priority = (
+            Priority.INTERACTIVE
+            if endpoint in _INTERACTIVE_ENDPOINTS
+            else current_priority()
+        )
+
+        retries = 0
+        while True:
+            await self._wait_if_paused()
+            try:
+                if chat_limiter is None:
+                    return await self._call(priority, callback, args, kwargs)
+
+                async with chat_limiter:
+                    return await self._call(priority, callback, args, kwargs)
+            except RetryAfter as e:
+                metrics.increment("rate_limiter.retry_after")
+                if retries >= max_retries:
+                    raise
+                retries += 1
+
+                logging.warning(
+                    f"Rate limited by Telegram on {endpoint}, "
+                    f"retrying in {e.retry_after}s"
+                )
+                loop = asyncio.get_running_loop()
+                self._paused_until = max(
+                    self._paused_until, loop.time() + e.retry_after
+                )
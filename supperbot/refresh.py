@@ -0,0 +1,90 @@
+"""
+Debounced refreshes of the consolidated jio messages, i.e. the host's main message and
+the shared messages in groups.
+
+Every order or payment changes the consolidated messages of its jio. Instead of
+re-rendering and editing them after each change, the jio is marked as dirty and its
+messages are refreshed once, `JIO_REFRESH_DELAY` seconds after the first change. All
+changes made in the meantime are included in that single refresh, as it renders the
+latest state of the jio.
+
+Refreshes of the same jio never run concurrently, so a message is always last edited
+with the latest state of its jio. Refreshes still pending when the bot stops are lost,
+and the messages are brought up to date by the next change of the jio.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from telegram import Bot
+
+from config import JIO_REFRESH_DELAY
+from supperbot.db import after_commit, transactional
+from supperbot.fanout import FanoutReport
+from supperbot.models import SupperJio
+
+
+@transactional
+async def _refresh(jio_id: int, bot: Bot) -> FanoutReport:
+    snapshot = await SupperJio.get_snapshot(jio_id)
+    return await snapshot.update_consolidated_jio_messages(bot)
+
+
+class RefreshScheduler:
+    def __init__(self, delay: float):
+        """
+        :param delay: The time (in seconds) after the first change of a jio when its
+                      messages are refreshed.
+        """
+        self.delay = delay
+
+        # Jio id -> timer of its pending refresh
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        # Jio id -> its running refresh
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def schedule(self, jio_id: int, bot: Bot) -> None:
+        """
+        Mark the jio as dirty, so that its messages are refreshed after the delay.
+        """
+        if jio_id in self._timers:
+            # Coalesced into the refresh which is already pending
+            return
+
+        loop = asyncio.get_running_loop()
+        self._timers[jio_id] = loop.call_later(self.delay, self._start, jio_id, bot)
+
+    def _start(self, jio_id: int, bot: Bot) -> None:
+        del self._timers[jio_id]
+        task = asyncio.create_task(self._run(jio_id, bot, self._tasks.get(jio_id)))
+        self._tasks[jio_id] = task
+
+        def done(_: asyncio.Task) -> None:
+            if self._tasks.get(jio_id) is task:
+                del self._tasks[jio_id]
+
+        task.add_done_callback(done)
+
+    async def _run(self, jio_id: int, bot: Bot, previous: asyncio.Task | None) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        try:
+            report = await _refresh(jio_id, bot)
+        except Exception as e:
+            logging.error(f"Unable to refresh the messages of jio {jio_id}: {e}")
+            return
+
+        logging.debug(f"Refreshed the messages of jio {jio_id}: {report}")
+
+
+refresh_scheduler = RefreshScheduler(JIO_REFRESH_DELAY)
+
+
+def refresh_jio_messages(jio_id: int, bot: Bot) -> None:
+    """
+    Refresh the consolidated messages of the jio shortly after the current unit of work
+    has been committed.
+    """
+    after_commit(lambda: refresh_scheduler.schedule(jio_id, bot))
@@ -0,0 +1,127 @@
+"""
+The HTTP transport used for requests to the Telegram bot API.
+
+PTB's default `HTTPXRequest` keeps a small connection pool with short timeouts. When
+a jio is updated, its messages are edited concurrently, and requests beyond the size
+of the pool wait for a free connection (or fail with a pool timeout). The transport
+here makes the pool size, keep-alive and HTTP/2 configurable, and measures how long
+requests wait for a connection, so that the pool can be sized against the actual
+number of concurrent requests.
+
+`get_updates` uses a separate transport, so that long polling never holds one of the
+connections needed for outbound requests.
+"""
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+from typing import Any, Tuple
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest
+
+from supperbot import metrics
+
+
+class PooledHTTPXRequest(HTTPXRequest):
+    """
+    An `HTTPXRequest` with a configurable keep-alive and HTTP/2, which publishes the
+    time requests wait for a connection from the pool as the following metrics:
+
+    * `http.<name>.requests`: The number of requests which obtained a connection.
+    * `http.<name>.pool_wait_ms`: The total time spent waiting for a connection.
+    * `http.<name>.pool_wait_max_ms`: The longest time spent waiting for a connection.
+    * `http.<name>.pool_timeouts`: The number of requests which gave up waiting.
+    """
+
+    __slots__ = ("name", "_keepalive_expiry", "_http2")
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        connection_pool_size: int,
+        keepalive_expiry: float | None,
+        http2: bool,
+        timeout: float,
+        pool_timeout: float,
+    ):
+        """
+        :param name: The name of the transport in the metrics.
+        :param connection_pool_size: The maximum number of open connections.
+        :param keepalive_expiry: The number of seconds an idle connection is kept open,
+                                 or None to keep it open until Telegram closes it.
+        :param http2: Whether to use HTTP/2, which requires the `h2` package.
+        :param timeout: The connect, read and write timeouts, in seconds.
+        :param pool_timeout: The maximum number of seconds a request waits for a
+                             connection from the pool.
+        :raises RuntimeError: If HTTP/2 is enabled without the `h2` package installed.
+        """
+        if http2 and importlib.util.find_spec("h2") is None:
+            raise RuntimeError(
+                "HTTP2 is enabled, but the h2 package is not installed. Install the "
+                "requirements in requirements.txt, or set HTTP2 to False."
+            )
+
+        self.name = name
+        self._keepalive_expiry = keepalive_expiry
+        self._http2 = http2
+        super().__init__(
+            connection_pool_size=connection_pool_size,
+            read_timeout=timeout,
+            write_timeout=timeout,
+            connect_timeout=timeout,
+            pool_timeout=pool_timeout,
+        )
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = self._client_kwargs["limits"]
+        kwargs = {
+            **self._client_kwargs,
+            "limits": httpx.Limits(
+                max_connections=limits.max_connections,
+                max_keepalive_connections=limits.max_keepalive_connections,
+                keepalive_expiry=self._keepalive_expiry,
+            ),
+        }
+        return httpx.AsyncClient(
+            **kwargs,
+            http2=self._http2,
+            event_hooks={"request": [self._trace_pool_wait]},
+        )
+
+    def _metric(self, name: str) -> str:
+        return f"http.{self.name}.{name}"
+
+    async def _trace_pool_wait(self, request: httpx.Request) -> None:
+        """
+        Measure the time until the request obtains a connection, which is when the
+        connection pool first reports an event for the request (either opening a new
+        connection or sending the request over an existing one).
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        waiting = True
+
+        async def trace(event: str, info: dict[str, Any]) -> None:
+            nonlocal waiting
+            if not waiting:
+                return
+
+            waiting = False
+            wait = round((loop.time() - started) * 1000)
+            metrics.increment(self._metric("requests"))
+            metrics.increment(self._metric("pool_wait_ms"), wait)
+            if wait > metrics.get(self._metric("pool_wait_max_ms")):
+                metrics.set_value(self._metric("pool_wait_max_ms"), wait)
+
+        request.extensions["trace"] = trace
+
+    async def do_request(self, *args, **kwargs) -> Tuple[int, bytes]:
+        try:
+            return await super().do_request(*args, **kwargs)
+        except TimedOut as e:
+            if isinstance(e.__cause__, httpx.PoolTimeout):
+                metrics.increment(self._metric("pool_timeouts"))
+            raise
@@ -0,0 +1,117 @@
+"""
+A write-behind buffer which coalesces many small writes into one transaction.
+
+The application hands all conversations and `user_data` which have changed to the
+persistence at once, as concurrent calls. Instead of committing each of these writes
+in a transaction of its own, writes submitted to the buffer are collected for a few
+milliseconds (or until enough have been collected), and are then executed and
+committed together as a single transaction.
+
+`WriteBuffer.submit` only returns once the transaction containing the write has been
+committed. Writes made by a unit of work must not be submitted to a buffer, as the
+unit of work would hold a connection (and possibly a lock) that the buffered
+transaction could be waiting for; they use `supperbot.db.write` instead.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+T = TypeVar("T")
+
+# A write operation, which executes its statements on the given connection
+Operation = Callable[[AsyncConnection], Awaitable[T]]
+
+
+class WriteBuffer:
+    def __init__(self, engine: AsyncEngine, *, max_delay: float, max_operations: int):
+        """
+        :param engine: The engine used to execute the buffered writes.
+        :param max_delay: The maximum time (in seconds) a write waits in the buffer
+                          before the buffer is flushed.
+        :param max_operations: The number of buffered writes which causes the buffer
+                               to be flushed immediately.
+        """
+        if max_delay < 0:
+            raise ValueError("max_delay must not be negative.")
+
+        if max_operations <= 0:
+            raise ValueError("max_operations must be a positive integer.")
+
+        self.engine = engine
+        self.max_delay = max_delay
+        self.max_operations = max_operations
+
+        self._pending: list[tuple[Operation, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._flush_lock = asyncio.Lock()
+
+    async def submit(self, operation: Operation[T]) -> T:
+        """
+        Buffer a write operation, and wait until it has been committed.
+
+        :return: The value returned by the operation.
+        :raises: Any exception raised by the operation. Only the failing operation is
+                 rolled back; other operations in the same batch are still committed.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((operation, future))
+
+        if len(self._pending) >= self.max_operations:
+            self._schedule_flush(loop, 0)
+        elif self._timer is None:
+            self._schedule_flush(loop, self.max_delay)
+
+        return await future
+
+    def _schedule_flush(self, loop: asyncio.AbstractEventLoop, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = loop.call_later(delay, lambda: loop.create_task(self.flush()))
+
+    async def flush(self) -> None:
+        """
+        Execute and commit all buffered writes.
+        """
+        async with self._flush_lock:
+            self._timer = None
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+
+            try:
+                async with self.engine.begin() as conn:
+                    results = [await operation(conn) for operation, _ in batch]
+            except Exception as e:
+                logging.warning(
+                    f"Unable to commit a batch of {len(batch)} write(s), "
+                    f"retrying them individually: {e}"
+                )
+                await self._execute_individually(batch)
+                return
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _execute_individually(
+        self, batch: list[tuple[Operation, asyncio.Future]]
+    ) -> None:
+        """
+        Execute each write in its own transaction, so that a single failing write does
+        not cause the rest of its batch to fail.
+        """
+        for operation, future in batch:
+            try:
+                async with self.engine.begin() as conn:
+                    result: Any = await operation(conn)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,52 @@
+"""
+Shared fixtures for the tests.
+
+The tests run against the example config in `defaultconfig.py` rather than any local
+`config.py`, and each test which needs a database gets its own temporary SQLite file.
+"""
+import sys
+
+import defaultconfig
+
+sys.modules["config"] = defaultconfig
+
+import pytest  # noqa: E402
+import pytest_asyncio  # noqa: E402
+
+from supperbot import db  # noqa: E402
+from supperbot.cache import jio_cache  # noqa: E402
+from supperbot.migrations import run_migrations  # noqa: E402
+from supperbot.models.user import _seen_users  # noqa: E402
+
+
+@pytest_asyncio.fixture
+async def database(tmp_path):
+    """
+    A new database with the current schema, used by all sessions during the test.
+
+    The in-memory caches are cleared, as ids are given out again by each database.
+    """
+    jio_cache._snapshots.clear()
+    _seen_users.clear()
+    engine = db.make_engine(
+        f"sqlite:///{tmp_path / 'test.db'}",
+        sqlite_pragmas=defaultconfig.SQLITE_PRAGMAS,
+    )
+    db.async_session.configure(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(run_migrations)
+
+    yield engine
+
+    db.async_session.configure(bind=db.engine)
+    await engine.dispose()
+
+
+@pytest.fixture(params=["on conflict", "select then insert"])
+def upsert_support(request, monkeypatch) -> str:
+    """
+    Runs the test both with `INSERT ... ON CONFLICT`, and as for a dialect without it.
+    """
+    if request.param == "select then insert":
+        monkeypatch.setattr(db, "_UPSERT_INSERTS", {})
+    return request.param
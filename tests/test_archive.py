@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import NoResultFound
+from telegram import CallbackQuery, Update
+from telegram import User as TelegramUser
+
+from supperbot.commands.misc import error_handler
+from supperbot.commands.ordering import cancel_order_action
+from supperbot.commands.payment import declare_payment, undo_payment
+from supperbot.db import transactional
+from supperbot.enums import CallbackType, Stage
+from supperbot.migrations import run_migrations
+from supperbot.models import Order, SupperJio, User
+from supperbot.models.archive import archive_closed_jios
+
+pytestmark = pytest.mark.asyncio
+
+
+@transactional
+async def create_closed_jio() -> int:
+    await User.upsert(1, "Host", 1)
+    jio = await SupperJio.create(1, "McDonald's", "Supper tonight")
+    order = await Order.create_order(jio_id=jio.id, user_id=1)
+    await order.add_food("McSpicy")
+    jio.update(status=Stage.CLOSED)
+    return jio.id
+
+
+@transactional
+async def archive() -> list[int]:
+    return await archive_closed_jios(
+        closed_before=datetime.now() + timedelta(days=1), limit=10
+    )
+
+
+async def test_archived_ids_are_not_given_out_again(database):
+    first = await create_closed_jio()
+    assert await archive() == [first]
+
+    second = await create_closed_jio()
+    assert second > first
+    assert await archive() == [second]
+
+
+async def test_migration_moves_archived_rows_with_reused_ids(database):
+    first = await create_closed_jio()
+    await archive()
+
+    # Simulate a database where SQLite gave the archived ids out again
+    async with database.begin() as conn:
+        await conn.execute(text("DELETE FROM sqlite_sequence"))
+        await conn.execute(text("DELETE FROM schema_migrations WHERE version = 7"))
+    reused = await create_closed_jio()
+    assert reused == first
+
+    async with database.begin() as conn:
+        await conn.run_sync(run_migrations)
+        archived = (await conn.scalars(text("SELECT id FROM archived_jios"))).all()
+        archived_orders = (
+            await conn.scalars(text("SELECT jio_id FROM archived_orders"))
+        ).all()
+
+    assert archived == archived_orders
+    assert archived[0] > reused
+    assert await archive() == [reused]
+    assert await create_closed_jio() > archived[0]
+
+
+class Bot:
+    def __init__(self):
+        self.answers = []
+
+    async def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self.answers.append(text)
+
+
+@pytest.mark.parametrize(
+    "handler, callback_type",
+    [
+        (declare_payment, CallbackType.DECLARE_PAYMENT),
+        (undo_payment, CallbackType.UNDO_PAYMENT),
+        (cancel_order_action, CallbackType.CANCEL_ORDER_ACTION),
+    ],
+)
+async def test_buttons_of_archived_jios_are_answered(database, handler, callback_type):
+    jio_id = await create_closed_jio()
+    await archive()
+
+    # Someone who never ordered from the jio presses a button on an old message
+    await transactional(User.upsert)(2, "Someone", 2)
+    bot = Bot()
+    query = CallbackQuery(
+        "1", TelegramUser(2, "Someone", False), "1", data=f"{callback_type}:{jio_id}"
+    )
+    query.set_bot(bot)
+    update = Update(1, callback_query=query)
+    context = SimpleNamespace(bot=bot)
+
+    with pytest.raises(NoResultFound) as error:
+        await handler(update, context)
+    context.error = error.value
+    await error_handler(update, context)
+
+    assert bot.answers == ["This jio has been archived and can no longer be used."]
+    async with database.connect() as conn:
+        assert (await conn.scalars(text("SELECT jio_id FROM orders"))).all() == []
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from supperbot.cache import JioCache
+
+pytestmark = pytest.mark.asyncio
+
+
+class Snapshot:
+    def __init__(self, version: int, closed: bool = False):
+        self.version = version
+        self.closed = closed
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+
+async def test_cached_snapshot_is_returned_until_invalidated():
+    cache = JioCache(maxsize=2, closed_ttl=60)
+    loads = []
+
+    async def load():
+        loads.append(1)
+        return Snapshot(len(loads))
+
+    assert (await cache.get(1, load)).version == 1
+    assert (await cache.get(1, load)).version == 1
+
+    cache._bump(1)
+    assert (await cache.get(1, load)).version == 2
+
+
+async def test_snapshot_changed_while_loading_is_not_cached():
+    cache = JioCache(maxsize=2, closed_ttl=60)
+    loading = asyncio.Event()
+    changed = asyncio.Event()
+
+    async def slow_load():
+        loading.set()
+        await changed.wait()
+        return Snapshot(1)
+
+    task = asyncio.create_task(cache.get(1, slow_load))
+    await loading.wait()
+    cache._bump(1)
+    changed.set()
+    assert (await task).version == 1
+
+    async def load():
+        return Snapshot(2)
+
+    assert (await cache.get(1, load)).version == 2
+    # Versions are only kept while a jio is being loaded
+    assert not cache._versions and not cache._loading
+
+
+async def test_versions_are_not_kept_for_jios_which_are_not_loading():
+    cache = JioCache(maxsize=2, closed_ttl=60)
+    for jio_id in range(100):
+        cache._bump(jio_id)
+
+    assert not cache._versions
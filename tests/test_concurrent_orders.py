@@ -0,0 +1,63 @@
+"""
+Many users add food items to the same jio at the same time, as updates are processed
+concurrently. Afterwards, every item must have been stored exactly once, with the
+positions of each order in sequence, and the counters of the jio must match its orders.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+from supperbot.db import transactional
+from supperbot.locks import locks_jio
+from supperbot.models import Order, OrderItem, SupperJio, User
+
+pytestmark = pytest.mark.asyncio
+
+USERS = 20
+ITEMS = 5
+
+
+@transactional
+async def create_jio() -> int:
+    for user_id in range(1, USERS + 1):
+        await User.upsert(user_id, f"User {user_id}", user_id)
+    jio = await SupperJio.create(1, "Stress test", "Concurrent ordering stress test")
+    return jio.id
+
+
+@locks_jio(lambda jio_id, user_id, food: jio_id)
+@transactional
+async def add_food(jio_id: int, user_id: int, food: str) -> None:
+    order = await Order.create_order(jio_id=jio_id, user_id=user_id)
+    await order.add_food(food)
+
+
+async def user_orders(jio_id: int, user_id: int) -> None:
+    # Updates from the same user are processed one after another
+    for i in range(ITEMS):
+        await add_food(jio_id, user_id, f"Food {i} of user {user_id}")
+
+
+async def test_no_order_items_are_lost(database):
+    jio_id = await create_jio()
+
+    await asyncio.gather(
+        *(user_orders(jio_id, user_id) for user_id in range(1, USERS + 1))
+    )
+
+    async with database.connect() as conn:
+        positions = await conn.execute(
+            select(OrderItem.user_id, OrderItem.position)
+            .where(OrderItem.jio_id == jio_id)
+            .order_by(OrderItem.user_id, OrderItem.position)
+        )
+        by_user: dict[int, list[int]] = {}
+        for user_id, position in positions:
+            by_user.setdefault(user_id, []).append(position)
+
+        assert by_user == {u: list(range(ITEMS)) for u in range(1, USERS + 1)}
+        assert await conn.scalar(select(func.count()).select_from(OrderItem)) == (
+            USERS * ITEMS
+        )
+        assert await SupperJio.check_counters(conn) == []
@@ -0,0 +1,20 @@
+import importlib
+import sys
+from types import ModuleType
+
+import defaultconfig
+import supperbot
+
+
+def test_settings_missing_from_the_config_take_their_default(monkeypatch):
+    config = ModuleType("config")
+    config.TOKEN = "123:abc"
+    config.PORT = None
+    monkeypatch.setitem(sys.modules, "config", config)
+
+    importlib.reload(supperbot)
+
+    assert config.TOKEN == "123:abc"
+    assert config.PORT is None
+    assert config.CONCURRENT_UPDATES == defaultconfig.CONCURRENT_UPDATES
+    assert not hasattr(config, "logging")
@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+
+from supperbot.db import transactional, upsert
+from supperbot.deadletters import DeadLetterTracker, dead_letters
+from supperbot.models import User
+
+pytestmark = pytest.mark.asyncio
+
+
+async def stored_users(database) -> list[tuple]:
+    async with database.connect() as conn:
+        users = User.__table__
+        return list(await conn.execute(select(users).order_by(users.c.id)))
+
+
+async def test_upsert_inserts_and_updates(database, upsert_support):
+    users = User.__table__
+    async with database.begin() as conn:
+        await upsert(conn, users, {"id": 1}, {"display_name": "Alice", "chat_id": 10})
+        await upsert(conn, users, {"id": 2}, {"display_name": "Bob", "chat_id": 20})
+        await upsert(conn, users, {"id": 1}, {"display_name": "Tan", "chat_id": 10})
+
+    assert await stored_users(database) == [(1, "Tan", 10), (2, "Bob", 20)]
+
+
+async def test_upsert_can_keep_the_existing_row(database, upsert_support):
+    users = User.__table__
+    async with database.begin() as conn:
+        await upsert(conn, users, {"id": 1}, {"display_name": "Alice", "chat_id": 10})
+        await upsert(
+            conn,
+            users,
+            {"id": 1},
+            {"display_name": "Tan", "chat_id": 11},
+            update=False,
+        )
+
+    assert await stored_users(database) == [(1, "Alice", 10)]
+
+
+async def test_upsert_only_rewrites_changed_rows(database):
+    users = User.__table__
+    async with database.begin() as conn:
+
+        async def changes(name: str) -> int:
+            before = await conn.scalar(text("SELECT total_changes()"))
+            values = {"display_name": name, "chat_id": 10}
+            await upsert(conn, users, {"id": 1}, values)
+            return await conn.scalar(text("SELECT total_changes()")) - before
+
+        assert await changes("Alice") == 1
+        assert await changes("Alice") == 0
+        assert await changes("Tan") == 1
+
+
+async def test_upsert_statement_for_postgresql():
+    statements = []
+
+    async def execute(stmt):
+        statements.append(stmt)
+
+    conn = SimpleNamespace(dialect=postgresql.dialect(), execute=execute)
+    values = {"display_name": "Alice", "chat_id": 10}
+    await upsert(conn, User.__table__, {"id": 1}, values)
+    sql = str(statements[0].compile(dialect=postgresql.dialect()))
+
+    assert "ON CONFLICT (id) DO UPDATE" in sql
+    assert "WHERE users.display_name != excluded.display_name" in sql
+
+
+async def test_message_is_dead_lettered_once(database, upsert_support):
+    tracker = DeadLetterTracker(3)
+
+    for error in ("Chat not found", "Forbidden"):
+        await transactional(tracker.store)("1:1", "edit", error)
+
+    async with database.connect() as conn:
+        rows = (await conn.execute(select(dead_letters.c.error))).all()
+    assert rows == [("Chat not found",)]
@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+import pytest
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, TimedOut
+
+from supperbot import edits, fanout
+from supperbot.deadletters import DeadLetterTracker
+from supperbot.edits import (
+    EditTracker,
+    content_hash,
+    forget_callback_message,
+    message_key,
+)
+from supperbot.fanout import Target, fan_out
+
+
+@pytest.fixture
+def tracker(monkeypatch) -> EditTracker:
+    tracker = EditTracker(2)
+    monkeypatch.setattr(fanout, "edit_tracker", tracker)
+    monkeypatch.setattr(edits, "edit_tracker", tracker)
+    monkeypatch.setattr(fanout, "dead_letter_tracker", DeadLetterTracker(3))
+    monkeypatch.setattr(fanout, "EDIT_RETRY_BASE_DELAY", 0)
+    return tracker
+
+
+def keyboard(data: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Join", callback_data=data)]])
+
+
+def test_content_hash_depends_on_text_and_keyboard():
+    assert content_hash("Jio", keyboard("a")) == content_hash("Jio", keyboard("a"))
+    assert content_hash("Jio", keyboard("a")) != content_hash("Jio", keyboard("b"))
+    assert content_hash("Jio", None) != content_hash("Jio 2", None)
+
+
+def test_least_recently_edited_message_is_forgotten(tracker):
+    tracker.record("1:1", 1)
+    tracker.record("1:2", 2)
+    tracker.record("1:3", 3)
+
+    assert not tracker.is_unchanged("1:1", 1)
+    assert tracker.is_unchanged("1:2", 2)
+    assert tracker.is_unchanged("1:3", 3)
+
+
+async def edit(tracker: EditTracker, content: int, *errors: Exception) -> list[int]:
+    calls = []
+
+    async def call():
+        calls.append(content)
+        if errors:
+            raise errors[0]
+
+    await fan_out([Target("edit", call, message="1:1", content=content, retry=True)])
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_changed_content_is_edited(tracker):
+    assert await edit(tracker, 1) == [1]
+    assert await edit(tracker, 1) == []
+    assert await edit(tracker, 2) == [2]
+
+
+@pytest.mark.asyncio
+async def test_message_not_modified_records_the_content(tracker):
+    await edit(tracker, 1, BadRequest("Message is not modified"))
+
+    assert tracker.is_unchanged("1:1", 1)
+
+
+@pytest.mark.asyncio
+async def test_failed_edit_is_made_again(tracker):
+    tracker.record("1:1", 1)
+    errors = [TimedOut()] * (fanout.EDIT_MAX_RETRIES + 1)
+    await edit(tracker, 2, *errors)
+
+    # The message may or may not have been edited, so neither content is known
+    assert not tracker.is_unchanged("1:1", 1)
+    assert not tracker.is_unchanged("1:1", 2)
+
+
+@pytest.mark.asyncio
+async def test_pressed_button_forgets_the_content_of_its_message(tracker):
+    tracker.record(message_key(1, 5), 1)
+    tracker.record("inline", 1)
+
+    message = SimpleNamespace(chat_id=1, message_id=5)
+    query = SimpleNamespace(inline_message_id=None, message=message)
+    await forget_callback_message(SimpleNamespace(callback_query=query), None)
+    query = SimpleNamespace(inline_message_id="inline", message=None)
+    await forget_callback_message(SimpleNamespace(callback_query=query), None)
+
+    assert not tracker.is_unchanged(message_key(1, 5), 1)
+    assert not tracker.is_unchanged("inline", 1)
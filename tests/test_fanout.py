@@ -0,0 +1,163 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+from telegram.error import BadRequest, TimedOut
+
+from supperbot import fanout
+from supperbot.db import transactional
+from supperbot.deadletters import DeadLetterTracker, dead_letters
+from supperbot.edits import EditTracker
+from supperbot.fanout import Target, fan_out
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture(autouse=True)
+def trackers(monkeypatch):
+    """
+    Fresh trackers for each test, and retries without waiting.
+    """
+    monkeypatch.setattr(fanout, "edit_tracker", EditTracker(100))
+    monkeypatch.setattr(fanout, "dead_letter_tracker", DeadLetterTracker(3))
+    monkeypatch.setattr(fanout, "EDIT_RETRY_BASE_DELAY", 0)
+
+
+class Call:
+    """
+    An API call which raises the given errors in turn, and then succeeds.
+    """
+
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(chat_id=1, message_id=100 + self.calls)
+
+
+async def test_calls_are_made_with_bounded_concurrency():
+    in_flight = 0
+    max_in_flight = 0
+
+    def make_call(delay: float):
+        async def call():
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(in_flight, max_in_flight)
+            await asyncio.sleep(delay)
+            in_flight -= 1
+
+        return call
+
+    # Later targets finish first, but the results keep the order of the targets
+    targets = [Target(f"send {i}", make_call((10 - i) / 1000)) for i in range(10)]
+    report = await fan_out(targets, concurrency=3)
+
+    assert max_in_flight == 3
+    assert [result.target for result in report.results] == [t.name for t in targets]
+
+
+async def test_failing_target_does_not_stop_the_others():
+    failing = Call(BadRequest("Chat not found"))
+    other = Call()
+    report = await fan_out([Target("failing", failing), Target("other", other)])
+
+    assert [result.ok for result in report.results] == [False, True]
+    assert report.errors == report.results[:1]
+    assert other.calls == 1
+
+
+async def test_edits_are_retried_after_timeouts():
+    call = Call(TimedOut(), TimedOut())
+    report = await fan_out([Target("edit", call, message="1:1", content=1, retry=True)])
+
+    assert call.calls == 3
+    assert report.results[0].ok
+
+
+async def test_edits_give_up_after_the_maximum_number_of_retries():
+    call = Call(*(TimedOut() for _ in range(fanout.EDIT_MAX_RETRIES + 1)))
+    report = await fan_out([Target("edit", call, message="1:1", content=1, retry=True)])
+
+    assert call.calls == fanout.EDIT_MAX_RETRIES + 1
+    assert isinstance(report.results[0].error, TimedOut)
+
+
+async def test_sends_are_not_retried():
+    call = Call(TimedOut())
+    report = await fan_out([Target("send", call)])
+
+    assert call.calls == 1
+    assert isinstance(report.results[0].error, TimedOut)
+
+
+async def test_message_which_can_no_longer_be_edited_is_sent_again():
+    edit = Call(BadRequest("Message can't be edited"))
+    resend = Call()
+    resent_ids = []
+
+    async def on_resent(message_id: int) -> None:
+        resent_ids.append(message_id)
+
+    target = Target(
+        "edit",
+        edit,
+        message="1:1",
+        content=1,
+        retry=True,
+        resend=resend,
+        on_resent=on_resent,
+    )
+    report = await fan_out([target])
+
+    assert report.results[0].resent_message_id == 101
+    assert resent_ids == [101]
+    # The new message is known to have the content already
+    assert fanout.edit_tracker.is_unchanged("1:101", 1)
+
+
+async def test_unchanged_messages_are_not_edited_again():
+    call = Call()
+    target = Target("edit", call, message="1:1", content=1, retry=True)
+
+    await fan_out([target])
+    report = await fan_out([target])
+
+    assert call.calls == 1
+    assert report.skipped == report.results
+
+
+@transactional
+async def fan_out_in_session(targets):
+    return await fan_out(targets)
+
+
+async def test_messages_failing_permanently_are_dead_lettered(database):
+    call = Call(*(BadRequest("Chat not found") for _ in range(3)))
+    target = Target("edit", call, message="1:1", content=1, retry=True)
+
+    reports = [await fan_out_in_session([target]) for _ in range(4)]
+
+    assert [r.results[0].dead_lettered for r in reports[:3]] == [False, False, True]
+    assert reports[3].skipped == reports[3].results
+    assert call.calls == 3
+
+    async with database.connect() as conn:
+        stored = (await conn.scalars(select(dead_letters.c.message))).all()
+    assert stored == ["1:1"]
+
+
+async def test_timeouts_never_dead_letter_a_message():
+    call = Call(*(TimedOut() for _ in range(100)))
+    target = Target("edit", call, message="1:1", content=1, retry=True)
+
+    for _ in range(5):
+        report = await fan_out([target])
+        assert not report.results[0].dead_lettered
+
+    assert "1:1" not in fanout.dead_letter_tracker
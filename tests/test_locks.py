@@ -0,0 +1,166 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from telegram import Chat, Message, Update, User
+from telegram.ext import Application, ApplicationBuilder
+
+from supperbot import locks
+from supperbot.locks import SerializedApplication, jio_locks, locks_jio
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    user = User(user_id, "Someone", False)
+    message = Message(update_id, datetime.now(), Chat(user_id, "private"), user)
+    return Update(update_id, message=message)
+
+
+class Handlers:
+    """
+    Stands in for `Application.process_update`. Each update is processed until it is
+    released, and the updates currently being processed are recorded.
+    """
+
+    def __init__(self):
+        self.updates: dict[int, Update] = {}
+        self.running: set[int] = set()
+        self.started: list[int] = []
+        self.finished: list[int] = []
+        self.max_running_per_user: dict[int, int] = {}
+        self.releases: dict[int, asyncio.Event] = {}
+
+    def release(self, update_id: int) -> None:
+        self.releases.setdefault(update_id, asyncio.Event()).set()
+
+    async def __call__(self, update: Update) -> None:
+        self.running.add(update.update_id)
+        self.started.append(update.update_id)
+        user_id = update.effective_user.id
+        running = sum(
+            1 for u in self.running if self.updates[u].effective_user.id == user_id
+        )
+        self.max_running_per_user[user_id] = max(
+            running, self.max_running_per_user.get(user_id, 0)
+        )
+
+        await self.releases.setdefault(update.update_id, asyncio.Event()).wait()
+        self.running.discard(update.update_id)
+        self.finished.append(update.update_id)
+
+
+@pytest.fixture
+def handlers(monkeypatch) -> Handlers:
+    handlers = Handlers()
+    monkeypatch.setattr(Application, "process_update", handlers)
+    return handlers
+
+
+def make_application(monkeypatch, concurrent_updates: int) -> SerializedApplication:
+    monkeypatch.setattr(locks, "CONCURRENT_UPDATES", concurrent_updates)
+    return (
+        ApplicationBuilder()
+        .token("123:abc")
+        .application_class(SerializedApplication)
+        .concurrent_updates(100)
+        .build()
+    )
+
+
+async def process(application: SerializedApplication, handlers, *updates: Update):
+    """
+    Starts processing the updates concurrently, in the given order.
+    """
+    handlers.updates = {update.update_id: update for update in updates}
+    tasks = [
+        asyncio.create_task(application.process_update(update)) for update in updates
+    ]
+    await asyncio.sleep(0)
+    return tasks
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def test_updates_from_the_same_user_are_processed_in_order(handlers, monkeypatch):
+    application = make_application(monkeypatch, 4)
+    tasks = await process(application, handlers, *(make_update(i, 1) for i in range(3)))
+
+    for update_id in range(3):
+        await settle()
+        assert handlers.started == list(range(update_id + 1))
+        handlers.release(update_id)
+
+    await asyncio.gather(*tasks)
+    assert handlers.finished == [0, 1, 2]
+    assert handlers.max_running_per_user[1] == 1
+
+
+async def test_updates_from_different_users_are_processed_concurrently(
+    handlers, monkeypatch
+):
+    application = make_application(monkeypatch, 4)
+    tasks = await process(application, handlers, make_update(0, 1), make_update(1, 2))
+
+    await settle()
+    assert handlers.running == {0, 1}
+
+    handlers.release(0)
+    handlers.release(1)
+    await asyncio.gather(*tasks)
+
+
+async def test_waiting_updates_do_not_hold_a_concurrency_slot(handlers, monkeypatch):
+    application = make_application(monkeypatch, 2)
+    burst = [make_update(i, 1) for i in range(5)]
+    tasks = await process(application, handlers, *burst, make_update(5, 2))
+
+    # The other user is processed while the first update of the burst is running
+    await settle()
+    assert handlers.running == {0, 5}
+    handlers.release(5)
+    await settle()
+    assert handlers.finished == [5]
+
+    for update_id in range(5):
+        handlers.release(update_id)
+    await asyncio.gather(*tasks)
+    assert handlers.finished == [5, 0, 1, 2, 3, 4]
+
+
+async def test_changes_to_the_same_jio_are_made_one_at_a_time():
+    running = set()
+    overlaps = []
+    release = asyncio.Event()
+
+    @locks_jio(lambda jio_id: jio_id)
+    async def change(jio_id: int) -> None:
+        overlaps.append(jio_id in running)
+        running.add(jio_id)
+        await release.wait()
+        running.discard(jio_id)
+
+    tasks = [asyncio.create_task(change(jio_id)) for jio_id in (1, 1, 2)]
+    await settle()
+    # The second change to jio 1 waits, while jio 2 is changed concurrently
+    assert running == {1, 2}
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert overlaps == [False, False, False]
+    assert not jio_locks._locks
+
+
+async def test_jio_lock_is_reentrant():
+    @locks_jio(lambda jio_id: jio_id)
+    async def outer(jio_id: int) -> str:
+        return await inner(jio_id)
+
+    @locks_jio(lambda jio_id: jio_id)
+    async def inner(jio_id: int) -> str:
+        return "done"
+
+    assert await asyncio.wait_for(outer(1), timeout=1) == "done"
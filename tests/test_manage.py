@@ -0,0 +1,44 @@
+import pytest
+
+import manage
+from supperbot.db import Base
+
+pytestmark = pytest.mark.asyncio
+
+users = Base.metadata.tables["users"]
+favourite_orders = Base.metadata.tables["favourite_orders"]
+
+FAVOURITES = [
+    {"id": 1, "user_id": 1, "restaurant": None, "food": ""},
+    {"id": 2, "user_id": 1, "restaurant": "", "food": None},
+    {"id": 3, "user_id": 1, "restaurant": "\\N", "food": "\\\\N, with commas"},
+    {"id": 4, "user_id": None, "restaurant": "Al Amaan", "food": "Maggi goreng"},
+]
+
+
+@pytest.mark.parametrize("fmt", manage.FORMATS)
+async def test_exported_rows_are_imported_unchanged(database, tmp_path, fmt):
+    async with database.begin() as conn:
+        await conn.execute(users.insert(), {"id": 1, "display_name": "", "chat_id": 1})
+        await conn.execute(favourite_orders.insert(), FAVOURITES)
+
+    tables = [users, favourite_orders]
+    await manage.export_database(str(database.url), tmp_path, fmt, tables)
+    imported = f"sqlite:///{tmp_path / 'imported.db'}"
+    await manage.import_database(imported, tmp_path, tables)
+
+    engine = manage.make_engine(imported)
+    async with engine.connect() as conn:
+        rows = await conn.execute(favourite_orders.select().order_by("id"))
+        assert [dict(row._mapping) for row in rows] == FAVOURITES
+    await engine.dispose()
+
+
+async def test_import_fails_when_both_formats_were_exported(database, tmp_path):
+    for fmt in manage.FORMATS:
+        await manage.export_database(str(database.url), tmp_path, fmt, [users])
+
+    with pytest.raises(SystemExit):
+        await manage.import_database(
+            f"sqlite:///{tmp_path / 'imported.db'}", tmp_path, [users]
+        )
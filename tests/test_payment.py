@@ -0,0 +1,117 @@
+import asyncio
+from collections import Counter
+from datetime import datetime
+import json
+from types import SimpleNamespace
+
+import pytest
+from telegram import Bot, CallbackQuery, Chat, Message, Update
+from telegram import User as TelegramUser
+from telegram.request import BaseRequest
+
+from supperbot.commands.payment import ping_unpaid_users
+from supperbot.db import transactional
+from supperbot.enums import CallbackType, PaidStatus
+from supperbot.models import Order, SupperJio, User
+
+pytestmark = pytest.mark.asyncio
+
+HOST = 1
+UNPAID = [2, 3, 4, 5]
+PAID = 6
+NOT_ORDERED = 7
+# A user who blocked the bot, so cannot be pinged
+BLOCKED = 5
+
+
+class CountingRequest(BaseRequest):
+    """
+    Stands in for the Bot API, counting the calls made to each of its methods.
+    """
+
+    def __init__(self):
+        self.calls: Counter[str] = Counter()
+        self.chats: list[int] = []
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+
+        chat_id = parameters.get("chat_id")
+        if endpoint == "sendMessage":
+            self.chats.append(chat_id)
+        if chat_id == BLOCKED:
+            body = {
+                "ok": False,
+                "description": "Forbidden: bot was blocked by the user",
+            }
+            return 403, json.dumps(body).encode()
+
+        result = True
+        if endpoint == "sendMessage":
+            result = {
+                "message_id": sum(self.calls.values()),
+                "date": 0,
+                "chat": {"id": chat_id, "type": "private"},
+                "text": parameters["text"],
+            }
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+@transactional
+async def create_jio() -> int:
+    for user_id in [HOST, *UNPAID, PAID, NOT_ORDERED]:
+        await User.upsert(user_id, f"User {user_id}", user_id)
+    jio = await SupperJio.create(HOST, "McDonald's", "Supper tonight")
+
+    for user_id in [*UNPAID, PAID, NOT_ORDERED]:
+        order = await Order.create_order(jio_id=jio.id, user_id=user_id)
+        # Each order message was sent before, and has buttons to be removed
+        await order.update(message_id=100 + user_id)
+        if user_id != NOT_ORDERED:
+            await order.add_food("McSpicy")
+        if user_id == PAID:
+            await order.update(paid_status=PaidStatus.PAID)
+    return jio.id
+
+
+async def test_ping_sends_a_single_message_to_each_unpaid_user(database):
+    jio_id = await create_jio()
+    request = CountingRequest()
+    bot = Bot("123:token", request=request)
+
+    host = TelegramUser(HOST, "Host", False)
+    chat = Chat(HOST, Chat.PRIVATE)
+    message = Message(1, datetime.now(), chat, from_user=host)
+    query = CallbackQuery(
+        "1", host, "1", message=message, data=f"{CallbackType.PING_ALL_UNPAID}:{jio_id}"
+    )
+    for obj in (chat, message, query):
+        obj.set_bot(bot)
+
+    deferred = []
+    application = SimpleNamespace(
+        create_task=lambda coroutine: deferred.append(asyncio.create_task(coroutine))
+    )
+    context = SimpleNamespace(bot=bot, application=application)
+    await ping_unpaid_users(Update(1, callback_query=query), context)
+
+    await asyncio.gather(*deferred)
+
+    # A message to each unpaid user and the list of pinged users to the host, then the
+    # buttons of the previous order messages of the users reached are removed
+    reached = len(UNPAID) - 1
+    assert request.calls == {
+        "answerCallbackQuery": 1,
+        "sendMessage": len(UNPAID) + 1,
+        "editMessageReplyMarkup": reached,
+    }
+    assert sorted(request.chats[:-1]) == UNPAID
+    assert request.chats[-1] == HOST
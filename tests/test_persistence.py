@@ -0,0 +1,24 @@
+import pytest
+
+from supperbot.enums import CallbackType
+from supperbot.persistence import SQLPersistence
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_conversations_and_user_data_are_restored(database, upsert_support):
+    persistence = SQLPersistence(database, update_interval=60)
+    await persistence.update_conversation("ordering", (1, 1), CallbackType.ADD_ORDER)
+    await persistence.update_conversation("ordering", (2, 2), "other state")
+    await persistence.update_user_data(1, {"current_jio": 5})
+    await persistence.update_user_data(2, {"current_jio": 6})
+    # Writing again replaces the stored values
+    await persistence.update_conversation("ordering", (2, 2), None)
+    await persistence.update_user_data(1, {"current_jio": 7})
+    await persistence.drop_user_data(2)
+
+    restored = SQLPersistence(database, update_interval=60)
+    assert await restored.get_conversations("ordering") == {
+        (1, 1): CallbackType.ADD_ORDER
+    }
+    assert await restored.get_user_data() == {1: {"current_jio": 7}}
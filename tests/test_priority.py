@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from supperbot.priority import (
+    Priority,
+    PriorityGate,
+    current_priority,
+    request_priority,
+)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def queue(gate: PriorityGate, order: list[str], *requests: tuple[str, Priority]):
+    """
+    Queues the requests for a slot of the gate, in the given order. Each request
+    records its name once given a slot, and releases the slot straight away.
+    """
+
+    async def request(name: str, priority: Priority) -> None:
+        async with gate.slot(priority):
+            order.append(name)
+
+    tasks = []
+    for name, priority in requests:
+        tasks.append(asyncio.create_task(request(name, priority)))
+        await settle()
+    return tasks
+
+
+def test_gate_needs_a_slot():
+    with pytest.raises(ValueError):
+        PriorityGate(0)
+
+
+@pytest.mark.asyncio
+async def test_waiting_requests_are_served_in_order_of_priority():
+    gate = PriorityGate(1)
+    order = []
+    await gate.acquire(Priority.NORMAL)
+
+    tasks = await queue(
+        gate,
+        order,
+        ("bulk 1", Priority.BULK),
+        ("normal 1", Priority.NORMAL),
+        ("bulk 2", Priority.BULK),
+        ("interactive", Priority.INTERACTIVE),
+        ("normal 2", Priority.NORMAL),
+    )
+    assert gate.depth(Priority.BULK) == 2
+    assert gate.depth(Priority.NORMAL) == 2
+    assert gate.depth(Priority.INTERACTIVE) == 1
+
+    gate.release()
+    await asyncio.gather(*tasks)
+    assert order == ["interactive", "normal 1", "normal 2", "bulk 1", "bulk 2"]
+    assert all(gate.depth(priority) == 0 for priority in Priority)
+
+
+@pytest.mark.asyncio
+async def test_requests_do_not_wait_while_slots_are_free():
+    gate = PriorityGate(2)
+    order = []
+
+    await asyncio.gather(
+        *await queue(gate, order, ("bulk", Priority.BULK), ("normal", Priority.NORMAL))
+    )
+    assert order == ["bulk", "normal"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_request_passes_its_turn_on():
+    gate = PriorityGate(1)
+    order = []
+    await gate.acquire(Priority.NORMAL)
+
+    cancelled, waiting = await queue(
+        gate, order, ("cancelled", Priority.INTERACTIVE), ("waiting", Priority.BULK)
+    )
+    cancelled.cancel()
+    await settle()
+    assert gate.depth(Priority.INTERACTIVE) == 0
+
+    gate.release()
+    await waiting
+    assert order == ["waiting"]
+
+    # The slot is free again once every request released it
+    await asyncio.wait_for(gate.acquire(Priority.BULK), timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_priority_is_inherited_by_created_tasks():
+    async def priority() -> Priority:
+        return current_priority()
+
+    assert current_priority() == Priority.NORMAL
+    with request_priority(Priority.BULK):
+        assert await asyncio.create_task(priority()) == Priority.BULK
+    assert current_priority() == Priority.NORMAL
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+
+import defaultconfig
+from supperbot.ratelimiter import ChatAwareRateLimiter
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_limiter(**kwargs) -> ChatAwareRateLimiter:
+    limits = {
+        "overall": (100, 1),
+        "group": (2, 0.2),
+        "private": (1, 0.1),
+        "max_retries": 1,
+        "concurrency": 10,
+    }
+    return ChatAwareRateLimiter(**{**limits, **kwargs})
+
+
+async def request_times(limiter: ChatAwareRateLimiter, *chat_ids: int) -> list[float]:
+    """
+    Makes a request to each chat concurrently, and returns how long after the start
+    each request was made.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def callback():
+        return loop.time() - start
+
+    return await asyncio.gather(
+        *(
+            limiter.process_request(
+                callback, (), {}, "sendMessage", {"chat_id": chat_id}, None
+            )
+            for chat_id in chat_ids
+        )
+    )
+
+
+async def test_requests_to_a_private_chat_are_spaced_out():
+    first, second = await request_times(make_limiter(), 1, 1)
+
+    assert first < 0.05
+    assert second >= 0.08
+
+
+async def test_private_chats_allow_a_short_burst_of_requests():
+    limiter = make_limiter(private=defaultconfig.RATE_LIMIT_PRIVATE)
+    times = await request_times(limiter, 1, 1, 1)
+
+    assert max(times) < 0.05
+
+
+async def test_private_chats_are_limited_separately():
+    times = await request_times(make_limiter(), 1, 2, 3)
+
+    assert max(times) < 0.05
+
+
+async def test_groups_allow_a_burst_of_requests():
+    times = sorted(await request_times(make_limiter(), -1, -1, -1))
+
+    assert times[1] < 0.05
+    assert times[2] >= 0.08
+
+
+async def test_overall_limit_applies_across_chats():
+    times = sorted(await request_times(make_limiter(overall=(2, 0.2)), 1, 2, 3))
+
+    assert times[1] < 0.05
+    assert times[2] >= 0.08
+
+
+async def test_retry_after_is_retried():
+    limiter = make_limiter()
+    calls = 0
+
+    async def callback():
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise RetryAfter(0)
+        return True
+
+    assert await limiter.process_request(callback, (), {}, "sendMessage", {}, None)
+    assert calls == 2
+
+
+async def test_retry_after_is_raised_after_the_maximum_number_of_retries():
+    limiter = make_limiter()
+    calls = 0
+
+    async def callback():
+        nonlocal calls
+        calls += 1
+        raise RetryAfter(0)
+
+    with pytest.raises(RetryAfter):
+        await limiter.process_request(callback, (), {}, "sendMessage", {}, None)
+    assert calls == 2
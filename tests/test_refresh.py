@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from supperbot import refresh
+from supperbot.refresh import RefreshScheduler
+
+pytestmark = pytest.mark.asyncio
+
+DELAY = 0.01
+
+
+class Refreshes:
+    """
+    Stands in for refreshing the messages of a jio, which takes until it is released.
+    """
+
+    def __init__(self):
+        self.started: list[int] = []
+        self.running: set[int] = set()
+        self.overlapped = False
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, jio_id: int, bot) -> None:
+        self.overlapped |= jio_id in self.running
+        self.running.add(jio_id)
+        self.started.append(jio_id)
+        try:
+            await self.release.wait()
+        finally:
+            self.running.discard(jio_id)
+
+
+@pytest.fixture
+def refreshes(monkeypatch) -> Refreshes:
+    refreshes = Refreshes()
+    monkeypatch.setattr(refresh, "_refresh", refreshes)
+    return refreshes
+
+
+async def wait_for_refreshes(scheduler: RefreshScheduler) -> None:
+    await asyncio.sleep(DELAY * 3)
+    while scheduler._tasks:
+        await asyncio.wait(list(scheduler._tasks.values()))
+
+
+async def test_changes_are_coalesced_into_a_single_refresh(refreshes):
+    scheduler = RefreshScheduler(DELAY)
+    for _ in range(5):
+        scheduler.schedule(1, None)
+
+    assert refreshes.started == []
+    await wait_for_refreshes(scheduler)
+    assert refreshes.started == [1]
+
+
+async def test_jios_are_refreshed_separately(refreshes):
+    scheduler = RefreshScheduler(DELAY)
+    scheduler.schedule(1, None)
+    scheduler.schedule(2, None)
+    scheduler.schedule(1, None)
+
+    await wait_for_refreshes(scheduler)
+    assert sorted(refreshes.started) == [1, 2]
+
+
+async def test_change_during_a_refresh_schedules_another(refreshes):
+    scheduler = RefreshScheduler(DELAY)
+    refreshes.release.clear()
+    scheduler.schedule(1, None)
+    await asyncio.sleep(DELAY * 3)
+    assert refreshes.running == {1}
+
+    # The second refresh waits for the first, so that it is the last to edit
+    scheduler.schedule(1, None)
+    await asyncio.sleep(DELAY * 3)
+    assert refreshes.started == [1]
+
+    refreshes.release.set()
+    await wait_for_refreshes(scheduler)
+    assert refreshes.started == [1, 1]
+    assert not refreshes.overlapped
+
+
+async def test_failed_refresh_does_not_stop_later_refreshes(monkeypatch):
+    calls = []
+
+    async def failing(jio_id: int, bot) -> None:
+        calls.append(jio_id)
+        if len(calls) == 1:
+            raise RuntimeError("Database is locked")
+
+    monkeypatch.setattr(refresh, "_refresh", failing)
+    scheduler = RefreshScheduler(DELAY)
+
+    scheduler.schedule(1, None)
+    await wait_for_refreshes(scheduler)
+    scheduler.schedule(1, None)
+    await wait_for_refreshes(scheduler)
+
+    assert calls == [1, 1]
@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import event
+
+from supperbot.db import transactional
+from supperbot.models import Order, SupperJio, User
+
+pytestmark = pytest.mark.asyncio
+
+
+@transactional
+async def create_jio(participants: int) -> int:
+    jio = await SupperJio.create(1, "McDonald's", "Supper tonight")
+    for user_id in range(1, participants + 1):
+        await User.upsert(user_id, f"User {user_id}", user_id)
+        order = await Order.create_order(jio_id=jio.id, user_id=user_id)
+        await order.add_food(f"McSpicy {user_id}")
+    return jio.id
+
+
+@transactional
+async def render(jio_id: int) -> list[str]:
+    snapshot = (await SupperJio.get_jio(jio_id)).snapshot()
+    return [snapshot.message, *(order.message for order in snapshot.orders)]
+
+
+async def count_render_queries(database, participants: int) -> int:
+    jio_id = await create_jio(participants)
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(database.sync_engine, "before_cursor_execute", record)
+    try:
+        messages = await render(jio_id)
+    finally:
+        event.remove(database.sync_engine, "before_cursor_execute", record)
+
+    assert len(messages) == participants + 1
+    return len(statements)
+
+
+async def test_rendering_issues_constant_number_of_queries(database):
+    few = await count_render_queries(database, 2)
+    many = await count_render_queries(database, 80)
+
+    assert few == many == 3
@@ -0,0 +1,30 @@
+import importlib.util
+
+import pytest
+
+from supperbot.transport import PooledHTTPXRequest
+
+
+def make_request(http2: bool) -> PooledHTTPXRequest:
+    return PooledHTTPXRequest(
+        "bot",
+        connection_pool_size=4,
+        keepalive_expiry=60,
+        http2=http2,
+        timeout=10,
+        pool_timeout=5,
+    )
+
+
+def test_http2_without_h2_fails_on_start(monkeypatch):
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None)
+
+    with pytest.raises(RuntimeError, match="h2"):
+        make_request(http2=True)
+    make_request(http2=False)
+
+
+def test_http2_with_h2():
+    pytest.importorskip("h2")
+
+    assert make_request(http2=True)._client is not None
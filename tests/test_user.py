@@ -0,0 +1,48 @@
+import pytest
+from sqlalchemy import event, select
+
+from supperbot.db import transactional
+from supperbot.models import User
+
+
+async def stored_users(database) -> list[tuple]:
+    async with database.connect() as conn:
+        users = User.__table__
+        return list(await conn.execute(select(users).order_by(users.c.id)))
+
+
+async def count_upsert_queries(database, display_name: str) -> int:
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(database.sync_engine, "before_cursor_execute", record)
+    try:
+        await transactional(User.upsert)(1, display_name, 10)
+    finally:
+        event.remove(database.sync_engine, "before_cursor_execute", record)
+
+    return len([s for s in statements if "users" in s])
+
+
+@pytest.mark.asyncio
+async def test_recently_stored_users_are_not_written_again(database):
+    assert await count_upsert_queries(database, "Alice") == 1
+    assert await count_upsert_queries(database, "Alice") == 0
+    assert await count_upsert_queries(database, "Alice Tan") == 1
+
+    assert await stored_users(database) == [(1, "Alice Tan", 10)]
+
+
+@pytest.mark.asyncio
+async def test_users_are_only_remembered_once_committed(database):
+    @transactional
+    async def upsert_then_fail():
+        await User.upsert(1, "Alice", 10)
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        await upsert_then_fail()
+
+    assert await count_upsert_queries(database, "Alice") == 1
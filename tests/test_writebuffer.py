@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event, text
+
+from supperbot.writebuffer import WriteBuffer
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture
+async def engine(database):
+    """
+    The test database, with a table of unique values.
+    """
+    async with database.begin() as conn:
+        await conn.execute(text("CREATE TABLE items (value INTEGER UNIQUE)"))
+    return database
+
+
+@pytest.fixture
+def commits(engine) -> list[None]:
+    """
+    Records each transaction committed on the engine.
+    """
+    commits = []
+
+    def record(_):
+        commits.append(None)
+
+    event.listen(engine.sync_engine, "commit", record)
+    yield commits
+    event.remove(engine.sync_engine, "commit", record)
+
+
+def insert(value: int):
+    async def operation(conn) -> int:
+        await conn.execute(text("INSERT INTO items VALUES (:value)"), {"value": value})
+        return value
+
+    return operation
+
+
+async def stored(engine) -> list[int]:
+    async with engine.connect() as conn:
+        return sorted((await conn.scalars(text("SELECT value FROM items"))).all())
+
+
+async def test_limits_are_validated():
+    with pytest.raises(ValueError):
+        WriteBuffer(None, max_delay=-1, max_operations=1)
+    with pytest.raises(ValueError):
+        WriteBuffer(None, max_delay=0, max_operations=0)
+
+
+async def test_concurrent_writes_are_committed_together(engine, commits):
+    buffer = WriteBuffer(engine, max_delay=0.01, max_operations=100)
+
+    results = await asyncio.gather(*(buffer.submit(insert(i)) for i in range(10)))
+
+    assert results == list(range(10))
+    assert await stored(engine) == list(range(10))
+    assert len(commits) == 1
+
+
+async def test_buffer_is_flushed_once_full(engine, commits):
+    # The delay is never reached, so the writes can only be flushed once full
+    buffer = WriteBuffer(engine, max_delay=60, max_operations=3)
+
+    writes = [asyncio.create_task(buffer.submit(insert(i))) for i in range(2)]
+    await asyncio.sleep(0.05)
+    assert not any(write.done() for write in writes)
+
+    writes.append(asyncio.create_task(buffer.submit(insert(2))))
+    assert await asyncio.wait_for(asyncio.gather(*writes), timeout=5) == [0, 1, 2]
+    assert len(commits) == 1
+
+
+async def test_buffer_is_flushed_after_the_delay(engine, commits):
+    buffer = WriteBuffer(engine, max_delay=0.05, max_operations=100)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    assert await buffer.submit(insert(1)) == 1
+    assert loop.time() - start >= 0.05
+    assert len(commits) == 1
+
+
+async def test_buffer_can_be_flushed_early(engine):
+    buffer = WriteBuffer(engine, max_delay=60, max_operations=100)
+
+    write = asyncio.create_task(buffer.submit(insert(1)))
+    await asyncio.sleep(0)
+    await buffer.flush()
+
+    assert await asyncio.wait_for(write, timeout=5) == 1
+
+
+async def test_failing_write_does_not_fail_the_rest_of_its_batch(engine):
+    buffer = WriteBuffer(engine, max_delay=0.01, max_operations=100)
+
+    # The second insert of 1 violates the unique constraint
+    results = await asyncio.gather(
+        *(buffer.submit(insert(value)) for value in (1, 2, 1, 3)),
+        return_exceptions=True,
+    )
+
+    assert results[:2] == [1, 2] and results[3] == 3
+    assert isinstance(results[2], Exception)
+    assert await stored(engine) == [1, 2, 3]